@@ -15,7 +15,7 @@ class Drawable:
 
     @abc.abstractmethod
     def draw(self, surface, dt):
-        """Draw self to surface using time step dt"""
+        """Draw self to surface using time step dt. Returns the list of pygame.Rect drawn over"""
         return
 
 
@@ -28,5 +28,5 @@ class Entity(Drawable):
         return 0
 
     @abc.abstractmethod
-    def act(self, actions, dt):
-        """Act based on actions and time step"""
+    def act(self, actions, dt, sense=True):
+        """Act based on actions and time step. Observations only need updating if sense is set"""
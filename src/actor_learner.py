@@ -0,0 +1,229 @@
+# Asynchronous training: actor threads play games while a learner thread trains the agent on what they collect
+import contextlib
+import queue
+import threading
+import time
+
+import numpy as np
+
+from src.racecar_game import Game, Controls, OBS_SIZE
+from src.recorder import Recorder
+
+# Reward for the transition that ends an episode, as in main.ai_game
+DONE_REWARD = -10
+# Transitions an actor collects before handing them to the learner in one piece
+CHUNK_SIZE = 64
+# Seconds blocking queue operations wait before checking whether to stop
+POLL_INTERVAL = 0.1
+# Most replays per collected transition, the ratio of the synchronous loop in main.ai_game
+REPLAY_RATIO = 1.0
+
+
+class ActorLearner:
+    """
+    Actors step their own headless Game and act with a private NumPy copy of the policy. They push transitions in
+    chunks onto a bounded queue. The learner drains the queue into the agent's replay memory and calls replay in a
+    loop, publishing the trained weights to the actors every publish_interval replays. Keras and NumPy release the GIL
+    in their heavy parts, so simulation and training overlap instead of taking turns. The replay memory is only
+    touched by the learner, and a full queue makes actors wait, so they can't run arbitrarily far ahead. Nor can the
+    learner: it waits for new transitions rather than replay more than replay_ratio times per transition, and epsilon
+    decays per transition collected, not per replay.
+    """
+
+    def __init__(self, agent, actors=2, batch_size=32, publish_interval=10, queue_size=16, level='level1',
+                 action_repeat=1, seed=None, record=None, replay_ratio=REPLAY_RATIO):
+        """
+        :param agent: Agent to train, see src.backends
+        :param actors: Number of actor threads
+        :param batch_size: Replay batch size
+        :param publish_interval: Replays between publishing weights to the actors
+        :param queue_size: Chunks the queue holds before actors block
+        :param level: Level the actors play
+        :param action_repeat: Physics steps per decision, see Game
+        :param seed: Seed for the actors' exploration
+        :param record: Path prefix to log the actors' games to, actor i writes to record.i, see src.recorder
+        :param replay_ratio: Most replays per transition collected
+        """
+        self.agent = agent
+        self.batch_size = batch_size
+        self.publish_interval = publish_interval
+        self.queue = queue.Queue(queue_size)
+        self.level = level
+        self.action_repeat = action_repeat
+        self.record = record
+        self.replay_ratio = replay_ratio
+        self.seeds = np.random.SeedSequence(seed).spawn(actors)
+
+        # Weights are published as (version, weights). Replacing the tuple is atomic, so actors never see a torn update
+        self.published = (0, agent.get_weights())
+        self.replays = 0
+        self.transitions = 0
+        # Per actor, so that every counter has a single writer
+        self.steps = [0] * actors
+        self.episodes = [0] * actors
+
+        self._stop = threading.Event()
+        self._errors = []
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._guard, args=(self._actor, i), daemon=True)
+                         for i in range(len(self.seeds))]
+        self._threads.append(threading.Thread(target=self._guard, args=(self._learner,), daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stop and join all threads
+        :raises: The first exception raised in any thread
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._errors:
+            raise self._errors[0]
+
+    def run(self, seconds=None, replays=None):
+        """
+        Train until a time limit or number of replays is reached, or a thread fails
+        :return: stats
+        """
+        self.start()
+        end = None if seconds is None else time.perf_counter() + seconds
+        try:
+            while not self._stop.is_set():
+                if end is not None and time.perf_counter() >= end:
+                    break
+                if replays is not None and self.replays >= replays:
+                    break
+                time.sleep(POLL_INTERVAL / 10)
+        finally:
+            self.stop()
+        return self.stats
+
+    @property
+    def running(self):
+        # False once stopped, including by a failing thread
+        return bool(self._threads) and not self._stop.is_set()
+
+    @property
+    def stats(self):
+        return {
+            'steps': sum(self.steps),
+            'episodes': sum(self.episodes),
+            'transitions': self.transitions,
+            'replays': self.replays,
+            'weights_version': self.published[0],
+            'epsilon': self.agent.epsilon,
+        }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _guard(self, target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _put(self, item):
+        # Blocks while the queue is full, unless stopped
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def _actor(self, index):
+        rng = np.random.default_rng(self.seeds[index])
+        recorder = Recorder('{}.{}'.format(self.record, index)) if self.record else None
+        with recorder or contextlib.nullcontext():
+            self._play(index, rng, Game(init_graphics=False, level=self.level, action_repeat=self.action_repeat,
+                                        recorder=recorder))
+
+    def _play(self, index, rng, game):
+        policy = self.agent.policy.copy()
+        version = 0
+        chunk = _Chunk(CHUNK_SIZE, OBS_SIZE)
+        state = game.car.observation.copy()
+        while not self._stop.is_set():
+            published_version, weights = self.published
+            if published_version != version:
+                policy.set_weights(weights)
+                version = published_version
+
+            if rng.random() <= self.agent.epsilon:
+                action = int(rng.integers(self.agent.action_shape))
+            else:
+                action = int(np.argmax(policy(state)[0]))
+            observation, reward, done = game.act([Controls(action)])
+            chunk.add(state, action, reward if not done else DONE_REWARD, observation, done)
+            # After a reset the car's buffer already holds the first observation of the next episode
+            state = game.car.observation.copy()
+            self.steps[index] += 1
+            self.episodes[index] += done
+            if chunk.full:
+                self._put(chunk.arrays())
+                chunk.clear()
+
+    def _learner(self):
+        while not self._stop.is_set():
+            # Wait for data while there isn't enough to train on, or the transitions so far have been replayed enough
+            self._drain(block=not self._can_replay())
+            if not self._can_replay():
+                continue
+            self.agent.replay(self.batch_size, decay=False)
+            self.replays += 1
+            if self.replays % self.publish_interval == 0:
+                self.published = (self.published[0] + 1, self.agent.get_weights())
+
+    def _can_replay(self):
+        return len(self.agent.memory) >= self.batch_size and self.replays < self.transitions * self.replay_ratio
+
+    def _drain(self, block):
+        try:
+            item = self.queue.get(timeout=POLL_INTERVAL) if block else self.queue.get_nowait()
+            while True:
+                self.agent.memory.extend(*item)
+                self.transitions += len(item[1])
+                self.agent.decay_epsilon(len(item[1]))
+                item = self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+class _Chunk:
+    # Preallocated transitions of one actor, handed over as a batch for ReplayBuffer.extend
+    def __init__(self, size, state_size):
+        self.states = np.zeros((size, state_size), dtype=np.float32)
+        self.actions = np.zeros(size, dtype=np.int64)
+        self.rewards = np.zeros(size, dtype=np.float32)
+        self.next_states = np.zeros((size, state_size), dtype=np.float32)
+        self.dones = np.zeros(size, dtype=np.bool_)
+        self.size = 0
+
+    @property
+    def full(self):
+        return self.size == len(self.actions)
+
+    def add(self, state, action, reward, next_state, done):
+        i = self.size
+        self.states[i], self.actions[i], self.rewards[i] = state, action, reward
+        self.next_states[i], self.dones[i] = next_state, done
+        self.size += 1
+
+    def arrays(self):
+        return (self.states[:self.size].copy(), self.actions[:self.size].copy(), self.rewards[:self.size].copy(),
+                self.next_states[:self.size].copy(), self.dones[:self.size].copy())
+
+    def clear(self):
+        self.size = 0
@@ -1,17 +1,23 @@
 import random
-from collections import deque
 
 import numpy as np
-from tensorflow.keras.layers import Dense
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.optimizers import Adam
+
+from src.inference import NumpyMLP
+from src.replay import ReplayBuffer, PrioritizedReplayBuffer
 
 
 class CarAgent:
-    def __init__(self, state_shape, action_shape):
+    # Keras only saves weights to files named like this
+    WEIGHTS_SUFFIX = '.weights.h5'
+
+    def __init__(self, state_shape, action_shape, target_update_interval=100, memory_size=2000, memmap_dir=None,
+                 prioritized=False):
         self.state_shape = state_shape
         self.action_shape = action_shape
-        self.memory = deque(maxlen=2000)
+        # Prioritized replay samples by TD error, so rare transitions like crashes are replayed far more often
+        self.prioritized = prioritized
+        memory = PrioritizedReplayBuffer if prioritized else ReplayBuffer
+        self.memory = memory(memory_size, state_shape, memmap_dir=memmap_dir)
 
         # Discount factor
         self.gamma = 0.95
@@ -22,45 +28,102 @@ class CarAgent:
 
         self.learning_rate = 0.001
 
+        # The target network gives the bootstrapped Q-values in replay, and is synced to the trained model every
+        # target_update_interval calls to replay
+        self.target_update_interval = target_update_interval
+        self.replays = 0
+
         self.model = self._build_model()
+        # Keras is only used for training. Acting and the Q-value estimates in replay go through NumPy copies of the
+        # weights, refreshed after every update. The target network only exists as such a copy
+        self.policy = NumpyMLP.from_keras(self.model)
+        self.target_policy = self.policy.copy()
 
     def _build_model(self):
+        # TensorFlow takes seconds to import, so it's only loaded once a model is actually built
+        from tensorflow.keras.layers import Dense
+        from tensorflow.keras.models import Sequential
+        from tensorflow.keras.optimizers import Adam
+
         model = Sequential()
 
         model.add(Dense(24, input_dim=self.state_shape, activation='relu'))
         model.add(Dense(24, activation='relu'))
         model.add(Dense(self.action_shape, activation='linear'))
 
-        model.compile(loss='mse', optimizer=Adam(lr=self.learning_rate))
+        model.compile(loss='mse', optimizer=Adam(learning_rate=self.learning_rate))
 
         return model
 
+    def update_target_model(self):
+        self.target_policy.set_weights(self.model.get_weights())
+
+    def get_weights(self):
+        return self.model.get_weights()
+
+    def update_policy(self):
+        # Export the trained weights for acting
+        self.policy.set_weights(self.model.get_weights())
+
     def remember(self, state, action, reward, next_state, done):
-        self.memory.append((state, action, reward, next_state, done))
+        self.memory.append(state, action, reward, next_state, done)
 
     def act(self, state):
         if np.random.rand() <= self.epsilon:
             return random.randrange(self.action_shape)
-        act_values = self.model.predict(state)
-        return np.argmax(act_values[0])
-
-    def replay(self, batch_size):
-        minibatch = random.sample(self.memory, batch_size)
-
-        for state, action, reward, next_state, done in minibatch:
-            target = reward
-            if not done:
-                target = (reward + self.gamma * np.amax(self.model.predict(next_state)[0]))
-            target_f = self.model.predict(state)
-            target_f[0][action] = target
-
-            self.model.fit(state, target_f, epochs=1, verbose=1)
-
-        if self.epsilon > self.epsilon_min:
-            self.epsilon *= self.epsilon_decay
+        return int(np.argmax(self.policy(state)[0]))
+
+    def act_batch(self, states):
+        """
+        Epsilon-greedy actions for a batch of states, e.g. one per env of a VecGame
+        :param states: B x state_shape matrix
+        :return: B action indices
+        """
+        actions = np.argmax(self.policy(states), axis=1)
+        explore = np.random.rand(len(actions)) <= self.epsilon
+        actions[explore] = np.random.randint(self.action_shape, size=np.count_nonzero(explore))
+        return actions
+
+    def replay(self, batch_size, decay=True):
+        """
+        Train on a batch sampled from the replay memory
+        :param decay: Whether to decay epsilon once, see decay_epsilon
+        """
+        weights = None
+        if self.prioritized:
+            batch, indices, weights = self.memory.sample_weighted(batch_size)
+        else:
+            batch = self.memory.sample(batch_size)
+        states, actions, rewards, next_states, dones = batch
+
+        # One batched prediction for the current estimates and one for the bootstrapped targets
+        target_f = self.policy(states)
+        next_q = self.target_policy(next_states)
+        targets = rewards + self.gamma * np.amax(next_q, axis=1) * ~dones
+        rows = np.arange(batch_size)
+        if self.prioritized:
+            self.memory.update_priorities(indices, targets - target_f[rows, actions])
+        target_f[rows, actions] = targets
+
+        # fit sets up a data adapter and callbacks on every call, which costs far more than the step itself
+        self.model.train_on_batch(states, target_f, sample_weight=weights)
+        self.update_policy()
+
+        self.replays += 1
+        if self.replays % self.target_update_interval == 0:
+            self.update_target_model()
+
+        if decay:
+            self.decay_epsilon()
+
+    def decay_epsilon(self, steps=1):
+        # Decay exploration as if replay had run steps times
+        self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay ** steps)
 
     def load(self, name):
         self.model.load_weights(name)
+        self.update_policy()
+        self.update_target_model()
 
     def save(self, name):
         self.model.save_weights(name)
@@ -0,0 +1,32 @@
+# Agent implementations by name, imported only when used so that simulation-only code never loads their dependencies
+import importlib
+
+# Name: (module, class). An agent class is constructed as cls(state_shape, action_shape, **kwargs) and provides
+#   act(state) and act_batch(states)         epsilon-greedy actions for one state or a batch
+#   remember(state, action, reward, next_state, done) and replay(batch_size, decay=True)
+#   decay_epsilon(steps=1)                   what replay does to epsilon unless decay is False
+#   policy                                   callable from states to Q-values, with copy() and set_weights()
+#   get_weights(), save(name) and load(name)
+#   WEIGHTS_SUFFIX                           ending save requires of file names
+#   epsilon, memory and action_shape
+# and optionally saved_settings(name), the constructor keyword arguments needed to load a saved file
+BACKENDS = {
+    'keras': ('src.agent', 'CarAgent'),
+    'tabular': ('src.tabular', 'TabularAgent'),
+}
+DEFAULT_BACKEND = 'keras'
+
+
+def load_backend(name=DEFAULT_BACKEND):
+    """
+    :param name: Key in BACKENDS
+    :return: The agent class
+    """
+    if name not in BACKENDS:
+        raise ValueError('Unknown backend {}, choose from {}'.format(name, ', '.join(BACKENDS)))
+    module, attr = BACKENDS[name]
+    return getattr(importlib.import_module(module), attr)
+
+
+def create_agent(name, state_shape, action_shape, **kwargs):
+    return load_backend(name)(state_shape, action_shape, **kwargs)
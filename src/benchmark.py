@@ -0,0 +1,338 @@
+# Headless benchmarks of the simulation, sensing and training hot paths, written as JSON for comparing commits
+#
+#   python -m src.benchmark --output results.json
+#   python -m src.benchmark --quick --compare results.json
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# pygame greets on import, which would end up in front of the results on stdout
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from pygame.math import Vector2  # noqa: E402
+
+from src.collision import line_array, nearest_hits, segment_intersections  # noqa: E402
+from src.helpers import nearest_hit, segment_intersection  # noqa: E402
+from src.racecar_game import Game, Controls, OBS_SIZE  # noqa: E402
+from src.vec_game import VecGame  # noqa: E402
+
+# A metric is better when higher if its name ends in one of these, and when lower otherwise
+HIGHER_IS_BETTER = ('_per_s',)
+# Relative slowdown compare reports as a regression
+REGRESSION_THRESHOLD = 0.1
+REPLAY_BATCH_SIZES = (32, 64, 128, 256)
+
+
+def _best_time(fn, repeat):
+    # Shortest of several runs, the least disturbed by everything else running on the machine
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _latencies(fn, count):
+    # Milliseconds per call of fn
+    times = np.empty(count)
+    for i in range(count):
+        start = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - start
+    times *= 1000
+    return {'mean_ms': float(times.mean()), 'p50_ms': float(np.percentile(times, 50)),
+            'p95_ms': float(np.percentile(times, 95))}
+
+
+def _random_actions(rng, count):
+    return rng.choice(len(Controls), count, p=[0.7, 0.05, 0.15, 0.1])
+
+
+def bench_segment_intersection(quick):
+    """
+    One line against many walls, with the scalar helper in a loop and with the batched kernel. Uses the walls of level1
+    and a large random set
+    """
+    game = Game(init_graphics=False)
+    line = next(iter(game.car.lasers.values()))
+    line_arr = line_array([line])[:, 0]
+    rng = np.random.RandomState(0)
+    start = rng.uniform(0, 1000, (2, 2000 if quick else 20000))
+    random_walls = np.vstack((start, start + rng.uniform(-50, 50, start.shape)))
+    repeat = 3 if quick else 10
+
+    results = {}
+    for name, wall_array in (('level1', game.level.wall_array), ('random', random_walls)):
+        walls = [(Vector2(x1, y1), Vector2(x2, y2)) for x1, y1, x2, y2 in wall_array.T]
+        scalar = _best_time(lambda: [segment_intersection(line, wall) for wall in walls], repeat)
+        batched = _best_time(lambda: segment_intersections(line_arr, wall_array), repeat * 10)
+        results[name] = {
+            'walls': len(walls),
+            'scalar_pairs_per_s': len(walls) / scalar,
+            'batched_pairs_per_s': len(walls) / batched,
+        }
+    return results
+
+
+def bench_nearest_hits(quick):
+    """
+    Nearest hit of a few lines among many random walls, with the scalar helper in a loop and with the batched kernel
+    """
+    rng = np.random.RandomState(0)
+    lines = rng.uniform(0, 1000, (4, 10))
+    walls = rng.uniform(0, 1000, (4, 1000))
+    scalar_lines = [(Vector2(x1, y1), Vector2(x2, y2)) for x1, y1, x2, y2 in lines.T]
+    scalar_walls = [(Vector2(x1, y1), Vector2(x2, y2)) for x1, y1, x2, y2 in walls.T]
+    repeat = 3 if quick else 10
+
+    scalar = _best_time(lambda: [nearest_hit(line, scalar_walls) for line in scalar_lines], repeat)
+    batched = _best_time(lambda: nearest_hits(lines, walls), repeat * 10)
+    pairs = lines.shape[1] * walls.shape[1]
+    return {
+        'pairs': pairs,
+        'scalar_pairs_per_s': pairs / scalar,
+        'batched_pairs_per_s': pairs / batched,
+    }
+
+
+def bench_car_act(quick):
+    """
+    Car.act alone: physics, swept collision and sensing, without the Game around it. Collision through segment tests
+    and through the distance field
+    """
+    results = {}
+    for key, distance_field in (('steps_per_s', False), ('field_steps_per_s', True)):
+        game = Game(init_graphics=False, distance_field=distance_field)
+        car = game.car
+        steps = 300 if quick else 3000
+        actions = [[Controls(a)] for a in _random_actions(np.random.RandomState(0), steps)]
+        dt = game.clock.physics_dt
+
+        def run():
+            for action in actions:
+                car.act(action, dt)
+                if car.done:
+                    game.reset()
+        results[key] = steps / _best_time(run, 3)
+    return results
+
+
+def bench_game_episodes(quick):
+    """
+    Whole episodes through Game.act with a random policy, with and without action repeat
+    """
+    results = {}
+    for repeat in (1, 4):
+        game = Game(init_graphics=False, action_repeat=repeat)
+        rng = np.random.RandomState(0)
+        episodes = 3 if quick else 20
+        calls = 0
+        start = time.perf_counter()
+        for _ in range(episodes):
+            done = False
+            while not done:
+                _, _, done = game.act([Controls(_random_actions(rng, 1)[0])])
+                calls += 1
+        elapsed = time.perf_counter() - start
+        results['repeat{}'.format(repeat)] = {
+            'episodes_per_s': episodes / elapsed,
+            'decisions_per_s': calls / elapsed,
+            'physics_steps_per_s': calls * repeat / elapsed,
+        }
+    return results
+
+
+def bench_vec_game(quick):
+    """
+    VecGame.act over a batch of cars, with collision through segment tests and through the distance field
+    """
+    results = {}
+    for n in ((64,) if quick else (64, 256, 1024)):
+        results['cars{}'.format(n)] = {}
+        for key, distance_field in (('car_steps_per_s', False), ('field_car_steps_per_s', True)):
+            vec = VecGame(n, distance_field=distance_field)
+            actions = _random_actions(np.random.RandomState(0), n)
+            steps = 10 if quick else 50
+            vec.act(actions)
+            elapsed = _best_time(lambda: [vec.act(actions) for _ in range(steps)], 3)
+            results['cars{}'.format(n)][key] = n * steps / elapsed
+    return results
+
+
+def bench_agent_act(quick):
+    """
+    Latency of CarAgent.act on a single observation, through the network
+    """
+    from src.agent import CarAgent
+    agent = CarAgent(OBS_SIZE, len(Controls))
+    # Always take the network path
+    agent.epsilon = 0
+    state = np.random.RandomState(0).rand(1, OBS_SIZE).astype(np.float32)
+    agent.act(state)
+    return _latencies(lambda: agent.act(state), 20 if quick else 200)
+
+
+def bench_agent_replay(quick):
+    """
+    CarAgent.replay throughput for several batch sizes
+    """
+    from src.agent import CarAgent
+    results = {}
+    rng = np.random.RandomState(0)
+    for batch_size in REPLAY_BATCH_SIZES[:2] if quick else REPLAY_BATCH_SIZES:
+        agent = CarAgent(OBS_SIZE, len(Controls))
+        n = 2 * max(REPLAY_BATCH_SIZES)
+        agent.memory.extend(rng.rand(n, OBS_SIZE), rng.randint(len(Controls), size=n), rng.rand(n),
+                            rng.rand(n, OBS_SIZE), rng.rand(n) < 0.1)
+        agent.replay(batch_size)
+        replays = 3 if quick else 20
+        elapsed = _best_time(lambda: [agent.replay(batch_size) for _ in range(replays)], 3)
+        results['batch{}'.format(batch_size)] = {
+            'replays_per_s': replays / elapsed,
+            'transitions_per_s': replays * batch_size / elapsed,
+        }
+    return results
+
+
+def bench_tabular_replay(quick):
+    """
+    TabularAgent.replay throughput for several batch sizes
+    """
+    from src.tabular import TabularAgent
+    results = {}
+    rng = np.random.RandomState(0)
+    n = 1 << 16
+    agent = TabularAgent(OBS_SIZE, len(Controls), memory_size=n, seed=0)
+    agent.memory.extend(rng.uniform(0, 300, (n, OBS_SIZE)), rng.randint(len(Controls), size=n), rng.rand(n),
+                        rng.uniform(0, 300, (n, OBS_SIZE)), rng.rand(n) < 0.1)
+    for batch_size in (32, 1024) if quick else (32, 1024, 16384):
+        replays = 5 if quick else 50
+        elapsed = _best_time(lambda: [agent.replay(batch_size) for _ in range(replays)], 3)
+        results['batch{}'.format(batch_size)] = {
+            'replays_per_s': replays / elapsed,
+            'transitions_per_s': replays * batch_size / elapsed,
+        }
+    return results
+
+
+# Benchmarks by name, with the optional module each needs
+BENCHMARKS = {
+    'segment_intersection': (bench_segment_intersection, None),
+    'nearest_hits': (bench_nearest_hits, None),
+    'car_act': (bench_car_act, None),
+    'game_episodes': (bench_game_episodes, None),
+    'vec_game': (bench_vec_game, None),
+    'agent_act': (bench_agent_act, 'tensorflow'),
+    'agent_replay': (bench_agent_replay, 'tensorflow'),
+    'tabular_replay': (bench_tabular_replay, None),
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, quick=False):
+    """
+    Run benchmarks
+    :param names: Names in BENCHMARKS to run, all if None
+    :param quick: Fewer iterations, for smoke tests
+    :return: JSON-serializable results. Benchmarks whose dependencies are missing are reported as skipped
+    """
+    results = {
+        'meta': {
+            'commit': _git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'quick': quick,
+        },
+        'benchmarks': {},
+    }
+    for name in names or BENCHMARKS:
+        fn, requires = BENCHMARKS[name]
+        if requires is not None and importlib.util.find_spec(requires) is None:
+            results['benchmarks'][name] = {'skipped': '{} is not installed'.format(requires)}
+            continue
+        results['benchmarks'][name] = fn(quick)
+    return results
+
+
+def _flatten(results, prefix=''):
+    # Nested metrics as {'benchmark.group.metric': value}
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(baseline, results, threshold=REGRESSION_THRESHOLD):
+    """
+    Metrics that got worse by more than threshold, relative to the baseline
+    :return: List of (metric, baseline value, new value)
+    """
+    old, new = _flatten(baseline['benchmarks']), _flatten(results['benchmarks'])
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        if key.endswith(HIGHER_IS_BETTER):
+            worse = new[key] < old[key] * (1 - threshold)
+        elif key.endswith('_ms'):
+            worse = new[key] > old[key] * (1 + threshold)
+        else:
+            continue
+        if worse:
+            regressions.append((key, old[key], new[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.benchmark', description='Run the benchmark suite.')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='Benchmarks to run, all by default: {}'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--quick', action='store_true', help='Fewer iterations')
+    parser.add_argument('--output', help='File to write the JSON results to, stdout if not given')
+    parser.add_argument('--compare', metavar='BASELINE', help='Results to compare with, fails on regressions')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='Relative slowdown counted as a regression')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmarks: {}'.format(', '.join(unknown)))
+
+    # Keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args.names, args.quick)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for key, old, new in regressions:
+            print('regression: {} {:.4g} -> {:.4g}'.format(key, old, new), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,112 +1,193 @@
 # Implementations of collision functions using numpy
 import numpy as np
 
+# Tolerance for the parametric intersection tests. Hits up to EPS outside either segment still count, so that rays
+# passing exactly through a shared wall corner are not lost to rounding, and lines whose directions have a normalized
+# cross product below EPS are treated as parallel.
+EPS = 1e-9
+# Largest number of line pairs nearest_hits tests in one array computation
+BLOCK_PAIRS = 1 << 15
 
-def segment_intersections(line: list, line_arr: np.array) -> np.array:
+
+def line_array(lines) -> np.array:
     """
-    Return points of intersection if they exist. Leave the other points at np.NaN
-    :param line: Line to find collisions of other lines with
-    :param line_arr: N lines in a 4xN matrix
-    :return: 2xN matrix containing
+    Convert lines given as pairs of points into the 4xN matrix used in this module
+    :param lines: Iterable of lines of format [(x1, y1), (x2, y2)]
+    :return: 4xN matrix with rows x1, y1, x2, y2
     """
-    # Intersection given infinite lines. Returned in the shape 2xN where both values are NaN if there is no intersection
-    # Elements are NaN if no intersection exists (e.g. the lines are parallel)
-    p: np.array = _intersection(line, line_arr)
-
-    # If any of the intersection coordinates are too big, set to NaN.
-    p[~np.isnan(p) & np.any(np.abs(p) > 1e5, axis=0)] = np.NaN
-
-    # Check that intersections are within the bounds of the main line and the other line
-    # First, make rectangular regions for each line, (xmin, xmax, ymin, ymax) as rows, lines as columns
-    main_region = (min(line[0:2]), max(line[0:2]), min(line[2:4]), max(line[2:4]))
-    other_regions = np.vstack((np.min(line_arr[0:2], axis=0), np.max(line_arr[0:2], axis=0),
-                               np.min(line_arr[2:4], axis=0), np.max(line_arr[2:4], axis=0)))
-
-    # TODO: Increase size of boxes if too small (horizontal line)
-
-    present_mask = ~np.isnan(p[0])
-    present = p[:, present_mask]
-    other_regions = other_regions[:, present_mask]
-
-    # print(present.shape, other_regions.shape)
+    return np.array([(p1[0], p1[1], p2[0], p2[1]) for p1, p2 in lines], dtype=float).reshape(-1, 4).T
 
-    present[:, (present[0] < main_region[0]) | (present[0] > main_region[1]) |  # Not within main x
-               (present[1] < main_region[2]) | (present[1] > main_region[3]) |  # Not within main y
-               (present[0] < other_regions[0]) | (present[0] > other_regions[1]) |  # Not within other x
-               (present[1] < other_regions[2]) | (present[1] > other_regions[3])  # Not within other y
-    ] = np.NaN
-    p[:, present_mask] = present
 
-    return p
-
-
-def _intersection(line: list, line_arr: np.array) -> np.array:
-    line_slope, line_int = _line_slope_intercept(line)
-    slope_int = _slope_and_intercept(line_arr)
-    # print(line_slope, line_int, slope_int)
-
-    intersections = np.full(fill_value=np.inf, shape=(2, line_arr.shape[1]))
-
-    # Find when the main line or the other lines are vertical
-    line_vertical = line_slope is None
-    other_vertical = np.isnan(slope_int[0])
-
-    # All elements that have been dealt with
-    dealt = np.full(shape=intersections.shape[1], fill_value=False)
-
-    # Lines are parallel, don't need to handle this case
-    parallel = line_slope == slope_int[0]
-    intersections[:, parallel] = np.NaN
-    dealt |= parallel
+def transform_lines(local: np.array, cos, sin, offset, out: np.array, scratch: np.array = None) -> np.array:
+    """
+    Rotate and then translate lines into a preallocated line array. Everything is computed in place, so posing a car's
+    geometry every step doesn't allocate.
+    :param local: Lines in a 4x... matrix, in local coordinates
+    :param cos: Cosine of the rotation angle, broadcast against the lines
+    :param sin: Sine of the rotation angle, broadcast against the lines
+    :param offset: Translation (x, y), each broadcast against the lines
+    :param out: 4x... matrix to write the lines to
+    :param scratch: 2x... matrix of the shape of half of out for intermediate results, allocated if None
+    :return: out
+    """
+    x, y = local[0::2], local[1::2]
+    out_x, out_y = out[0::2], out[1::2]
+    if scratch is None:
+        scratch = np.empty_like(out_x)
+    np.multiply(x, cos, out=out_x)
+    np.multiply(y, sin, out=scratch)
+    out_x -= scratch
+    out_x += offset[0]
+    np.multiply(x, sin, out=out_y)
+    np.multiply(y, cos, out=scratch)
+    out_y += scratch
+    out_y += offset[1]
+    return out
+
+
+def segment_params(lines: np.array, others: np.array, eps: float = EPS) -> np.array:
+    """
+    Parametric segment intersection kernel. Line a + t * r meets other c + u * s where
+        t = (c - a) x s / (r x s),  u = (c - a) x r / (r x s)
+    and both are within [0, 1] if the segments intersect. No special cases are needed for vertical lines.
+    Both arguments have four rows x1, y1, x2, y2, and the remaining dimensions are broadcast against each other, so
+    a 4xLx1 and a 4x1xN argument test all pairs, while two 4xN arguments test pairwise.
+    :param lines: Lines to find the hit parameter along
+    :param others: Lines to intersect with
+    :param eps: Tolerance, see EPS
+    :return: t along lines at the intersection, np.inf where the segments don't intersect or are parallel
+    """
+    rx, ry = lines[2] - lines[0], lines[3] - lines[1]
+    sx, sy = others[2] - others[0], others[3] - others[1]
+    qx, qy = others[0] - lines[0], others[1] - lines[1]
 
-    # No vertical lines, use traditional formula
-    no_vert = ~((line_slope is None) | np.isnan(slope_int[0]))
-    no_vert_slope_int = slope_int[:, no_vert]
+    denom = rx * sy - ry * sx
+    parallel = np.abs(denom) <= eps * np.hypot(rx, ry) * np.hypot(sx, sy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (qx * sy - qy * sx) / denom
+        u = (qx * ry - qy * rx) / denom
 
-    x = (line_int - no_vert_slope_int[1]) / (no_vert_slope_int[0] - line_slope)
-    y = (line_slope * x + line_int)
-    # print(x, y)
-    intersections[:, no_vert] = np.vstack((x, y))
-    dealt |= no_vert
+    hit = ~parallel & (t >= -eps) & (t <= 1 + eps) & (u >= -eps) & (u <= 1 + eps)
+    return np.where(hit, np.clip(t, 0, 1), np.inf)
 
-    # Can now assume that one of the lines are vertical.
-    if line_slope is None:
-        # Main line is vertical
-        x = line[0]
-        y = slope_int[0, ~dealt] * x + slope_int[1, ~dealt]
-        intersections[:, ~dealt] = np.vstack((np.full(fill_value=x, shape=np.sum(~dealt)), y))
-    else:
-        # Other lines are vertical
-        x = line_arr[0, ~dealt]
-        y = line_slope * x + line_int
-        intersections[:, ~dealt] = np.vstack((x, y))
 
-    intersections[intersections == np.inf] = np.NaN
-    return intersections
+def pairwise_params(lines: np.array, line_arr: np.array, eps: float = EPS) -> np.array:
+    """
+    Hit parameters of every line against every other line
+    :param lines: L lines in a 4xL matrix
+    :param line_arr: N lines in a 4xN matrix
+    :return: LxN matrix of t along lines, np.inf where there's no intersection
+    """
+    return segment_params(lines[:, :, None], line_arr[:, None, :], eps)
 
 
-def _slope_and_intercept(lines: np.array):
+def swept_box(previous: np.array, box: np.array, out: np.array = None) -> np.array:
     """
-    Takes in 4xN array of lines, and outputs 2xN array of slope, intercept
-    :param lines(nd.array): Array of lines
-    :return: nd.array
+    Lines bounding the area a box covers while moving from one pose to the next: its edges at the new pose and the
+    paths of its four corners. Any wall crossing into the swept area crosses one of these lines or the previous box,
+    which was already tested the step before, so fast boxes can't tunnel through walls between two poses. Only walls
+    lying entirely inside the swept area are missed. Corners move in straight lines, which is exact for translation and
+    a chord of the arc for rotation.
+    :param previous: Box edges at the previous pose, 4 x ... x 4, where the first two edges are opposite each other
+    :param box: Box edges at the new pose, in the same layout
+    :param out: 4 x ... x 8 matrix to write the lines to, allocated if None
+    :return: 4 x ... x 8 lines, the four edges of box followed by the four corner paths
     """
-    si = np.full(shape=(2, lines.shape[1]), fill_value=np.NaN)
-    not_nan_mask = lines[0] != lines[2]
-    not_nan = lines[:, not_nan_mask]
+    if out is None:
+        out = np.empty(box.shape[:-1] + (8,), dtype=np.result_type(previous, box))
+    out[..., 0:4] = box
+    # The first points of the two opposite edges and then their second points are the four corners
+    for start, end, pose in ((0, 2, previous), (2, 4, box)):
+        out[start:end, ..., 4:6] = pose[0:2, ..., 0:2]
+        out[start:end, ..., 6:8] = pose[2:4, ..., 0:2]
+    return out
 
-    # Calculate slope and intercept
-    slope = (not_nan[3] - not_nan[1]) / (not_nan[2] - not_nan[0])
-    intercept = not_nan[1] - slope * not_nan[0]
 
-    si[:, not_nan_mask] = np.vstack((slope, intercept))
-    return si
+def nearest_hits(lines: np.array, line_arr: np.array, eps: float = EPS) -> tuple:
+    """
+    Nearest intersection of each line with any of the other lines, as a parameter along the line. Computed in the
+    precision of the inputs, so float32 lines and walls roughly halve the cost for large batches.
+    :param lines: L lines in a 4xL matrix, e.g. lasers
+    :param line_arr: N lines in a 4xN matrix, e.g. walls
+    :return: (t, index). t has length L and is np.inf where a line hits nothing, index is the index of the hit line in
+    line_arr or -1
+    """
+    n = lines.shape[1]
+    t = np.full(n, np.inf, dtype=np.result_type(lines, line_arr, np.float32))
+    index = np.full(n, -1)
+    if line_arr.shape[1] == 0:
+        return t, index
+    # Large batches are split up so that the temporaries of each block stay in cache
+    block = max(1, BLOCK_PAIRS // line_arr.shape[1])
+    for i in range(0, n, block):
+        t[i:i + block], index[i:i + block] = _nearest_block(lines[:, i:i + block], line_arr, eps)
+    return t, index
+
+
+def _nearest_block(lines: np.array, line_arr: np.array, eps: float) -> tuple:
+    # Same math as segment_params, written with in-place operations since this is the hot path of laser casting
+    ax, ay = lines[0][:, None], lines[1][:, None]
+    rx, ry = (lines[2] - lines[0])[:, None], (lines[3] - lines[1])[:, None]
+    sx, sy = line_arr[2] - line_arr[0], line_arr[3] - line_arr[1]
+    qx, qy = line_arr[0] - ax, line_arr[1] - ay
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv = rx * sy
+        inv -= ry * sx
+        # Parallel within the same normalized tolerance as segment_params
+        parallel = np.hypot(rx, ry) * (eps * np.hypot(sx, sy))
+        parallel = np.abs(inv) <= parallel
+        np.reciprocal(inv, out=inv)
+        t = qx * sy
+        t -= qy * sx
+        t *= inv
+        u = qx * ry
+        u -= qy * rx
+        u *= inv
+
+        # Both parameters within [-eps, 1 + eps]
+        hit = np.abs(t - 0.5) <= 0.5 + eps
+        u -= 0.5
+        np.abs(u, out=u)
+        hit &= u <= 0.5 + eps
+        hit &= ~parallel
+    t[~hit] = np.inf
+
+    index = np.argmin(t, axis=1)
+    t = t[np.arange(t.shape[0]), index]
+    miss = np.isinf(t)
+    index[miss] = -1
+    return np.where(miss, np.inf, np.clip(t, 0, 1)), index
+
+
+def nearest_intersections(lines: np.array, line_arr: np.array) -> tuple:
+    """
+    Find the closest intersection of each line with any of the other lines, measured from the line's first point.
+    All L x N pairs are tested in one array computation.
+    :param lines: L lines in a 4xL matrix, e.g. lasers
+    :param line_arr: N lines in a 4xN matrix, e.g. walls
+    :return: (distances, points). Distances has length L and is np.inf where a line hits nothing, points is 2xL and
+    NaN where a line hits nothing
+    """
+    t, _ = nearest_hits(lines, line_arr)
+    direction = lines[2:4] - lines[0:2]
+    with np.errstate(invalid='ignore'):
+        distances = t * np.hypot(*direction)
+        points = lines[0:2] + t * direction
+    points[:, np.isinf(t)] = np.nan
+    return distances, points
 
 
-def _line_slope_intercept(line: list):
-    if line[0] == line[2]:
-        # Infinite slope
-        return None, None
-    else:
-        slope = (line[3] - line[1]) / (line[2] - line[0])
-        return slope, line[1] - slope * line[0]
+def segment_intersections(line: list, line_arr: np.array) -> np.array:
+    """
+    Return points of intersection if they exist. Leave the other points at np.nan
+    :param line: Line to find collisions of other lines with, as x1, y1, x2, y2
+    :param line_arr: N lines in a 4xN matrix
+    :return: 2xN matrix containing intersection points
+    """
+    line = np.asarray(line, dtype=float).reshape(4, 1)
+    t = segment_params(line, line_arr)
+    with np.errstate(invalid='ignore'):
+        p = line[0:2] + t * (line[2:4] - line[0:2])
+    p[:, np.isinf(t)] = np.nan
+    return p
@@ -1,6 +1,9 @@
-from pygame import Rect
+from math import hypot
+
 from pygame.math import Vector2
 
+from src.collision import EPS
+
 
 class Line:
     def __init__(self, p1, p2):
@@ -67,77 +70,51 @@ def segment_intersection(l1, l2):
     :param l2: Line 2
     :return: Point (x,y) if intersection exists, otherwise None
     """
-    # Intersection point given infinite lines
-    p = _intersection(l1, l2)
-    if p is None:
-        print('failed initial intersection:')
+    t = segment_intersection_param(l1, l2)
+    if t is None:
         return None
+    (x1, y1), (x2, y2) = l1
+    return x1 + t * (x2 - x1), y1 + t * (y2 - y1)
 
-    for coord in p:
-        if abs(coord) > 1e5:
-            return None
-
-    # Check that this intersection is within the boundaries of both lines
-    # Rectangles represent boundaries for lines
-    l1 = [i for i in l1]
-    l2 = [i for i in l2]
-    r1, r2 = (Rect(l[0], [l[1][i] - l[0][i] for i in range(2)]) for l in (l1, l2))
-    r1.normalize()
-    r2.normalize()
-    for r in (r1, r2):
-        r.w = max(r.w, 3)
-        r.h = max(r.h, 3)
-    # print(r1, r2)
-
-    if r1.collidepoint(p) and r2.collidepoint(p):
-        return p
-    return None
 
-
-def _intersection(l1, l2):
+def segment_intersection_param(l1, l2, eps=EPS):
     """
-    Returns point of intersection for infinite lines or None, depending on if it exists or not. If lines are parallel,
-    it returns none.
+    Scalar form of collision.segment_params. Returns how far along l1 it intersects l2, as a fraction of its length.
     :param l1: Line no. 1, of format [(x1, y1), (x2, y2)]
     :param l2: Line no. 2
-    :return: None if no point, (xi, yi) otherwise
+    :param eps: Tolerance, see collision.EPS
+    :return: t in [0, 1] if the segments intersect, None otherwise (also if they are parallel)
     """
-    s1, i1 = _slope_and_intercept(l1)
-    s2, i2 = _slope_and_intercept(l2)
-
-    # print(s1, i1, s2, i2)
-
-    if s1 == s2:
+    (ax, ay), (bx, by) = l1
+    (cx, cy), (dx, dy) = l2
+    rx, ry = bx - ax, by - ay
+    sx, sy = dx - cx, dy - cy
+    qx, qy = cx - ax, cy - ay
+
+    denom = rx * sy - ry * sx
+    if abs(denom) <= eps * hypot(rx, ry) * hypot(sx, sy):
         # Lines are parallel, don't need to handle this case
         return None
+    t = (qx * sy - qy * sx) / denom
+    u = (qx * ry - qy * rx) / denom
+    if -eps <= t <= 1 + eps and -eps <= u <= 1 + eps:
+        return min(max(t, 0.), 1.)
+    return None
+
 
-    if s1 is not None and s2 is not None:
-        # No vertical lines, use traditional formula
-        x = (i1 - i2) / (s2 - s1)
-        y = s1 * x + i1
-        return x, y
-
-    # Can now assume that exactly one is vertical
-    if s1 is None:
-        # Line 1 is vertical
-        x = l1[0][0]
-        y = s2 * x + i2
-        return x, y
-
-    # Line 2 is vertical
-    x = l2[0][0]
-    y = s1 * x + i1
-    return x, y
-
-
-def _slope_and_intercept(line):
-    p1, p2 = line
-    if p1[0] == p2[0]:
-        # Infinite slope
-        return None, None
-    else:
-        slope = (p2[1] - p1[1]) / (p2[0] - p1[0])
-        return slope, p1[1] - slope * p1[0]
+def nearest_hit(line, lines):
+    """
+    Scalar form of collision.nearest_hits.
+    :param line: Line to cast
+    :param lines: Lines to test against
+    :return: (t, other) for the nearest intersected line, or (None, None) if there is none
+    """
+    best, hit = None, None
+    for other in lines:
+        t = segment_intersection_param(line, other)
+        if t is not None and (best is None or t < best):
+            best, hit = t, other
+    return best, hit
 
 
 if __name__ == '__main__':
@@ -0,0 +1,67 @@
+# Policy evaluation in plain NumPy, for acting without the per-call overhead of Keras
+import numpy as np
+
+ACTIVATIONS = {
+    'linear': None,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'tanh': lambda x: np.tanh(x, out=x),
+    'sigmoid': lambda x: np.divide(1, 1 + np.exp(-x, out=x), out=x),
+}
+
+
+class NumpyMLP:
+    """
+    Forward pass of a stack of Dense layers with NumPy matmuls. Keras predict costs milliseconds per call no matter how
+    small the network is, while the actual math of a small MLP takes microseconds, so acting goes through a copy of the
+    weights exported after every training update.
+    """
+
+    def __init__(self, weights, activations, dtype=np.float32):
+        """
+        :param weights: List of (kernel, bias) per layer, kernels are inputs x outputs as in Keras
+        :param activations: Activation name per layer, see ACTIVATIONS
+        :param dtype: Type to compute in
+        """
+        for activation in activations:
+            if activation not in ACTIVATIONS:
+                raise ValueError('Unsupported activation {}'.format(activation))
+        self.dtype = dtype
+        self.activations = [ACTIVATIONS[activation] for activation in activations]
+        self.layers = []
+        self.set_weights([array for layer in weights for array in layer])
+
+    @classmethod
+    def from_keras(cls, model, dtype=np.float32):
+        """
+        :param model: Keras model made only of Dense layers
+        """
+        layers = [layer for layer in model.layers if layer.get_weights()]
+        return cls([layer.get_weights() for layer in layers], [layer.get_config()['activation'] for layer in layers],
+                   dtype)
+
+    def set_weights(self, weights):
+        """
+        :param weights: Flat list of kernel, bias, kernel, bias, ..., as returned by Keras' model.get_weights
+        """
+        self.layers = [(np.array(kernel, dtype=self.dtype), np.array(bias, dtype=self.dtype))
+                       for kernel, bias in zip(weights[0::2], weights[1::2])]
+
+    def copy(self):
+        # Independent copy, e.g. for another thread to act with
+        mlp = NumpyMLP.__new__(NumpyMLP)
+        mlp.dtype, mlp.activations = self.dtype, list(self.activations)
+        mlp.layers = [(kernel.copy(), bias.copy()) for kernel, bias in self.layers]
+        return mlp
+
+    def __call__(self, states):
+        """
+        :param states: Batch of states, B x inputs, or a single state
+        :return: B x outputs matrix of outputs
+        """
+        x = np.asarray(states, dtype=self.dtype).reshape(-1, self.layers[0][0].shape[0])
+        for (kernel, bias), activation in zip(self.layers, self.activations):
+            x = x @ kernel
+            x += bias
+            if activation is not None:
+                activation(x)
+        return x
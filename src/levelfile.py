@@ -0,0 +1,187 @@
+# Compiled level format and a per-process cache of loaded levels
+import codecs
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from src.collision import line_array
+from src.spatial import DistanceField, WallGrid
+
+SOURCE_FILE = 'level.json'
+COMPILED_FILE = 'level.npz'
+DEFAULT_DIMENSIONS = (1366, 768)
+# Entry of a compiled level holding the source_hash of the level.json it was built from
+SOURCE_HASH_KEY = 'source_sha1'
+
+# Loaded levels by (absolute path, content hash). Entries are read-only and shared by every Level in the process
+_cache = {}
+
+
+class LevelData:
+    """
+    Read-only geometry of a level: wall polygons and segments, checkpoints, start pose, the wall grid and optionally a
+    distance field. A compiled level is an .npz archive of the arrays returned by to_arrays.
+    """
+
+    def __init__(self, wall_points, wall_offsets, checkpoint_array, start, start_angle, checkpoints_reversed=True,
+                 dimensions=DEFAULT_DIMENSIONS, grid_arrays=None, field_arrays=None):
+        """
+        :param wall_points: Kx2 matrix of the points of every wall polygon, one polygon after the other
+        :param wall_offsets: Index in wall_points where each polygon starts, followed by K
+        :param checkpoint_array: Checkpoints in a 4xC matrix, as in src.collision
+        :param start: Start position
+        :param start_angle: Start angle in degrees
+        :param checkpoints_reversed: Whether checkpoints are driven through in decreasing index order
+        :param dimensions: Size of the level in pixels
+        :param grid_arrays: Precomputed wall grid, as returned by WallGrid.to_arrays. Built if None
+        :param field_arrays: Precomputed distance field, as returned by DistanceField.to_arrays. Built on first use if
+        None
+        """
+        self.wall_points = np.asarray(wall_points, dtype=float)
+        self.wall_offsets = np.asarray(wall_offsets, dtype=int)
+        self.walls = [self.wall_points[a:b] for a, b in zip(self.wall_offsets[:-1], self.wall_offsets[1:])]
+        # Closed polygons, every point connects to the previous one
+        self.wall_array = line_array((polygon[i - 1], polygon[i]) for polygon in self.walls
+                                     for i in range(len(polygon)))
+        self.checkpoint_array = np.asarray(checkpoint_array, dtype=float)
+        self.checkpoints = self.checkpoint_array.T.reshape(-1, 2, 2)
+        self.start = np.asarray(start, dtype=float)
+        self.start_angle = float(start_angle)
+        self.checkpoints_reversed = bool(checkpoints_reversed)
+        self.dimensions = tuple(int(d) for d in dimensions)
+        if grid_arrays is None:
+            self.wall_index = WallGrid(self.wall_array)
+        else:
+            self.wall_index = WallGrid.from_arrays(self.wall_array, grid_arrays)
+        self._distance_field = None
+        if field_arrays:
+            self._set_distance_field(DistanceField.from_arrays(field_arrays))
+
+        for array in (self.wall_points, self.wall_offsets, self.wall_array, self.checkpoint_array, self.start,
+                      self.wall_index.table):
+            array.flags.writeable = False
+
+    @property
+    def distance_field(self):
+        # Takes about a second to build, so it's only built when asked for and then shared like the rest of the level
+        if self._distance_field is None:
+            self._set_distance_field(DistanceField(self.wall_array, self.dimensions))
+        return self._distance_field
+
+    @property
+    def has_distance_field(self):
+        return self._distance_field is not None
+
+    def _set_distance_field(self, field):
+        field.values.flags.writeable = False
+        self._distance_field = field
+
+    @classmethod
+    def from_json(cls, level):
+        """
+        :param level: Parsed level.json, with walls as lists of polygon points and checkpoints as point pairs
+        """
+        wall_offsets = np.cumsum([0] + [len(polygon) for polygon in level['walls']])
+        return cls(
+            wall_points=np.concatenate([np.reshape(polygon, (-1, 2)) for polygon in level['walls']]),
+            wall_offsets=wall_offsets,
+            checkpoint_array=line_array(level['checkpoints']),
+            start=level['start'],
+            start_angle=level['startangle'],
+            checkpoints_reversed=level.get('checkpointsreversed', True),
+            dimensions=level.get('dimensions', DEFAULT_DIMENSIONS),
+        )
+
+    def to_arrays(self):
+        arrays = {
+            'wall_points': self.wall_points,
+            'wall_offsets': self.wall_offsets,
+            'checkpoint_array': self.checkpoint_array,
+            'start': self.start,
+            'start_angle': np.array(self.start_angle),
+            'checkpoints_reversed': np.array(self.checkpoints_reversed),
+            'dimensions': np.array(self.dimensions),
+        }
+        arrays.update(self.wall_index.to_arrays())
+        if self.has_distance_field:
+            arrays.update(self._distance_field.to_arrays())
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            wall_points=arrays['wall_points'],
+            wall_offsets=arrays['wall_offsets'],
+            checkpoint_array=arrays['checkpoint_array'],
+            start=arrays['start'],
+            start_angle=arrays['start_angle'],
+            checkpoints_reversed=arrays['checkpoints_reversed'],
+            dimensions=arrays['dimensions'],
+            grid_arrays={key: arrays[key] for key in arrays if key.startswith('grid_')},
+            field_arrays={key: arrays[key] for key in arrays if key.startswith('field_')},
+        )
+
+
+def source_hash(content):
+    """
+    :param content: Bytes of a level.json
+    :return: Hash a compiled level stores of the level.json it was built from
+    """
+    return hashlib.sha1(content).hexdigest()
+
+
+def save_level(path, level, source_sha1=None):
+    """
+    Write a compiled level
+    :param path: Path of the .npz file
+    :param level: LevelData
+    :param source_sha1: source_hash of the level.json the level was built from. load_level only uses the compiled
+    level while that level.json is unchanged
+    """
+    arrays = level.to_arrays()
+    if source_sha1 is not None:
+        arrays[SOURCE_HASH_KEY] = np.array(source_sha1)
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def _compiled_source_hash(path):
+    # Hash of the source a compiled level was built from, None if it doesn't say. Only that entry of the archive is read
+    with np.load(path) as arrays:
+        return str(arrays[SOURCE_HASH_KEY]) if SOURCE_HASH_KEY in arrays.files else None
+
+
+def load_level(directory):
+    """
+    Load a level directory, preferring the compiled level.npz over level.json if it was built from the current
+    level.json. Levels are cached by path and content hash, so every Game in a process shares one read-only copy and a
+    level is only parsed once.
+    :param directory: Level directory
+    :return: LevelData
+    """
+    compiled = os.path.join(directory, COMPILED_FILE)
+    source = os.path.join(directory, SOURCE_FILE)
+    content = None
+    if os.path.exists(source):
+        with open(source, 'rb') as f:
+            content = f.read()
+    # A compiled level is stale unless it was built from this exact source. Modification times can't tell, a checkout
+    # doesn't preserve them
+    if content is None:
+        use_compiled = True
+        with open(compiled, 'rb') as f:
+            content = f.read()
+    else:
+        use_compiled = os.path.exists(compiled) and _compiled_source_hash(compiled) == source_hash(content)
+    key = (os.path.abspath(compiled if use_compiled else source), source_hash(content))
+    level = _cache.get(key)
+    if level is None:
+        if use_compiled:
+            with np.load(compiled) as arrays:
+                level = LevelData.from_arrays(arrays)
+        else:
+            level = LevelData.from_json(json.loads(codecs.decode(content, 'UTF-8')))
+        _cache[key] = level
+    return level
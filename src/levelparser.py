@@ -1,41 +1,334 @@
+# Level compiler: builds level.json and level.npz from the wall and checkpoint sources of a level directory
+#
+#   python -m src.levelparser                      build every level in assets/levels
+#   python -m src.levelparser assets/levels/level1 build one level
+#   python -m src.levelparser --check              only validate
+import argparse
 import codecs
+import glob
 import json
+import os
+import re
+import sys
+import xml.etree.ElementTree as ElementTree
 
-leveldir = '../assets/levels/level1/prewalls.json'
-checkpointdir = '../assets/levels/level1/precheckpoints.json'
-outputdir = '../assets/levels/level1/level.json'
+import numpy as np
 
-with codecs.open(leveldir, 'r', encoding='UTF-8') as f:
-    walls_in = json.load(f)['level']
+from src.collision import line_array, pairwise_params
+from src.levelfile import COMPILED_FILE, SOURCE_FILE, DEFAULT_DIMENSIONS, LevelData, save_level, source_hash
 
-with codecs.open(checkpointdir, 'r', encoding='UTF-8') as f:
-    checkpoints_in = json.load(f)['layers'][0]['paths']
+WALLS_FILE = 'prewalls.json'
+CHECKPOINTS_FILE = 'precheckpoints.json'
+# Vertices closer than this many pixels to the line through their neighbours are dropped
+SIMPLIFY_TOLERANCE = 1e-2
+# Decimals kept for coordinates in level.json
+DECIMALS = 3
 
-wallpos = 0
+_SVG_TOKEN = re.compile(r'[A-DF-Za-df-z]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_SVG_ARGS = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'Z': 0}
 
-level_out = {
-    "walls": [[], []],
-    "checkpoints": []
-}
 
-# Register walls
-wallpos = 0
-for c in walls_in:
-    if len(c) == 1:
-        wallpos = 1
-        continue
-    if c[0] == 'M' or c[0] == 'L':
-        curpos = c[1:3]
-        level_out['walls'][wallpos].append(curpos)
-    elif c[0] == 'l':
-        curpos = [curpos[0] + c[1], curpos[1] + c[2]]
-        level_out['walls'][wallpos].append(curpos)
+class LevelBuildError(ValueError):
+    """
+    A level source that can't be compiled. Every problem found is listed in problems
+    """
 
-# Register checkpoints
-for path in checkpoints_in:
-    level_out['checkpoints'].append(path['points'])
+    def __init__(self, directory, problems):
+        super().__init__('{}:\n  {}'.format(directory, '\n  '.join(problems)))
+        self.directory = directory
+        self.problems = problems
 
-input('Are you sure you want to write to {}? Ctrl+C to abort.'.format(outputdir))
 
-with codecs.open(outputdir, 'w', encoding='UTF-8') as f:
-    json.dump(level_out, f)
+def parse_path(commands):
+    """
+    Turn path commands into closed polygons. Supports absolute and relative moveto, lineto, horizontal and vertical
+    lineto and closepath, which is what Illustrator exports for straight-edged tracks.
+    :param commands: Iterable of (command, *numbers), e.g. ('l', -17.13, -5.09)
+    :return: (polygons, problems). Polygons is a list of lists of points, problems lists unclosed or unsupported paths
+    """
+    polygons, problems = [], []
+    current, pos, start = None, np.zeros(2), np.zeros(2)
+    for command, *args in commands:
+        kind = command.upper()
+        relative = command != kind
+        if kind not in _SVG_ARGS or len(args) != _SVG_ARGS[kind]:
+            problems.append('unsupported path command {}'.format([command] + list(args)))
+            continue
+        if kind == 'Z':
+            if current is not None:
+                polygons.append(current)
+            current, pos = None, start.copy()
+            continue
+
+        if kind == 'H':
+            point = np.array([pos[0] * relative + args[0], pos[1]])
+        elif kind == 'V':
+            point = np.array([pos[0], pos[1] * relative + args[0]])
+        else:
+            point = pos * relative + np.array(args, dtype=float)
+        if kind == 'M':
+            if current is not None:
+                problems.append('path starting at {} is not closed'.format(current[0]))
+            current, start = [], point
+        elif current is None:
+            problems.append('line to {} outside of a path'.format(point.tolist()))
+            continue
+        current.append(point)
+        pos = point
+    if current is not None:
+        problems.append('path starting at {} is not closed'.format(current[0]))
+    return polygons, problems
+
+
+def tokenize_svg_path(d):
+    """
+    Split SVG path data into commands, repeating the previous command for implicit repetitions. A moveto followed by
+    more coordinate pairs continues as lineto, as in the SVG spec.
+    :param d: Contents of a path's d attribute
+    :return: List of (command, *numbers)
+    """
+    commands, command, numbers = [], None, []
+
+    def flush():
+        n = _SVG_ARGS.get(command.upper(), 0) if command else 0
+        if n == 0 or not numbers:
+            commands.append((command,) + tuple(numbers))
+            return
+        repeated = command
+        for i in range(0, len(numbers), n):
+            commands.append((repeated,) + tuple(numbers[i:i + n]))
+            if repeated in 'Mm':
+                repeated = 'L' if repeated == 'M' else 'l'
+
+    for token in _SVG_TOKEN.findall(d):
+        if token.isalpha():
+            if command is not None:
+                flush()
+            command, numbers = token, []
+        else:
+            numbers.append(float(token))
+    if command is not None:
+        flush()
+    return commands
+
+
+def read_svg(path):
+    """
+    Wall polygons from every path element of an SVG file. Coordinates are used as written in the path data and
+    transforms are ignored, which matches the coordinates the track was authored in.
+    """
+    polygons, problems = [], []
+    for element in ElementTree.parse(path).iter():
+        if element.tag.rsplit('}', 1)[-1] == 'path':
+            found, path_problems = parse_path(tokenize_svg_path(element.get('d', '')))
+            polygons += found
+            problems += path_problems
+    return polygons, problems
+
+
+def read_prewalls(path):
+    # Path commands as JSON lists, a bare ['Z'] closes the current polygon
+    with codecs.open(path, 'r', encoding='UTF-8') as f:
+        return parse_path(json.load(f)['level'])
+
+
+def read_checkpoints(path):
+    with codecs.open(path, 'r', encoding='UTF-8') as f:
+        return [item['points'] for item in json.load(f)['layers'][0]['paths']]
+
+
+def simplify_polygon(points, tolerance=SIMPLIFY_TOLERANCE):
+    """
+    Drop repeated vertices and vertices lying on the segment between their neighbours
+    :param points: Points of a closed polygon
+    :param tolerance: Largest distance in pixels from the neighbours' segment for a vertex to be dropped
+    :return: Kx2 array of the remaining points
+    """
+    points = [np.asarray(p, dtype=float) for p in points]
+    removed = True
+    while removed and len(points) > 3:
+        removed = False
+        i = 0
+        while i < len(points) and len(points) > 3:
+            if _redundant(points[i - 1], points[i], points[(i + 1) % len(points)], tolerance):
+                del points[i]
+                removed = True
+            else:
+                i += 1
+    return np.array(points)
+
+
+def _redundant(prev, point, next, tolerance):
+    chord = next - prev
+    length = np.hypot(*chord)
+    offset = point - prev
+    if np.hypot(*offset) <= tolerance or length <= tolerance:
+        return True
+    along = np.dot(offset, chord) / length
+    distance = abs(chord[0] * offset[1] - chord[1] * offset[0]) / length
+    return distance <= tolerance and 0 <= along <= length
+
+
+def validate(polygons, checkpoints):
+    """
+    Check that walls are simple polygons that don't cross each other, and that every checkpoint spans the track from
+    one wall polygon to another
+    :return: List of problems, empty if the level is valid
+    """
+    problems = [] if polygons else ['no walls']
+    if not checkpoints:
+        problems.append('no checkpoints')
+    for i, polygon in enumerate(polygons):
+        if len(polygon) < 3:
+            problems.append('wall {} has only {} vertices'.format(i, len(polygon)))
+    if problems:
+        return problems
+
+    owner = np.concatenate([np.full(len(polygon), i) for i, polygon in enumerate(polygons)])
+    index = np.concatenate([np.arange(len(polygon)) for polygon in polygons])
+    sizes = np.array([len(polygon) for polygon in polygons])[owner]
+    walls = line_array((polygon[i - 1], polygon[i]) for polygon in polygons for i in range(len(polygon)))
+
+    # Segments of the same polygon that share a vertex always touch
+    crossings = ~np.isinf(pairwise_params(walls, walls))
+    same = owner[:, None] == owner[None, :]
+    step = (index[:, None] - index[None, :]) % sizes[:, None]
+    crossings &= ~(same & ((step == 0) | (step == 1) | (step == sizes[:, None] - 1)))
+    for a, b in zip(*np.nonzero(np.triu(crossings))):
+        what = 'crosses itself' if owner[a] == owner[b] else 'crosses wall {}'.format(owner[b])
+        problems.append('wall {} {} at segments {} and {}'.format(owner[a], what, index[a], index[b]))
+
+    hits = ~np.isinf(pairwise_params(line_array(checkpoints), walls))
+    for i, row in enumerate(hits):
+        touched = np.unique(owner[row])
+        if len(touched) < 2:
+            problems.append('checkpoint {} touches {} wall(s), it should span the track between two'
+                            .format(i, len(touched)))
+    return problems
+
+
+def find_sources(directory):
+    """
+    :return: (walls source, checkpoints source) of a level directory, None where missing. prewalls.json is preferred
+    over an SVG export
+    """
+    walls = os.path.join(directory, WALLS_FILE)
+    if not os.path.exists(walls):
+        svgs = sorted(glob.glob(os.path.join(directory, '*.svg')))
+        walls = svgs[0] if svgs else None
+    checkpoints = os.path.join(directory, CHECKPOINTS_FILE)
+    return walls, checkpoints if os.path.exists(checkpoints) else None
+
+
+def build_level(directory, walls_source=None, start=None, start_angle=None, tolerance=SIMPLIFY_TOLERANCE,
+                write=True, distance_field=True):
+    """
+    Compile a level directory into level.json and level.npz. The start pose and other settings are kept from an
+    existing level.json unless given.
+    :param directory: Level directory
+    :param walls_source: prewalls.json or SVG file to read walls from, found in the directory if None
+    :param start: Start position, overrides level.json
+    :param start_angle: Start angle in degrees, overrides level.json
+    :param tolerance: See simplify_polygon, 0 to keep every vertex
+    :param write: Whether to write the output files, only validate if False
+    :param distance_field: Whether to precompute the level's distance field into level.npz
+    :return: LevelData
+    :raises LevelBuildError: If the sources are missing or the level is invalid
+    """
+    found_walls, checkpoints_source = find_sources(directory)
+    walls_source = walls_source or found_walls
+    problems = []
+    if walls_source is None:
+        problems.append('no {} or .svg file'.format(WALLS_FILE))
+    if checkpoints_source is None:
+        problems.append('no {} file'.format(CHECKPOINTS_FILE))
+
+    level = {}
+    source = os.path.join(directory, SOURCE_FILE)
+    if os.path.exists(source):
+        with codecs.open(source, 'r', encoding='UTF-8') as f:
+            level = json.load(f)
+    if start is not None:
+        level['start'] = list(start)
+    if start_angle is not None:
+        level['startangle'] = start_angle
+    for key in ('start', 'startangle'):
+        if key not in level:
+            problems.append('no {} given and no existing {}'.format(key, SOURCE_FILE))
+    if problems:
+        raise LevelBuildError(directory, problems)
+
+    if walls_source.endswith('.svg'):
+        polygons, problems = read_svg(walls_source)
+    else:
+        polygons, problems = read_prewalls(walls_source)
+    if tolerance > 0:
+        polygons = [simplify_polygon(polygon, tolerance) for polygon in polygons]
+    checkpoints = read_checkpoints(checkpoints_source)
+    problems += validate(polygons, checkpoints)
+    if problems:
+        raise LevelBuildError(directory, problems)
+
+    level['walls'] = [np.round(polygon, DECIMALS).tolist() for polygon in polygons]
+    level['checkpoints'] = checkpoints
+    level.setdefault('dimensions', list(DEFAULT_DIMENSIONS))
+    data = LevelData.from_json(level)
+    if write:
+        if distance_field:
+            # Built on first access, after which to_arrays includes it
+            data.distance_field
+        content = json.dumps(level).encode('UTF-8')
+        with open(source, 'wb') as f:
+            f.write(content)
+        save_level(os.path.join(directory, COMPILED_FILE), data, source_hash(content))
+    return data
+
+
+def level_directories(path):
+    """
+    :return: path if it's a level directory, otherwise every level directory directly inside it
+    """
+    path = os.path.normpath(path)
+    if any(find_sources(path)):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if os.path.isdir(os.path.join(path, name)) and any(find_sources(os.path.join(path, name))))
+
+
+def main(argv=None):
+    from src.racecar_game import LEVEL_DIR
+
+    parser = argparse.ArgumentParser(prog='python -m src.levelparser', description='Compile level sources.')
+    parser.add_argument('paths', nargs='*', default=[LEVEL_DIR],
+                        help='Level directories, or directories of levels. Defaults to every level')
+    parser.add_argument('--svg', action='store_true', help='Read walls from the SVG export even if {} exists'
+                        .format(WALLS_FILE))
+    parser.add_argument('--start', type=float, nargs=2, metavar=('X', 'Y'), help='Start position')
+    parser.add_argument('--start-angle', type=float, help='Start angle in degrees')
+    parser.add_argument('--tolerance', type=float, default=SIMPLIFY_TOLERANCE,
+                        help='Collinear simplification tolerance in pixels, 0 to disable')
+    parser.add_argument('--check', action='store_true', help='Validate without writing anything')
+    parser.add_argument('--no-distance-field', action='store_true',
+                        help='Leave the distance field out of level.npz, it is then built when first used')
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for directory in [d for path in args.paths for d in level_directories(path)]:
+        walls_source = None
+        if args.svg:
+            svgs = sorted(glob.glob(os.path.join(directory, '*.svg')))
+            walls_source = svgs[0] if svgs else None
+        try:
+            level = build_level(directory, walls_source, args.start, args.start_angle, args.tolerance,
+                                write=not args.check, distance_field=not args.no_distance_field)
+        except LevelBuildError as e:
+            print(e, file=sys.stderr)
+            failed += 1
+            continue
+        print('{}: {} walls, {} segments, {} checkpoints'.format(
+            directory, len(level.walls), level.wall_array.shape[1], len(level.checkpoints)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
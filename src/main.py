@@ -1,11 +1,32 @@
-from sys import exit
+# Command line entry point. Only the chosen command imports what it needs, so playing and evaluating a tabular agent
+# never load TensorFlow
+#
+#   python -m src.main play
+#   python -m src.main train --actors 2 --seconds 600 --save weights.weights.h5
+#   python -m src.main train --backend tabular --envs 256 --seconds 600 --save table.npz
+#   python -m src.main evaluate --weights weights.weights.h5 --episodes 10 --record run.traj
+#   python -m src.main replay run.traj --episode 2
+#   python -m src.main benchmark --quick
+import argparse
+import contextlib
+import json
+import os
+import sys
+from time import perf_counter, sleep
 
 import numpy as np
-import pygame
-from pygame.time import Clock
 
-from src.agent import CarAgent
-from src.racecar_game import Game, Controls
+# pygame greets on import, which would end up in front of the JSON reports on stdout
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame  # noqa: E402
+from pygame.time import Clock  # noqa: E402
+
+from src.actor_learner import ActorLearner, DONE_REWARD  # noqa: E402
+from src.backends import BACKENDS, DEFAULT_BACKEND, create_agent, load_backend  # noqa: E402
+from src.racecar_game import Game, Controls, OBS_SIZE  # noqa: E402
+from src.recorder import Recorder, Trajectory, play, rederive_observations, resimulate  # noqa: E402
+from src.vec_game import VecGame  # noqa: E402
 
 controls = {
     pygame.K_i: Controls.FRONT,
@@ -14,65 +35,311 @@ controls = {
     pygame.K_k: Controls.BACK
 }
 
+# Physics steps the agent's action is held for. Fewer decisions mean fewer network passes and laser casts per second
+AI_ACTION_REPEAT = 4
+# Decisions after which evaluate gives up on an episode, for policies that drive in circles through checkpoints
+MAX_EPISODE_STEPS = 10000
 
-def main():
-    # cProfile.run('player_game()', sort='tottime')
-    player_game()
-    # ai_game()
 
+def _quit_requested():
+    # Handle window events, True once the window is closed or escape is pressed
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            return True
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            return True
+    return False
 
-def player_game():
-    game = Game(init_graphics=True)
-    clock = Clock()
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                exit()
-            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                pygame.event.post(pygame.event.Event(pygame.QUIT, {}))
 
+def player_game(level='level1'):
+    game = Game(init_graphics=True, level=level)
+    clock = Clock()
+    while not _quit_requested():
         dt = clock.tick(60) / 1000
         pressed = pygame.key.get_pressed()
         control = []
         for key, action in controls.items():
             if pressed[key]:
                 control.append(action)
-        response = game.act(control, dt)
-        # print(response)
+        game.act(control, dt)
         game.render(dt)
+    pygame.quit()
+
+
+def ai_game(agent, episodes=None, seconds=None, batch_size=32, render=False, level='level1',
+            action_repeat=AI_ACTION_REPEAT, recorder=None):
+    """
+    Train in this process, alternating a decision and a replay
+    :param episodes: Episodes to train for, no limit if None
+    :param seconds: Time limit, no limit if None
+    :param render: Open a window and draw the game, at most 60 decisions per second
+    :param recorder: src.recorder.Recorder to log the game to
+    :return: Reward of every finished episode
+    """
+    game = Game(init_graphics=render, level=level, action_repeat=action_repeat, recorder=recorder)
+    clock = Clock()
+    end = None if seconds is None else perf_counter() + seconds
+    state = game.car.observation.reshape(1, OBS_SIZE).copy()
+    rewards, total = [], 0.
+    while episodes is None or len(rewards) < episodes:
+        if end is not None and perf_counter() >= end:
+            break
+        if render:
+            if _quit_requested():
+                break
+            game.render(clock.tick(60) / 1000)
+        action = agent.act(state)
+        # The game runs action_repeat fixed physics steps per decision
+        observation, reward, done = game.act([Controls(action)])
+        total += reward
+        next_state = observation.reshape(1, OBS_SIZE).copy()
+        agent.remember(state, action, reward if not done else DONE_REWARD, next_state, done)
+        # After a reset the car's buffer already holds the first observation of the next episode
+        state = game.car.observation.reshape(1, OBS_SIZE).copy()
+        if len(agent.memory) >= batch_size:
+            agent.replay(batch_size)
+        if done:
+            rewards.append(total)
+            total = 0.
+    if render:
+        pygame.quit()
+    return rewards
+
+
+def async_ai_game(agent, actors=2, seconds=None, batch_size=32, report_interval=10, level='level1',
+                  action_repeat=AI_ACTION_REPEAT, record=None):
+    # Headless training with actors and learner running side by side
+    end = None if seconds is None else perf_counter() + seconds
+    with ActorLearner(agent, actors=actors, batch_size=batch_size, level=level, action_repeat=action_repeat,
+                      record=record) as pipeline:
+        # Leaving the block raises whatever stopped a thread
+        while pipeline.running and (end is None or perf_counter() < end):
+            sleep(report_interval if end is None else max(min(report_interval, end - perf_counter()), 0))
+            print(json.dumps(pipeline.stats), file=sys.stderr, flush=True)
+    return pipeline.stats
 
 
-def ai_game():
-    game = Game(init_graphics=True)
+def vec_ai_game(agent, envs=64, seconds=None, steps=None, batch_size=32, level='level1',
+                action_repeat=AI_ACTION_REPEAT):
+    """
+    Train on a VecGame, choosing the actions of all envs in one act_batch call. Every step adds one transition per env
+    to the replay memory and replays one batch
+    :param envs: Number of cars
+    :param seconds: Time limit, no limit if None
+    :param steps: Steps of all envs to train for, no limit if None
+    :return: Number of finished episodes
+    """
+    if batch_size > agent.memory.capacity:
+        raise ValueError('Batch size {} is larger than the replay memory of {}'.format(batch_size,
+                                                                                      agent.memory.capacity))
+    vec = VecGame(envs, level=level, action_repeat=action_repeat)
+    states = vec.snapshot().observation
+    start = states[0].copy()
+    end = None if seconds is None else perf_counter() + seconds
+    episodes = step = 0
+    while (steps is None or step < steps) and (end is None or perf_counter() < end):
+        actions = agent.act_batch(states)
+        observations, rewards, dones = vec.act(actions)
+        agent.memory.extend(states, actions, np.where(dones, DONE_REWARD, rewards), observations, dones)
+        if len(agent.memory) >= batch_size:
+            agent.replay(batch_size)
+        # Cars that are done start over from the start of the level
+        states = observations
+        states[dones] = start
+        episodes += int(np.count_nonzero(dones))
+        step += 1
+    return episodes
+
+
+def evaluate(agent, episodes=5, render=False, level='level1', action_repeat=AI_ACTION_REPEAT,
+             max_steps=MAX_EPISODE_STEPS, recorder=None):
+    """
+    Play greedily, without exploring or learning
+    :param recorder: src.recorder.Recorder to log the game to
+    :return: Reward and decisions of every episode
+    """
+    game = Game(init_graphics=render, level=level, action_repeat=action_repeat, recorder=recorder)
     clock = Clock()
-    state_shape, action_shape = [10, 4]
-    agent = CarAgent(state_shape, action_shape)
-    state = np.reshape(unpack_response(game.car.sense())[0], (1, state_shape))
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                exit()
-            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                pygame.event.post(pygame.event.Event(pygame.QUIT, {}))
-        dt = clock.tick(60) / 1000  # Only used to force at most 60 fps
-        dt = 1 / 60
-        actions = agent.act(state)
-        next_state, reward, done = unpack_response(agent.act(actions, dt))
-        reward = reward if not done else -10
-        agent.remember(state, actions, reward, next_state, done)
-        state = next_state
-
-
-def unpack_response(response):
-    car = response.get('car', {})
-    done = car.pop('done', False)
-    reward = car.pop('reward', None)
-    state = np.array(car.values())
-    print(state)
-    return state, reward, done
+    agent.epsilon = 0
+    results = []
+    for _ in range(episodes):
+        game.reset()
+        total, steps, done = 0., 0, False
+        while not done and steps < max_steps:
+            if render:
+                if _quit_requested():
+                    pygame.quit()
+                    return results
+                game.render(clock.tick(60) / 1000)
+            _, reward, done = game.act([Controls(agent.act(game.car.observation.reshape(1, OBS_SIZE)))])
+            total += reward
+            steps += 1
+        results.append({'reward': total, 'steps': steps, 'done': done})
+    if render:
+        pygame.quit()
+    return results
+
+
+def _build_agent(args):
+    settings = {}
+    saved_settings = getattr(load_backend(args.backend), 'saved_settings', None)
+    if args.weights and saved_settings is not None:
+        # Set up like the agent that saved the weights, e.g. with its bins for a tabular agent
+        settings = saved_settings(args.weights)
+    agent = create_agent(args.backend, OBS_SIZE, len(Controls), **settings)
+    if args.weights:
+        agent.load(args.weights)
+    return agent
+
+
+def _play(args):
+    player_game(args.level)
+
+
+def _train(args):
+    # Keep stdout for the final report, progress and library chatter go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        agent = _build_agent(args)
+        if args.actors:
+            stats = async_ai_game(agent, args.actors, args.seconds, args.batch_size, args.report_interval,
+                                  args.level, args.action_repeat, args.record)
+        elif args.envs:
+            episodes = vec_ai_game(agent, args.envs, args.seconds, args.steps, args.batch_size, args.level,
+                                   args.action_repeat)
+            stats = {'episodes': episodes, 'epsilon': agent.epsilon}
+        else:
+            with _recorder(args) as recorder:
+                rewards = ai_game(agent, args.episodes, args.seconds, args.batch_size, args.render, args.level,
+                                  args.action_repeat, recorder)
+            stats = {'episodes': len(rewards), 'mean_reward': float(np.mean(rewards)) if rewards else None,
+                     'epsilon': agent.epsilon}
+        if args.save:
+            agent.save(args.save)
+    print(json.dumps(stats))
+
+
+def _evaluate(args):
+    with contextlib.redirect_stdout(sys.stderr), _recorder(args) as recorder:
+        results = evaluate(_build_agent(args), args.episodes, args.render, args.level, args.action_repeat,
+                           args.max_steps, recorder)
+    rewards = [result['reward'] for result in results]
+    print(json.dumps({'episodes': results, 'mean_reward': float(np.mean(rewards)) if rewards else None}))
+
+
+def _replay(args):
+    trajectory = Trajectory(args.path)
+    episodes = trajectory.episodes if args.episode is None else [args.episode]
+    if not args.check:
+        for episode in episodes:
+            if not play(trajectory, trajectory.episode(episode), args.fps):
+                break
+        return
+    # Headless: sense again at the recorded poses and rerun the recorded actions, reporting any differences
+    with contextlib.redirect_stdout(sys.stderr):
+        report = []
+        for episode in episodes:
+            records = trajectory.episode(episode)
+            observations = rederive_observations(trajectory, records)
+            rerun = resimulate(trajectory, records)
+            complete = records['step'][0] == 0
+            report.append({
+                'episode': int(episode),
+                'steps': len(records),
+                'reward': int(records['reward'].sum()),
+                'max_observation_error': float(np.abs(observations - records['observation']).max()),
+                # Only episodes recorded from their start can be rerun
+                'resimulated': bool(complete and len(rerun) == len(records) and
+                                    np.allclose(rerun['observation'], records['observation'], atol=1e-3)),
+            })
+    print(json.dumps(report))
+    return 0 if all(episode['resimulated'] for episode in report) else 1
+
+
+def _recorder(args):
+    # Recorder for --record, or a context that does nothing
+    return Recorder(args.record) if args.record else contextlib.nullcontext()
+
+
+def _benchmark(args):
+    # Imported here, it sets up stdout and environment for itself
+    from src import benchmark
+    return benchmark.main(args.benchmark_args)
+
+
+def _add_agent_arguments(parser):
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=DEFAULT_BACKEND, help='Agent implementation')
+    parser.add_argument('--weights', help='Weights to start from')
+    parser.add_argument('--level', default='level1')
+    parser.add_argument('--action-repeat', type=int, default=AI_ACTION_REPEAT,
+                        help='Physics steps per decision')
+    parser.add_argument('--record', metavar='PATH',
+                        help='Log every step to a trajectory file, or one file per actor named PATH.N')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.main', description='Play, train, evaluate or benchmark.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    play = commands.add_parser('play', help='Drive with i, j, k and l (default)')
+    play.add_argument('--level', default='level1')
+    play.set_defaults(run=_play)
+
+    train = commands.add_parser('train', help='Train an agent')
+    _add_agent_arguments(train)
+    train.add_argument('--actors', type=int, default=0,
+                       help='Actor threads for asynchronous training, train in the main thread if 0')
+    train.add_argument('--envs', type=int, default=0, help='Cars to train on at once in a VecGame')
+    train.add_argument('--episodes', type=int, help='Episodes to train for, synchronous training only')
+    train.add_argument('--steps', type=int, help='Steps to train for, VecGame training only')
+    train.add_argument('--seconds', type=float, help='Time limit')
+    train.add_argument('--batch-size', type=int, default=32)
+    train.add_argument('--render', action='store_true', help='Draw the game, synchronous training only')
+    train.add_argument('--report-interval', type=float, default=10, help='Seconds between asynchronous reports')
+    train.add_argument('--save', help='File to save the weights to')
+    train.set_defaults(run=_train)
+
+    evaluate_parser = commands.add_parser('evaluate', help='Play greedy episodes and report the rewards')
+    _add_agent_arguments(evaluate_parser)
+    evaluate_parser.add_argument('--episodes', type=int, default=5)
+    evaluate_parser.add_argument('--max-steps', type=int, default=MAX_EPISODE_STEPS, help='Decisions per episode')
+    evaluate_parser.add_argument('--render', action='store_true')
+    evaluate_parser.set_defaults(run=_evaluate)
+
+    replay = commands.add_parser('replay', help='Play back a recorded trajectory')
+    replay.add_argument('path')
+    replay.add_argument('--episode', type=int, help='Episode to play, all by default')
+    replay.add_argument('--fps', type=float, default=60, help='Frame rate cap')
+    replay.add_argument('--check', action='store_true',
+                        help='Instead of drawing, check the log by sensing and simulating again, and report as JSON')
+    replay.set_defaults(run=_replay)
+
+    # Everything after benchmark goes to src.benchmark, including --help
+    benchmark = commands.add_parser('benchmark', help='Run the benchmark suite, see python -m src.benchmark --help',
+                                    add_help=False)
+    benchmark.set_defaults(run=_benchmark)
+
+    args, extra = parser.parse_known_args(argv)
+    if args.command is None:
+        args = parser.parse_args(['play'])
+    if args.command == 'benchmark':
+        args.benchmark_args = extra
+    elif extra:
+        parser.error('unrecognized arguments: {}'.format(' '.join(extra)))
+    if args.command == 'train' and (args.actors or args.envs) and (args.render or args.episodes is not None):
+        parser.error('--render and --episodes only apply to synchronous training')
+    if args.command == 'train' and args.actors and args.envs:
+        parser.error('--actors and --envs are different ways to train, choose one')
+    if args.command == 'train' and args.steps is not None and not args.envs:
+        parser.error('--steps only applies to training with --envs')
+    if args.command == 'train' and args.record and args.envs:
+        parser.error('--record does not apply to training with --envs')
+    if args.command == 'train' and args.save:
+        # Checked before training, a name the backend can't save to would lose the whole run
+        suffix = load_backend(args.backend).WEIGHTS_SUFFIX
+        if not args.save.endswith(suffix):
+            parser.error('{} weights must be saved to a file ending in {}'.format(args.backend, suffix))
+    return args.run(args)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# Opt-in timing of the phases of a game step, with counters and rolling histograms
+import json
+import sys
+from time import perf_counter
+
+import numpy as np
+
+# Samples kept per phase for percentiles and histograms
+WINDOW = 1000
+# Histogram bin edges in seconds, log-spaced from a microsecond to a second
+HISTOGRAM_EDGES = np.logspace(-6, 0, 25)
+
+
+class Profiler:
+    """
+    Records the wall time of named phases and counts events such as intersection tests. Timing is done with laps, so
+    consecutive phases cost one clock read each:
+
+        lap = profiler.timer()
+        ...
+        lap = profiler.record('physics', lap)
+        ...
+        lap = profiler.record('collision', lap)
+
+    The last WINDOW samples of every phase are kept for percentiles and histograms. Call step once per game step,
+    which also dumps a report every dump_every steps.
+    """
+
+    enabled = True
+
+    def __init__(self, window=WINDOW, dump_every=None, output=None):
+        """
+        :param window: Samples kept per phase
+        :param dump_every: Steps between reports written by step, never if None
+        :param output: Path or stream reports are written to, stderr if None
+        """
+        self.window = window
+        self.dump_every = dump_every
+        self.output = output
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.phases = {}
+        self.counters = {}
+
+    @staticmethod
+    def timer():
+        return perf_counter()
+
+    def record(self, phase, start):
+        """
+        Add the time since start to a phase
+        :return: The current time, the start of the next phase
+        """
+        now = perf_counter()
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = _PhaseStats(self.window)
+        stats.add(now - start)
+        return now
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def step(self):
+        self.steps += 1
+        if self.dump_every and self.steps % self.dump_every == 0:
+            self.dump()
+
+    def report(self):
+        """
+        :return: JSON-serializable summary. Phases have totals over all samples, and percentiles and a histogram over
+        the last window samples. Counters have totals and averages per step
+        """
+        steps = max(self.steps, 1)
+        return {
+            'steps': self.steps,
+            'phases': {name: stats.report(steps) for name, stats in sorted(self.phases.items())},
+            'counters': {name: {'total': total, 'per_step': total / steps}
+                         for name, total in sorted(self.counters.items())},
+        }
+
+    def dump(self, output=None):
+        """
+        Write the report as one line of JSON
+        :param output: Path to append to or stream, self.output if None
+        """
+        output = output or self.output or sys.stderr
+        line = json.dumps(self.report()) + '\n'
+        if isinstance(output, str):
+            with open(output, 'a') as f:
+                f.write(line)
+        else:
+            output.write(line)
+            output.flush()
+
+
+class NullProfiler:
+    """
+    Profiler that records nothing, the default, so instrumented code only pays for a few no-op calls
+    """
+
+    enabled = False
+    steps = 0
+
+    @staticmethod
+    def timer():
+        return None
+
+    @staticmethod
+    def record(phase, start):
+        return None
+
+    def count(self, name, n=1):
+        pass
+
+    def step(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _PhaseStats:
+    def __init__(self, window):
+        self.samples = np.zeros(window)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def report(self, steps):
+        recent = self.samples[:min(self.count, len(self.samples))]
+        counts, _ = np.histogram(recent, np.concatenate(([0], HISTOGRAM_EDGES, [np.inf])))
+        p50, p95, p99 = np.percentile(recent, [50, 95, 99]) * 1e6
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'per_step_us': self.total / steps * 1e6,
+            'mean_us': self.total / self.count * 1e6,
+            'p50_us': p50,
+            'p95_us': p95,
+            'p99_us': p99,
+            'max_us': self.max * 1e6,
+            # Counts below, between and above HISTOGRAM_EDGES
+            'histogram': counts.tolist(),
+        }
@@ -1,14 +1,18 @@
-import codecs
-import heapq
-import json
+import os
+from collections import OrderedDict
 from enum import Enum, unique
+from math import cos, radians, sin
 
+import numpy as np
 import pygame
 import pygame.gfxdraw
 from pygame.math import Vector2
 
 from src.abstracts import Drawable, Entity
-from src.helpers import segment_intersection, rotate_line, translate_shape, rotate_shape
+from src.collision import pairwise_params, line_array, segment_params, swept_box, transform_lines
+from src.helpers import rotate_line
+from src.levelfile import load_level
+from src.profiler import NULL_PROFILER
 
 MAX_VEL = 300
 ACC = 200
@@ -17,6 +21,24 @@ LASER_LENGTH = 300
 TURNSPEED = 200
 FRICTION = 0.03
 IDLE_BREAK = 0.97
+CHECKPOINT_REWARD = 1
+# Simulated seconds a car may go without reaching the next checkpoint
+CHECKPOINT_TIMEOUT = 3
+# Length of one physics step in simulated seconds
+PHYSICS_DT = 1 / 60
+# Angle in degrees the drawn car's rotation is rounded to, and rotated car sprites kept for reuse
+SPRITE_ANGLE_STEP = 2
+SPRITE_CACHE_SIZE = 512
+
+# Observation layout. Car.observation is a float32 vector of OBS_SIZE entries: the car's speed at OBS_VELOCITY, then
+# the distance to the nearest wall along each laser at OBS_LASERS, in LASER_NAMES order (LASER_LENGTH if nothing is hit)
+LASER_NAMES = ('front', 'front_left', 'front_left_diag', 'front_left_perp', 'front_right', 'front_right_diag',
+               'front_right_perp', 'back', 'back_left_diag', 'back_right_diag')
+OBS_VELOCITY = 0
+OBS_LASERS = slice(1, 1 + len(LASER_NAMES))
+OBS_SIZE = 1 + len(LASER_NAMES)
+
+LEVEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'levels')
 
 
 @unique
@@ -41,6 +63,8 @@ class Sprites:
         self.car_sprite = pygame.Surface(CAR_DIM)
         self.car_sprite = self.car_sprite.convert_alpha()
         self.make_car_sprite()
+        # Rotated car sprites by (angle step, colliding), least recently used first
+        self._rotated_cars = OrderedDict()
 
     def make_car_sprite(self):
         self.car_sprite.fill(Colors.CAR)
@@ -48,14 +72,132 @@ class Sprites:
         self.car_sprite.fill(Colors.CAR_WINDSHIELD, (w - 7, 0, 7, h))
         pygame.draw.rect(self.car_sprite, (0, 0, 0, 255), self.car_rect, 2)
 
+    def rotated_car(self, angle, colliding):
+        """
+        Car sprite rotated to angle, rounded to SPRITE_ANGLE_STEP. Rotating is by far the most expensive part of
+        drawing, so sprites are cached, with the least recently used dropped beyond SPRITE_CACHE_SIZE
+        :param angle: Car angle in degrees
+        :param colliding: Whether to draw the car in the collision color
+        """
+        key = (int(round(angle / SPRITE_ANGLE_STEP)) % (360 // SPRITE_ANGLE_STEP), colliding)
+        sprite = self._rotated_cars.get(key)
+        if sprite is not None:
+            self._rotated_cars.move_to_end(key)
+            return sprite
+        sprite = self.car_sprite.copy()
+        if colliding:
+            sprite.fill((0, 0, 255))
+        sprite = pygame.transform.rotozoom(sprite, -key[0] * SPRITE_ANGLE_STEP, 1)
+        self._rotated_cars[key] = sprite
+        if len(self._rotated_cars) > SPRITE_CACHE_SIZE:
+            self._rotated_cars.popitem(last=False)
+        return sprite
+
+
+class SimClock:
+    """
+    Fixed-timestep simulation clock. Physics always advances in steps of physics_dt, so results don't depend on the
+    frame rate. Elapsed real time is accumulated and spent in whole steps, while agents that don't follow a wall clock
+    take action_repeat steps per decision.
+    """
+
+    def __init__(self, physics_dt=PHYSICS_DT, action_repeat=1):
+        """
+        :param physics_dt: Length of a physics step in simulated seconds
+        :param action_repeat: Physics steps per act call without a dt, i.e. the frame skip
+        """
+        self.physics_dt = physics_dt
+        self.action_repeat = action_repeat
+        self.accumulator = 0.
+        self.steps_taken = 0
+
+    @property
+    def time(self):
+        # Simulated seconds since the clock was created
+        return self.steps_taken * self.physics_dt
+
+    def steps(self, dt=None):
+        """
+        Number of physics steps to take now
+        :param dt: Elapsed time to catch up on, or None for action_repeat steps
+        """
+        if dt is None:
+            steps = self.action_repeat
+        else:
+            self.accumulator += dt
+            # Tolerate rounding, so that dt == physics_dt is always exactly one step
+            steps = int(self.accumulator / self.physics_dt + 1e-6)
+            self.accumulator = max(0., self.accumulator - steps * self.physics_dt)
+        self.steps_taken += steps
+        return steps
+
+
+class GameState:
+    """
+    Simulation state of N cars as arrays: position and velocity (Nx2), angle in degrees, checkpoint index and seconds
+    since the last checkpoint (N), and the current observation (NxOBS_SIZE). Taken with Game.snapshot or
+    VecGame.snapshot and put back with restore, so resets and branching rollouts are array copies instead of rebuilding
+    cars. Indexing, repeat and stack select, clone and combine states, e.g. to start a whole VecGame from one Game.
+    """
+
+    FIELDS = ('pos', 'vel', 'angle', 'check_idx', 'since_checkpoint', 'observation')
+
+    def __init__(self, pos, vel, angle, check_idx, since_checkpoint, observation):
+        self.pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+        self.vel = np.asarray(vel, dtype=float).reshape(-1, 2)
+        self.angle = np.asarray(angle, dtype=float).reshape(-1)
+        self.check_idx = np.asarray(check_idx, dtype=int).reshape(-1)
+        self.since_checkpoint = np.asarray(since_checkpoint, dtype=float).reshape(-1)
+        self.observation = np.asarray(observation, dtype=np.float32).reshape(-1, OBS_SIZE)
+
+    @classmethod
+    def empty(cls, n):
+        return cls(np.zeros((n, 2)), np.zeros((n, 2)), np.zeros(n), np.zeros(n, dtype=int), np.zeros(n),
+                   np.zeros((n, OBS_SIZE), dtype=np.float32))
+
+    @classmethod
+    def stack(cls, states):
+        return cls(*(np.concatenate([getattr(state, field) for state in states]) for field in cls.FIELDS))
+
+    def __len__(self):
+        return len(self.angle)
+
+    def __getitem__(self, index):
+        # State of the selected cars, a batch of one for a single index
+        index = [index] if np.isscalar(index) else index
+        return GameState(*(getattr(self, field)[index] for field in self.FIELDS))
+
+    def repeat(self, n):
+        """
+        :return: State with every car repeated n times in a row
+        """
+        return GameState(*(np.repeat(getattr(self, field), n, axis=0) for field in self.FIELDS))
+
+    def copy(self):
+        return GameState(*(getattr(self, field).copy() for field in self.FIELDS))
+
 
 class Game:
-    def __init__(self, init_graphics=False):
+    def __init__(self, init_graphics=False, level='level1', physics_dt=PHYSICS_DT, action_repeat=1, profiler=None,
+                 distance_field=False, recorder=None):
+        """
+        :param init_graphics: Whether to open a window
+        :param level: Name of the level directory
+        :param physics_dt: Length of a physics step in simulated seconds
+        :param action_repeat: Physics steps per act call without a dt. Cars only sense on the last one
+        :param profiler: src.profiler.Profiler to time the phases of act and render with, nothing is timed if None
+        :param distance_field: Collide with walls through lookups in the level's distance field, whose cost doesn't
+        grow with the number of walls, instead of exact segment tests
+        :param recorder: src.recorder.Recorder to log every act call to
+        """
+        self.distance_field = distance_field
+        self.recorder = recorder
+        self.clock = SimClock(physics_dt, action_repeat)
+        self.profiler = profiler or NULL_PROFILER
         self.screen = None
         self.bg = None
         self.sprites = None
-        self.logic_buffer = None
-        self.level = Level(self)
+        self.level = Level(self, level)
 
         if init_graphics:
             pygame.init()
@@ -63,37 +205,122 @@ class Game:
             self.screen = pygame.display.set_mode(self.level.dimensions)
             self.sprites = Sprites()
 
+        # Screen areas drawn over in the last frame, None until a full frame has been drawn
+        self._dirty = None
         self.entities = []
         self.drawables = []
         self.drawables.append(self.level)
         self.car = Car(self)
         self.entities.append(self.car)
         self.drawables.append(self.car)
-
-    def act(self, actions, dt):
-        sensors = {}
-        for entity in self.entities:
-            sensors = {**sensors, **entity.act(actions, dt)}
-        if sensors.get('car', {}).get('done', False):
+        # Every reset copies this back instead of sensing at the start again
+        self._start_state = self.snapshot()
+        if recorder is not None:
+            recorder.start(self)
+
+    def act(self, actions, dt=None):
+        """
+        Step the game in fixed physics steps, holding the actions for all of them
+        :param actions: List of Controls
+        :param dt: Elapsed time to simulate, e.g. real time for a player. If None, the game takes action_repeat steps
+        :return: (observation, reward, done). The observation is the car's buffer, laid out as described at OBS_SIZE
+        and overwritten in place by the next step, so copy it to keep it. The reward is summed over the steps taken.
+        When done, the game resets itself and the final observation is returned as a copy, while the buffer holds the
+        first observation of the next episode.
+        """
+        lap = self.profiler.timer()
+        car = self.car
+        steps = self.clock.steps(dt)
+        reward = 0
+        taken = 0
+        for step in range(steps):
+            for entity in self.entities:
+                entity.act(actions, self.clock.physics_dt, sense=step == steps - 1)
+            reward += car.reward
+            taken += 1
+            if car.done:
+                break
+        observation, done = car.observation, car.done
+        if self.recorder is not None:
+            self.recorder.record(self, actions, taken, reward, done)
+        if done:
+            observation = observation.copy()
             self.reset()
-        return sensors
+        self.profiler.record('step', lap)
+        self.profiler.step()
+        return observation, reward, done
 
     def reset(self):
-        self.level.reset()
-        # TODO: Find a better way to reset car
-        self.drawables.remove(self.car)
-        self.entities.remove(self.car)
-        self.car = Car(self)
-        self.entities.append(self.car)
-        self.drawables.append(self.car)
-
-    def render(self, dt):
+        self.restore(self._start_state)
+
+    def snapshot(self, out=None, index=0):
+        """
+        :param out: GameState to write the state into at index instead of allocating a new one
+        :return: GameState of the car and level
+        """
+        car = self.car
+        if out is None:
+            out = GameState.empty(1)
+        out.pos[index] = car.pos
+        out.vel[index] = car.vel
+        out.angle[index] = car.angle
+        out.check_idx[index] = self.level._check_idx
+        out.since_checkpoint[index] = car.since_checkpoint
+        out.observation[index] = car.observation
+        return out
+
+    def restore(self, state, index=0):
+        """
+        Put the car and level into a state taken with snapshot, without sensing again. While recording, only the start
+        state can be restored, which begins a new episode in the log. Recorded episodes are replayed from the start of
+        the level, so one continuing from any other state couldn't be
+        :param index: Car in the state to take
+        :return: The observation buffer
+        :raises ValueError: If recording and state isn't the start state
+        """
+        if self.recorder is not None:
+            if state is not self._start_state:
+                raise ValueError('Only the start state can be restored while recording')
+            self.recorder.reset()
+        car = self.car
+        car.pos = Vector2(*state.pos[index])
+        car.vel = Vector2(*state.vel[index])
+        car.angle = float(state.angle[index])
+        car.since_checkpoint = float(state.since_checkpoint[index])
+        car.reward = 0
+        car.done = False
+        car.checkpoint = False
+        car.observation[:] = state.observation[index]
+        # Laser hits for drawing, recovered from the observed distances
+        car._pose(car._laser_local, car._laser_world)
+        np.divide(car.observation[OBS_LASERS], LASER_LENGTH, out=car._laser_t)
+        car._laser_t[car._laser_t >= 1] = np.inf
+        self.level._check_idx = int(state.check_idx[index])
+        return car.observation
+
+    def render(self, dt, full=False):
+        """
+        Draw a frame. After the first one, only the areas drawn over in the last frame are restored from the level's
+        background and only those and the newly drawn areas are sent to the display
+        :param full: Redraw and update the whole screen
+        """
+        # Drawables only read simulation state, so rendering can be skipped entirely when running headless
+        lap = self.profiler.timer()
+        full = full or self._dirty is None
+        if full:
+            self.level.draw_background(self.screen)
+        else:
+            self.level.restore(self.screen, self._dirty)
+        rects = []
         for drawable in self.drawables:
-            drawable.draw(self.screen, dt)
-        # Compose layers
-        if self.logic_buffer is not None:
-            self.screen.blit(self.logic_buffer, (0, 0))
-        pygame.display.flip()
+            rects += drawable.draw(self.screen, dt)
+        lap = self.profiler.record('render', lap)
+        if full:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self._dirty + rects)
+        self._dirty = rects
+        self.profiler.record('flip', lap)
 
 
 class Car(Entity):
@@ -102,31 +329,56 @@ class Car(Entity):
         return 2
 
     def draw(self, surface, dt):
-        car_buf = self.game.sprites.car_sprite.copy()
-        if self.colliding:
-            car_buf.fill((0, 0, 255))
-        car_buf = pygame.transform.rotozoom(car_buf, -self.angle, 1)
-        surface.blit(car_buf, self.pos - Vector2(car_buf.get_size()) / 2)
+        sprite = self.game.sprites.rotated_car(self.angle, self.colliding)
+        rects = [surface.blit(sprite, self.pos - Vector2(sprite.get_size()) / 2)]
+        # Laser hits from the last simulation step
+        for hit in self.laser_hits:
+            rects.append(pygame.draw.circle(surface, (0, 0, 0), [int(i) for i in hit], 3))
+        return rects
 
     def __init__(self, game):
         self.game = game
-        level = game.level
-        print('start: {}'.format(level.start))
-        self.pos = Vector2(level.start)
-        self.vel = Vector2(0, 0)
-        self.angle = level.start_angle
         self.bounding_box = None
         self.colliding = True
-        self.since_checkpoint = 0
-        self.sensors = {}
+        # Outputs of the last step. The observation buffer is allocated once and written in place
+        self.observation = np.zeros(OBS_SIZE, dtype=np.float32)
+        self.box = self._init_box()
+        self.lasers = self._init_lasers()
+        # Geometry relative to the car's center as line arrays, and buffers it's posed into every step
+        center = np.tile(np.array(CAR_DIM) / 2, 2)[:, None]
+        self._box_local = line_array(self.box) - center
+        self._laser_local = line_array(self.lasers.values()) - center
+        self._box_world = np.empty_like(self._box_local)
+        self._previous_box = np.empty_like(self._box_local)
+        self._sweep = np.empty((4, 2 * self._box_local.shape[1]))
+        self._laser_world = np.empty_like(self._laser_local)
+        self._laser_t = np.empty(self._laser_local.shape[1])
+        self._scratch = np.empty((2, max(self._box_local.shape[1], self._laser_local.shape[1])))
+        self.reset()
+
+    def reset(self):
+        # Back to the start of the level, reusing this car's buffers
+        level = self.game.level
+        self.pos = Vector2(*level.start)
+        self.vel = Vector2(0, 0)
+        self.angle = level.start_angle
+        # Simulated seconds since the last checkpoint
+        self.since_checkpoint = 0.
+        self.reward = 0
+        self.done = False
+        self.checkpoint = False
+        self.sense()
+
+    @staticmethod
+    def _init_box():
         # Make bounding box as array of lines
         w, h = CAR_DIM
-        self.box = [(Vector2(0, e), Vector2(w, e)) for e in (0, h)] + [(Vector2(e, 0), Vector2(e, h)) for e in (0, w)]
-        self.lasers = self._init_lasers()
+        return [(Vector2(0, e), Vector2(w, e)) for e in (0, h)] + [(Vector2(e, 0), Vector2(e, h)) for e in (0, w)]
 
     @staticmethod
     def _init_lasers():
         w, h = CAR_DIM
+        # Keys in LASER_NAMES order
         lasers = {
             'front': [Vector2(w, h / 2), Vector2(w + LASER_LENGTH, h / 2)],
             'front_left': rotate_line([Vector2(w, 0), Vector2(w + LASER_LENGTH, 0)], Vector2(w, 0), -5),
@@ -141,14 +393,18 @@ class Car(Entity):
         }
         return lasers
 
-    def act(self, actions, dt):
-        self.sensors = {
-        }
-        self.since_checkpoint += 1
-        if self.since_checkpoint > 60 * 3:
-            self.sensors['done'] = True
-        self.game.logic_buffer = pygame.Surface(self.game.screen.get_size(), pygame.SRCALPHA, 32)
-        self.game.logic_buffer = self.game.logic_buffer.convert_alpha()
+    def act(self, actions, dt, sense=True):
+        # Pure simulation step: physics, sensing and reward. Nothing here may touch pygame surfaces, see draw()
+        # Sensing can be skipped on all but the last of several steps per decision, unless the car is done
+        self.reward = 0
+        self.checkpoint = False
+        self.since_checkpoint += dt
+        # Half a step of slack against rounding in the accumulated time
+        self.done = self.since_checkpoint > CHECKPOINT_TIMEOUT + dt / 2
+        profiler = self.game.profiler
+        lap = profiler.timer()
+        self._pose(self._box_local, self._previous_box)
+        lap = profiler.record('pose', lap)
         dir = Vector2()
         dir.from_polar((1, self.angle))
         if Controls.FRONT not in actions:
@@ -170,51 +426,73 @@ class Car(Entity):
         self.vel -= (self.vel - dir.dot(self.vel) * dir) * FRICTION
 
         self.pos += self.vel * dt
-
-        # Collision
-        # Translate and rotate
-        box = translate_shape(rotate_shape(self.box, CAR_DIM / 2, self.angle), self.pos - CAR_DIM / 2)
-        lasers = translate_shape(rotate_shape(self.lasers.values(), CAR_DIM / 2, self.angle), self.pos - CAR_DIM / 2)
-        # Collide lasers
-        laserdists = []
-        for laser in lasers:
-            intersections = []
-            for wall in self.game.level.wall_lines:
-                isect = segment_intersection(laser, wall)
-                if isect is not None:
-                    heapq.heappush(intersections, ((isect - laser[0]).length(), isect))
-            if len(intersections):
-                isect = heapq.heappop(intersections)
-                # print(isect)
-                laserdists.append(isect[0])
-                pygame.draw.circle(self.game.logic_buffer, (0, 0, 0), [int(i) for i in isect[1]], 3)
-            else:
-                laserdists.append(LASER_LENGTH)
-            # pygame.draw.line(self.game.logic_buffer, (255, 0, 0), *laser, 2)
-        self.sensors['lasers'] = dict(zip(self.lasers.keys(), laserdists))
-        for line in box:
-            # pygame.draw.line(self.game.logic_buffer, (0, 0, 0), *line, 4)
-            for wall in self.game.level.wall_lines:
-                if segment_intersection(line, wall) is not None:
-                    # pygame.draw.line(self.game.logic_buffer, (0, 0, 0), *wall, 4)
-                    self.sensors['done'] = True
-                    break
-            # Collide with checkpoint
-            if segment_intersection(line, self.game.level.current_checkpoint):
-                self.sensors['checkpoint'] = True
-                self.since_checkpoint = 0
-                self.game.level.increment_checkpoint()
-        # Collide checkpoint
-        # print(self.pos)
-        # self.angle += 1
-        return self.sense()
+        lap = profiler.record('physics', lap)
+        box = self._pose(self._box_local, self._box_world)
+        lap = profiler.record('pose', lap)
+
+        # Collision, swept from the previous pose so that fast cars can't pass through walls or checkpoints
+        level = self.game.level
+        sweep = swept_box(self._previous_box, box, out=self._sweep)
+        if self.game.distance_field:
+            # Off the track or touching a wall somewhere along the swept lines
+            if np.min(level.distance_field.clearance(sweep)) <= 0:
+                self.done = True
+        else:
+            # Collide with the walls in nearby cells only
+            nearby = level.wall_index.query_lines(sweep)
+            if np.any(~np.isinf(pairwise_params(sweep, level.wall_array[:, nearby]))):
+                self.done = True
+            profiler.count('wall_tests', sweep.shape[1] * nearby.size)
+        lap = profiler.record('collision', lap)
+        # Collide with checkpoints, a long step may pass more than one
+        for _ in range(len(level.checkpoints)):
+            profiler.count('checkpoint_tests', sweep.shape[1])
+            if np.all(np.isinf(segment_params(sweep, np.reshape(level.current_checkpoint, (4, 1))))):
+                break
+            self.checkpoint = True
+            self.reward += CHECKPOINT_REWARD
+            self.since_checkpoint = 0
+            level.increment_checkpoint()
+        profiler.record('checkpoint', lap)
+        if sense or self.done:
+            return self.sense()
+        return self.observation
+
+    def _pose(self, local, out):
+        """
+        Move car-local lines to the car's current pose
+        :param local: Line array relative to the car's center
+        :param out: Buffer of the same shape to write the world-space lines to
+        :return: out
+        """
+        angle = radians(self.angle)
+        return transform_lines(local, cos(angle), sin(angle), self.pos, out, self._scratch[:, :local.shape[1]])
 
     def sense(self):
-        self.sensors = {
-            'velocity': self.vel.length(),
-            **self.sensors
-        }
-        return {'car': self.sensors}
+        """
+        Write the observation at the current pose into the observation buffer
+        :return: The observation buffer
+        """
+        profiler = self.game.profiler
+        lap = profiler.timer()
+        self.observation[OBS_VELOCITY] = self.vel.length()
+        lasers = self._pose(self._laser_local, self._laser_world)
+        lap = profiler.record('pose', lap)
+        # Collide lasers through the level's wall grid. Every laser is LASER_LENGTH long, so the hit parameter scales
+        # directly to a distance
+        stats = profiler.counters if profiler.enabled else None
+        self._laser_t[:], _ = self.game.level.wall_index.cast(lasers, stats=stats)
+        profiler.record('lasers', lap)
+        np.minimum(self._laser_t, 1, out=self.observation[OBS_LASERS])
+        self.observation[OBS_LASERS] *= LASER_LENGTH
+        return self.observation
+
+    @property
+    def laser_hits(self):
+        # Points where the lasers of the last sense hit walls, only needed for drawing
+        hit = ~np.isinf(self._laser_t)
+        lasers, t = self._laser_world[:, hit], self._laser_t[hit]
+        return [tuple(p) for p in (lasers[0:2] + t * (lasers[2:4] - lasers[0:2])).T]
 
 
 class Level(Drawable):
@@ -223,12 +501,20 @@ class Level(Drawable):
         return -1
 
     def draw(self, surface, dt):
+        # Current checkpoint, the rest of the level is background
+        return [pygame.draw.line(surface, (0, 255, 0), *self.checkpoints[self._check_idx], 5)]
+
+    def draw_background(self, surface):
         if self.bg_buffer is None:
             self._init_bg(self.game)
-        # Draw BG buffer
         surface.blit(self.bg_buffer, (0, 0))
-        # Current checkpoint
-        pygame.draw.line(surface, (0, 255, 0), *self.checkpoints[self._check_idx], 5)
+
+    def restore(self, surface, rects):
+        # Draw the background over the given areas only
+        if self.bg_buffer is None:
+            self._init_bg(self.game)
+        for rect in rects:
+            surface.blit(self.bg_buffer, rect, rect)
 
     def _init_bg(self, game):
         # Initialize permanent background buffer
@@ -242,38 +528,43 @@ class Level(Drawable):
         for checkpoint in self.checkpoints:
             pygame.draw.line(self.bg_buffer, Colors.BG, *checkpoint)
 
-    def __init__(self, game):
+    def __init__(self, game, name='level1'):
         self.game = game
-        self.walls = []
-        self.wall_lines = []
-        self.checkpoints = []
+        self.name = name
         self._check_idx = -1
-        self.start = []
-        self.start_angle = []
-        self.checkpoints_reversed = True
-        self.dimensions = (1366, 768)
-        self._load_file()
-        # Convert wall points into lines
-        for walls in self.walls:
-            for i in range(0, len(walls)):
-                self.wall_lines.append((Vector2(walls[i - 1]), Vector2(walls[i])))
+        # Geometry is shared read-only between all levels loaded from the same file
+        self.data = load_level(os.path.join(LEVEL_DIR, name))
+        self.walls = self.data.walls
+        self.wall_array = self.data.wall_array
+        self.wall_index = self.data.wall_index
+        self.checkpoints = self.data.checkpoints
+        self.checkpoint_array = self.data.checkpoint_array
+        self.start = self.data.start
+        self.start_angle = self.data.start_angle
+        self.checkpoints_reversed = self.data.checkpoints_reversed
+        self.dimensions = self.data.dimensions
         # Initialize BG buffer
         self.bg_buffer = None
 
+    @property
+    def distance_field(self):
+        return self.data.distance_field
+
+    @property
+    def wall_lines(self):
+        # Walls as pairs of Vector2, for scalar code
+        return [(Vector2(x1, y1), Vector2(x2, y2)) for x1, y1, x2, y2 in self.wall_array.T]
+
     @property
     def current_checkpoint(self):
         return self.checkpoints[self._check_idx]
 
     def increment_checkpoint(self):
-        self._check_idx = (self._check_idx - 1 if self.checkpoints_reversed else 1) % len(self.checkpoints)
+        self._check_idx = (self._check_idx + self.checkpoint_step) % len(self.checkpoints)
+
+    @property
+    def checkpoint_step(self):
+        return -1 if self.checkpoints_reversed else 1
 
     def reset(self):
         self._check_idx = -1
-
-    def _load_file(self):
-        with codecs.open('../assets/levels/level1/level.json', 'r', encoding='UTF-8') as f:
-            level = json.load(f)
-        self.walls = level['walls']
-        self.checkpoints = level['checkpoints']
-        self.start = level['start']
-        self.start_angle = level['startangle']
@@ -0,0 +1,232 @@
+# Binary trajectory logs of Game.act, and playback of recorded episodes without the agent that played them
+#
+#   game = Game(recorder=Recorder('run.traj'))
+#   ...
+#   game.recorder.close()
+#   python -m src.main replay run.traj --episode 3
+import json
+import struct
+
+import numpy as np
+import pygame
+from pygame.math import Vector2
+from pygame.time import Clock
+
+from src.racecar_game import Game, Controls, OBS_SIZE
+
+MAGIC = b'QRTRAJ1\n'
+# One record per Game.act call, describing the state after it and before a reset if the episode ended
+STEP_DTYPE = np.dtype([
+    ('episode', np.uint32),
+    ('step', np.uint32),
+    # Bit c is set if Controls(c) was pressed
+    ('actions', np.uint8),
+    # Physics steps taken, fewer than requested if the episode ended
+    ('physics_steps', np.uint16),
+    ('reward', np.int32),
+    ('done', np.bool_),
+    ('checkpoint', np.int16),
+    ('x', np.float32),
+    ('y', np.float32),
+    ('angle', np.float32),
+    ('vx', np.float32),
+    ('vy', np.float32),
+    ('observation', np.float32, (OBS_SIZE,)),
+])
+# Records buffered in memory before they're written out together
+CHUNK_SIZE = 1024
+
+
+class Recorder:
+    """
+    Streams the actions, pose and observation of every Game.act call into a file, as a header followed by raw records
+    of STEP_DTYPE. Records go into a preallocated chunk that is written with a single call once full, so recording
+    costs one row assignment per step. Pass it to Game, and close it when done to write the last partial chunk.
+    """
+
+    def __init__(self, path=None, chunk_size=CHUNK_SIZE):
+        """
+        :param path: File to write, overwritten if it exists. If None, records are kept in memory, see to_array
+        :param chunk_size: Records buffered between writes
+        """
+        self.path = path
+        self.file = None
+        self._chunks = []
+        self.chunk = np.zeros(chunk_size, dtype=STEP_DTYPE)
+        self.size = 0
+        self.episode = 0
+        self.step = 0
+        self.records = 0
+
+    def start(self, game):
+        """
+        Write the header describing the game, called by Game
+        """
+        header = json.dumps({
+            'dtype': STEP_DTYPE.descr,
+            'level': game.level.name,
+            'physics_dt': game.clock.physics_dt,
+            'action_repeat': game.clock.action_repeat,
+            'distance_field': game.distance_field,
+        }).encode()
+        if self.path is not None:
+            self.file = open(self.path, 'wb')
+            self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+    def record(self, game, actions, physics_steps, reward, done):
+        car = game.car
+        mask = 0
+        for action in actions:
+            mask |= 1 << action.value
+        self.chunk[self.size] = (self.episode, self.step, mask, physics_steps, reward, done, game.level._check_idx,
+                                 car.pos.x, car.pos.y, car.angle, car.vel.x, car.vel.y, car.observation)
+        self.size += 1
+        self.records += 1
+        self.step += 1
+        if self.size == len(self.chunk):
+            self.flush()
+
+    def reset(self):
+        # Called by Game.restore, e.g. on reset, the next record starts a new episode
+        if self.step:
+            self.episode += 1
+            self.step = 0
+
+    def flush(self):
+        if self.file is None:
+            self._chunks.append(self.chunk[:self.size].copy())
+            self.size = 0
+            return
+        if self.size:
+            self.chunk[:self.size].tofile(self.file)
+            self.size = 0
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None and not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def to_array(self):
+        # All records of an in-memory recorder
+        return np.concatenate(self._chunks + [self.chunk[:self.size]])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Trajectory:
+    """
+    A recorded log. Records are memory-mapped, so even long logs open instantly. A partly written last record, e.g.
+    from a run that was killed, is ignored.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a trajectory log'.format(path))
+            length, = struct.unpack('<I', f.read(4))
+            self.header = json.loads(f.read(length).decode())
+            offset = f.tell()
+            f.seek(0, 2)
+            count = (f.tell() - offset) // STEP_DTYPE.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=STEP_DTYPE, mode='r', offset=offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=STEP_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def episodes(self):
+        # Episode numbers in the log, the last one may be unfinished
+        return np.unique(self.records['episode'])
+
+    def episode(self, number):
+        """
+        :return: Records of one episode, in order
+        """
+        return self.records[self.records['episode'] == number]
+
+    def game(self, init_graphics=False, recorder=None):
+        # A Game set up like the recorded one
+        return Game(init_graphics=init_graphics, level=self.header['level'], physics_dt=self.header['physics_dt'],
+                    action_repeat=self.header['action_repeat'], distance_field=self.header['distance_field'],
+                    recorder=recorder)
+
+
+def actions_of(record):
+    # Controls pressed in a record
+    return [control for control in Controls if record['actions'] >> control.value & 1]
+
+
+def set_pose(game, record):
+    """
+    Put the car and level of a game into the state of a record
+    """
+    car = game.car
+    car.pos = Vector2(float(record['x']), float(record['y']))
+    car.vel = Vector2(float(record['vx']), float(record['vy']))
+    car.angle = float(record['angle'])
+    game.level._check_idx = int(record['checkpoint'])
+
+
+def rederive_observations(trajectory, records, game=None):
+    """
+    Sense again at every recorded pose, e.g. to check a log against a changed sensor model
+    :param records: Records to sense at, e.g. trajectory.episode(n)
+    :param game: Game to sense in, one set up like the recorded one if None
+    :return: len(records) x OBS_SIZE matrix of observations
+    """
+    game = game or trajectory.game()
+    observations = np.empty((len(records), OBS_SIZE), dtype=np.float32)
+    for i, record in enumerate(records):
+        set_pose(game, record)
+        observations[i] = game.car.sense()
+    return observations
+
+
+def resimulate(trajectory, records):
+    """
+    Run the recorded actions again from the start of the level. The simulation is deterministic, so this reproduces
+    the records of a complete episode
+    :param records: Records of one episode starting at its first step, e.g. trajectory.episode(n)
+    :return: Records of the rerun
+    """
+    recorder = Recorder()
+    game = trajectory.game(recorder=recorder)
+    dt = game.clock.physics_dt
+    for record in records:
+        _, _, done = game.act(actions_of(record), record['physics_steps'] * dt)
+        if done:
+            break
+    rerun = recorder.to_array()
+    rerun['episode'] = records['episode'][:len(rerun)]
+    return rerun
+
+
+def play(trajectory, records, fps=60):
+    """
+    Render recorded records in a window at their recorded pace, capped at fps frames per second
+    :return: False if the window was closed before the end
+    """
+    game = trajectory.game(init_graphics=True)
+    clock = Clock()
+    physics_dt = trajectory.header['physics_dt']
+    try:
+        for record in records:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                    return False
+            set_pose(game, record)
+            game.car.sense()
+            # Wait as long as the recorded steps took in simulated time, as far as the frame rate allows
+            clock.tick(min(fps, 1 / max(record['physics_steps'] * physics_dt, 1e-6)))
+            game.render(record['physics_steps'] * physics_dt)
+    finally:
+        pygame.quit()
+    return True
@@ -0,0 +1,191 @@
+# Experience replay storage backed by preallocated NumPy arrays
+import os
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """
+    Ring buffer of (state, action, reward, next_state, done) transitions. Every field is one preallocated array, so
+    inserting is a row write and sampling a batch is a single fancy-indexing gather per field. With memmap_dir set the
+    arrays are memory-mapped .npy files, so buffers with millions of transitions don't have to live on the heap.
+    """
+
+    def __init__(self, capacity, state_shape, state_dtype=np.float32, memmap_dir=None, seed=None):
+        """
+        :param capacity: Maximum number of transitions, the oldest are overwritten first
+        :param state_shape: Shape of a single state, int or tuple
+        :param state_dtype: Storage type of states
+        :param memmap_dir: Directory to keep the arrays in as memory-mapped files, in memory if None
+        :param seed: Seed for sampling
+        """
+        self.capacity = capacity
+        self.state_shape = tuple(np.atleast_1d(state_shape))
+        self.memmap_dir = memmap_dir
+        self.rng = np.random.default_rng(seed)
+        self.states = self._allocate('states', self.state_shape, state_dtype)
+        self.actions = self._allocate('actions', (), np.int64)
+        self.rewards = self._allocate('rewards', (), np.float32)
+        self.next_states = self._allocate('next_states', self.state_shape, state_dtype)
+        self.dones = self._allocate('dones', (), np.bool_)
+        self.index = 0
+        self.size = 0
+
+    def _allocate(self, name, shape, dtype):
+        shape = (self.capacity,) + shape
+        if self.memmap_dir is None:
+            return np.zeros(shape, dtype=dtype)
+        os.makedirs(self.memmap_dir, exist_ok=True)
+        path = os.path.join(self.memmap_dir, name + '.npy')
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def __len__(self):
+        return self.size
+
+    def append(self, state, action, reward, next_state, done):
+        i = self.index
+        self.states[i] = np.reshape(state, self.state_shape)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = np.reshape(next_state, self.state_shape)
+        self.dones[i] = done
+        self.index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return i
+
+    def extend(self, states, actions, rewards, next_states, dones):
+        """
+        Insert a batch of transitions, e.g. one step of a VecGame
+        :return: Indices the transitions were written to
+        """
+        n = len(actions)
+        indices = (self.index + np.arange(n)) % self.capacity
+        self.states[indices] = np.reshape(states, (n,) + self.state_shape)
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.next_states[indices] = np.reshape(next_states, (n,) + self.state_shape)
+        self.dones[indices] = dones
+        self.index = (self.index + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        return indices
+
+    def sample_indices(self, batch_size):
+        return self.rng.integers(0, self.size, batch_size)
+
+    def sample(self, batch_size):
+        """
+        Sample transitions uniformly, with replacement
+        :return: (states, actions, rewards, next_states, dones) as contiguous arrays of batch_size rows
+        """
+        return self.gather(self.sample_indices(batch_size))
+
+    def gather(self, indices):
+        return (self.states[indices], self.actions[indices], self.rewards[indices], self.next_states[indices],
+                self.dones[indices])
+
+    def flush(self):
+        # Write memory-mapped arrays to disk
+        if self.memmap_dir is not None:
+            for array in (self.states, self.actions, self.rewards, self.next_states, self.dones):
+                array.flush()
+
+
+class SumTree:
+    """
+    Binary tree over N leaf priorities where every node holds the sum of its children. Updating leaves and finding the
+    leaf at a given prefix sum are O(log N), and both are vectorized over a batch of leaves or values.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # Leaves start at index `leaves`, the root is at index 1
+        self.depth = max(0, int(np.ceil(np.log2(capacity))))
+        self.leaves = 1 << self.depth
+        self.tree = np.zeros(2 * self.leaves)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def __getitem__(self, indices):
+        return self.tree[self.leaves + np.asarray(indices)]
+
+    def update(self, indices, priorities):
+        nodes = self.leaves + np.asarray(indices)
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        Leaves where the running sum of priorities passes each value
+        :param values: Array of values in [0, total)
+        :return: Leaf indices
+        """
+        values = np.array(values, dtype=float)
+        nodes = np.ones(values.shape, dtype=int)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            right = values >= self.tree[left]
+            values -= np.where(right, self.tree[left], 0)
+            nodes = left + right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer that samples transitions in proportion to priority ** alpha, with priorities kept in a SumTree.
+    New transitions get the highest priority seen so far, so everything is replayed at least about once. Sampling
+    returns importance-sampling weights that undo the bias, annealed from beta to 1 over beta_steps samples.
+    """
+
+    def __init__(self, capacity, state_shape, alpha=0.6, beta=0.4, beta_steps=100000, priority_eps=1e-3, **kwargs):
+        super().__init__(capacity, state_shape, **kwargs)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_start = beta
+        self.beta_steps = beta_steps
+        self.priority_eps = priority_eps
+        self.max_priority = 1.0
+        self.tree = SumTree(capacity)
+        self.samples = 0
+
+    def append(self, state, action, reward, next_state, done):
+        i = super().append(state, action, reward, next_state, done)
+        self.tree.update([i], self.max_priority)
+        return i
+
+    def extend(self, states, actions, rewards, next_states, dones):
+        indices = super().extend(states, actions, rewards, next_states, dones)
+        self.tree.update(indices, self.max_priority)
+        return indices
+
+    def sample_indices(self, batch_size):
+        # Stratified: one value from each of batch_size equal slices of the total priority
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * (self.tree.total / batch_size)
+        return np.minimum(self.tree.find(values), self.size - 1)
+
+    def sample_weighted(self, batch_size):
+        """
+        Sample transitions in proportion to their priority
+        :return: (transitions, indices, weights). Transitions is as returned by sample, indices are for
+        update_priorities, and weights are the importance-sampling weights, normalized to at most 1
+        """
+        indices = self.sample_indices(batch_size)
+        probabilities = self.tree[indices] / self.tree.total
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+
+        self.samples += 1
+        fraction = min(1., self.samples / self.beta_steps)
+        self.beta = self.beta_start + fraction * (1. - self.beta_start)
+        return self.gather(indices), indices, weights.astype(np.float32)
+
+    def update_priorities(self, indices, errors):
+        """
+        Set priorities from the absolute TD errors of sampled transitions
+        """
+        priorities = (np.abs(errors) + self.priority_eps) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
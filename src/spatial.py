@@ -0,0 +1,277 @@
+# Spatial acceleration structures over level walls
+import numpy as np
+
+from src.collision import nearest_hits, segment_params
+
+# Side length of grid cells in pixels. Roughly the length of the longer level walls
+CELL_SIZE = 64
+# Chunks of a cell's length each cast line advances per pass through the grid
+CHUNKS_PER_PASS = 3
+# Below this many walls, testing every wall in one batch beats the per-pass overhead of marching through the grid
+BRUTE_FORCE_WALLS = 500
+# Spacing of distance field samples in pixels
+FIELD_CELL_SIZE = 2.
+# Point and wall pairs evaluated at once while building a distance field
+FIELD_BLOCK_PAIRS = 1 << 16
+
+
+class WallGrid:
+    """
+    Uniform grid over wall segments, built once when a level is loaded. Every cell lists the walls whose bounding box
+    overlaps it, padded with -1 into a (cells x max walls per cell) table so that lookups for many cells are a single
+    gather. Queries cost in proportion to the walls near the query, not to the number of walls in the level.
+    """
+
+    def __init__(self, walls: np.array, cell_size: float = CELL_SIZE, brute_force_walls: int = BRUTE_FORCE_WALLS):
+        """
+        :param walls: N walls in a 4xN matrix, as in src.collision
+        :param cell_size: Side length of the square cells
+        :param brute_force_walls: Levels with fewer walls than this are cast against all walls at once
+        """
+        self.walls = walls
+        self.cell_size = cell_size
+        self.brute_force = walls.shape[1] < brute_force_walls
+        if walls.shape[1]:
+            self.origin = np.array([walls[[0, 2]].min(), walls[[1, 3]].min()])
+            extent = np.array([walls[[0, 2]].max(), walls[[1, 3]].max()]) - self.origin
+        else:
+            self.origin, extent = np.zeros(2), np.zeros(2)
+        self.shape = (np.floor(extent / cell_size).astype(int) + 1)
+
+        # Cell ranges covered by each wall's bounding box
+        lo = self._cell_coords(np.minimum(walls[0:2], walls[2:4]))
+        hi = self._cell_coords(np.maximum(walls[0:2], walls[2:4]))
+        cells = [[] for _ in range(self.shape[0] * self.shape[1])]
+        for i in range(walls.shape[1]):
+            for cx in range(lo[0, i], hi[0, i] + 1):
+                for cy in range(lo[1, i], hi[1, i] + 1):
+                    cells[self._cell_id(cx, cy)].append(i)
+
+        # The last row is an always empty cell, used for lookups outside the grid
+        width = max(1, max(len(c) for c in cells))
+        self.table = np.full((len(cells) + 1, width), -1, dtype=int)
+        for cell, indices in enumerate(cells):
+            self.table[cell, :len(indices)] = indices
+        self._outside = len(cells)
+
+    @classmethod
+    def from_arrays(cls, walls: np.array, arrays: dict, brute_force_walls: int = BRUTE_FORCE_WALLS):
+        """
+        Restore a grid saved with to_arrays, without rebuilding the cell table
+        """
+        grid = cls.__new__(cls)
+        grid.walls = walls
+        grid.cell_size = float(arrays['grid_cell_size'])
+        grid.brute_force = walls.shape[1] < brute_force_walls
+        grid.origin = np.asarray(arrays['grid_origin'], dtype=float)
+        grid.shape = np.asarray(arrays['grid_shape'], dtype=int)
+        grid.table = np.asarray(arrays['grid_table'], dtype=int)
+        grid._outside = grid.table.shape[0] - 1
+        return grid
+
+    def to_arrays(self) -> dict:
+        return {
+            'grid_cell_size': np.array(self.cell_size),
+            'grid_origin': self.origin,
+            'grid_shape': self.shape,
+            'grid_table': self.table,
+        }
+
+    def _cell_coords(self, points: np.array) -> np.array:
+        # Integer cell coordinates of 2xN points, clipped to the grid
+        coords = np.floor((points - self.origin[:, None]) / self.cell_size).astype(int)
+        return np.clip(coords, 0, self.shape[:, None] - 1)
+
+    def _cell_id(self, cx, cy):
+        return cx * self.shape[1] + cy
+
+    def _cell_ids(self, cx: np.array, cy: np.array) -> np.array:
+        # Like _cell_id, but cells outside the grid map to the empty cell
+        inside = (cx >= 0) & (cx < self.shape[0]) & (cy >= 0) & (cy < self.shape[1])
+        return np.where(inside, self._cell_id(cx, cy), self._outside)
+
+    def query_box(self, xmin, ymin, xmax, ymax) -> np.array:
+        """
+        Walls that may intersect an axis-aligned box
+        :return: Sorted unique wall indices, a superset of the walls inside or crossing the box
+        """
+        lo = np.floor((np.array([xmin, ymin]) - self.origin) / self.cell_size).astype(int)
+        hi = np.floor((np.array([xmax, ymax]) - self.origin) / self.cell_size).astype(int)
+        lo, hi = np.maximum(lo, 0), np.minimum(hi, self.shape - 1)
+        if np.any(lo > hi):
+            return np.empty(0, dtype=int)
+        cx, cy = np.meshgrid(np.arange(lo[0], hi[0] + 1), np.arange(lo[1], hi[1] + 1), indexing='ij')
+        candidates = self.table[self._cell_id(cx, cy).ravel()]
+        return np.unique(candidates[candidates >= 0])
+
+    def box_candidates(self, lo: np.array, hi: np.array) -> np.array:
+        """
+        Walls near each of many boxes, e.g. the bounding boxes of a batch of cars. Every box is looked up in a block of
+        cells as large as the largest box needs, so this is fastest when all boxes are small.
+        :param lo: 2xN matrix of box minimum corners
+        :param hi: 2xN matrix of box maximum corners
+        :return: NxK matrix of wall indices, padded with -1
+        """
+        lo = np.floor((lo - self.origin[:, None]) / self.cell_size).astype(int)
+        hi = np.floor((hi - self.origin[:, None]) / self.cell_size).astype(int)
+        span = np.max(hi - lo, axis=1, initial=0) + 1
+        cx = lo[0][:, None, None] + np.arange(span[0])[None, :, None]
+        cy = lo[1][:, None, None] + np.arange(span[1])[None, None, :]
+        # Smaller boxes also get the cells past their own range, which only adds candidates
+        cells = self._cell_ids(cx, cy)
+        return self.table[cells].reshape(lo.shape[1], -1)
+
+    def query_lines(self, lines: np.array) -> np.array:
+        """
+        Walls that may intersect any of the lines, based on the lines' common bounding box
+        :param lines: L lines in a 4xL matrix
+        :return: Sorted unique wall indices
+        """
+        return self.query_box(lines[[0, 2]].min(), lines[[1, 3]].min(), lines[[0, 2]].max(), lines[[1, 3]].max())
+
+    def cast(self, lines: np.array, chunks_per_pass: int = CHUNKS_PER_PASS, stats: dict = None) -> tuple:
+        """
+        Nearest wall hit along each line, like collision.nearest_hits. Lines are split into chunks no longer than a cell,
+        so each chunk touches at most 2x2 cells. All lines advance through their chunks as a batch, a few chunks per
+        pass, and a line stops as soon as its nearest hit lies within the chunks already traversed.
+        :param lines: L lines in a 4xL matrix
+        :param chunks_per_pass: Chunks tested per line and pass. Fewer means earlier termination, more means less
+        per-pass overhead
+        :param stats: Dict to add the number of line and wall pairs tested to, under 'cast_tests'
+        :return: (t, index). t has length L and is np.inf where a line hits nothing, index is the wall index or -1
+        """
+        if self.brute_force:
+            if stats is not None:
+                stats['cast_tests'] = stats.get('cast_tests', 0) + lines.shape[1] * self.walls.shape[1]
+            return nearest_hits(lines, self.walls)
+        n = lines.shape[1]
+        best_t = np.full(n, np.inf)
+        best_index = np.full(n, -1)
+        if not self.walls.shape[1]:
+            return best_t, best_index
+
+        direction = lines[2:4] - lines[0:2]
+        chunks = np.maximum(np.ceil(np.hypot(*direction) / self.cell_size), 1).astype(int)
+
+        active = np.arange(n)
+        step = 0
+        while active.size:
+            # Chunk boundaries as 2 x active x chunks_per_pass, clamped to the end of each line
+            steps = step + np.arange(chunks_per_pass + 1)
+            t = np.minimum(steps[None, :] / chunks[active, None], 1)
+            points = lines[0:2, active, None] + t * direction[:, active, None]
+            start, end = points[:, :, :-1], points[:, :, 1:]
+            lo = np.floor((np.minimum(start, end) - self.origin[:, None, None]) / self.cell_size).astype(int)
+            hi = np.floor((np.maximum(start, end) - self.origin[:, None, None]) / self.cell_size).astype(int)
+
+            # 2x2 block of cells covering each chunk, duplicates are harmless
+            cells = np.concatenate([self._cell_ids(cx, cy) for cx in (lo[0], hi[0]) for cy in (lo[1], hi[1])], axis=1)
+            candidates = self.table[cells].reshape(active.size, -1)
+
+            if stats is not None:
+                stats['cast_tests'] = stats.get('cast_tests', 0) + candidates.size
+            hit_t = segment_params(lines[:, active, None], self.walls[:, candidates])
+            hit_t[candidates < 0] = np.inf
+            nearest = np.argmin(hit_t, axis=1)
+            hit_t = hit_t[np.arange(active.size), nearest]
+            better = hit_t < best_t[active]
+            best_t[active[better]] = hit_t[better]
+            best_index[active[better]] = candidates[better, nearest[better]]
+
+            # Early termination once the nearest hit can't be beaten by walls further along the line
+            done = best_t[active] <= t[:, -1]
+            done |= t[:, -1] >= 1
+            active = active[~done]
+            step += chunks_per_pass
+        return best_t, best_index
+
+
+class DistanceField:
+    """
+    Signed distance to the nearest wall, sampled on a regular grid over the level. Distances are positive on the track,
+    which is the area inside an odd number of wall polygons, and negative off it. A lookup is a bilinear interpolation
+    of four samples, so testing whether a shape touches a wall costs the same no matter how many walls the level has.
+    """
+
+    def __init__(self, walls: np.array, dimensions: tuple, cell_size: float = FIELD_CELL_SIZE):
+        """
+        :param walls: N walls in a 4xN matrix, as in src.collision, forming closed polygons
+        :param dimensions: Width and height of the level in pixels
+        :param cell_size: Spacing of the samples
+        """
+        self.cell_size = float(cell_size)
+        width, height = dimensions
+        xs = np.arange(int(np.ceil(width / cell_size)) + 1) * self.cell_size
+        ys = np.arange(int(np.ceil(height / cell_size)) + 1) * self.cell_size
+        self.values = np.empty((len(ys), len(xs)), dtype=np.float32)
+        rows = max(1, FIELD_BLOCK_PAIRS // max(len(xs) * walls.shape[1], 1))
+        for start in range(0, len(ys), rows):
+            x, y = np.meshgrid(xs, ys[start:start + rows])
+            self.values[start:start + rows] = self._signed_distance(walls, x.ravel(), y.ravel()).reshape(x.shape)
+
+    @staticmethod
+    def _signed_distance(walls: np.array, x: np.array, y: np.array) -> np.array:
+        if not walls.shape[1]:
+            return np.full(x.shape, -np.inf)
+        x1, y1, x2, y2 = (row[None, :] for row in walls)
+        px, py = x[:, None], y[:, None]
+        dx, dy = x2 - x1, y2 - y1
+        # Closest point on each wall
+        t = np.clip(((px - x1) * dx + (py - y1) * dy) / np.maximum(dx * dx + dy * dy, 1e-12), 0, 1)
+        distance = np.sqrt(np.min((x1 + t * dx - px) ** 2 + (y1 + t * dy - py) ** 2, axis=1))
+        # Even-odd rule: count the walls a ray to the right of each point crosses
+        straddles = (y1 > py) != (y2 > py)
+        crossing_x = x1 + (py - y1) * dx / np.where(dy == 0, 1, dy)
+        inside = np.count_nonzero(straddles & (px < crossing_x), axis=1) % 2 == 1
+        return np.where(inside, distance, -distance)
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        """
+        Restore a field saved with to_arrays
+        """
+        field = cls.__new__(cls)
+        field.cell_size = float(arrays['field_cell_size'])
+        field.values = np.asarray(arrays['field_values'], dtype=np.float32)
+        return field
+
+    def to_arrays(self) -> dict:
+        return {
+            'field_cell_size': np.array(self.cell_size),
+            'field_values': self.values,
+        }
+
+    def sample(self, x: np.array, y: np.array) -> np.array:
+        """
+        Signed distance at points of any shape, interpolated between samples. Points outside the field count as off the
+        track, at the distance of the nearest edge sample or -1, whichever is lower
+        """
+        gx, gy = np.asarray(x) / self.cell_size, np.asarray(y) / self.cell_size
+        rows, cols = self.values.shape
+        x0 = np.clip(gx.astype(np.intp), 0, cols - 2)
+        y0 = np.clip(gy.astype(np.intp), 0, rows - 2)
+        fx, fy = np.clip(gx - x0, 0, 1), np.clip(gy - y0, 0, 1)
+        # Gathers from the flat samples, the four corners are at fixed offsets
+        corner = y0 * cols + x0
+        values = self.values.ravel()
+        top, top_right = values.take(corner), values.take(corner + 1)
+        bottom, bottom_right = values.take(corner + cols), values.take(corner + cols + 1)
+        top = top + fx * (top_right - top)
+        distance = top + fy * (bottom + fx * (bottom_right - bottom) - top)
+        outside = (gx < 0) | (gx > cols - 1) | (gy < 0) | (gy > rows - 1)
+        if np.any(outside):
+            distance = np.where(outside, np.minimum(distance, -1), distance)
+        return distance
+
+    def clearance(self, lines: np.array) -> np.array:
+        """
+        Smallest signed distance along each line, from samples no further apart than the field's samples. A line is
+        clear of the walls where this is positive, unless a wall pokes into it by less than a sample spacing
+        :param lines: Line array of shape 4 x ..., as in src.collision
+        :return: Array of shape ...
+        """
+        length = np.hypot(lines[2] - lines[0], lines[3] - lines[1])
+        samples = int(np.ceil(np.max(length, initial=0) / self.cell_size)) + 1
+        t = np.linspace(0, 1, max(samples, 2)).reshape((-1,) + (1,) * (lines.ndim - 1))
+        distance = self.sample(lines[0] + t * (lines[2] - lines[0]), lines[1] + t * (lines[3] - lines[1]))
+        return distance.min(axis=0)
@@ -0,0 +1,171 @@
+# Runs headless Game instances in worker processes, exchanging actions and observations through shared memory
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from src.racecar_game import Game, Controls, OBS_SIZE, PHYSICS_DT
+
+# Commands sent to workers. Only these small messages go through pipes, all per-env data is in shared memory
+_STEP, _RESET, _CLOSE = range(3)
+# Seconds close waits for a worker to exit before terminating it
+CLOSE_TIMEOUT = 5
+
+
+class _SharedArrays:
+    """
+    Named NumPy arrays laid out back to back in one shared memory block. The creating process owns the block, workers
+    attach to it by name.
+    """
+
+    def __init__(self, specs, name=None):
+        """
+        :param specs: List of (name, shape, dtype)
+        :param name: Name of an existing block to attach to, a new block is created if None
+        """
+        self.specs = specs
+        offsets, size = [], 0
+        for _, shape, dtype in specs:
+            # Keep every array 8 byte aligned
+            size = -(-size // 8) * 8
+            offsets.append(size)
+            size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.shm = SharedMemory(name=name, create=name is None, size=max(size, 1))
+        self.arrays = {
+            key: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            for (key, shape, dtype), offset in zip(specs, offsets)
+        }
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker(conn, shm_name, specs, envs, game_kwargs):
+    shared = _SharedArrays(specs, shm_name)
+    actions, observations = shared['actions'][envs], shared['observations'][envs]
+    rewards, dones = shared['rewards'][envs], shared['dones'][envs]
+    try:
+        # Inside the try, so a game that fails to load still detaches from the shared memory
+        games = [Game(init_graphics=False, **game_kwargs) for _ in range(envs.start, envs.stop)]
+        while True:
+            command, dt = conn.recv()
+            if command == _STEP:
+                for i, game in enumerate(games):
+                    action = actions[i]
+                    # Game.act has already reset the game if it's done, like in a single process
+                    observations[i], rewards[i], dones[i] = game.act([Controls(action)] if action >= 0 else [], dt)
+            elif command == _RESET:
+                for i, game in enumerate(games):
+                    game.reset()
+                    observations[i] = game.car.observation
+            elif command == _CLOSE:
+                break
+            conn.send(None)
+    finally:
+        del actions, observations, rewards, dones
+        shared.close()
+        conn.close()
+
+
+class SubprocGame:
+    """
+    N headless games spread over K worker processes, stepped together. Actions go to the workers and observations,
+    rewards and dones come back through shared memory, so a step only pickles a tiny command per worker.
+    """
+
+    def __init__(self, n, workers=None, level='level1', start_method=None, physics_dt=PHYSICS_DT, action_repeat=1):
+        """
+        :param n: Number of games
+        :param workers: Number of worker processes, defaults to one per core but at most n
+        :param level: Level every game plays
+        :param start_method: multiprocessing start method, the platform default if None
+        :param physics_dt: Length of a physics step in simulated seconds, see Game
+        :param action_repeat: Physics steps per act call without a dt, see Game
+        """
+        self.n = n
+        workers = min(n, workers or mp.cpu_count())
+        specs = [
+            ('actions', (n,), np.int64),
+            ('observations', (n, OBS_SIZE), np.float32),
+            ('rewards', (n,), np.float32),
+            ('dones', (n,), np.bool_),
+        ]
+        self._shared = _SharedArrays(specs)
+        self._conns = []
+        self._processes = []
+        self.closed = False
+
+        game_kwargs = {'level': level, 'physics_dt': physics_dt, 'action_repeat': action_repeat}
+        ctx = mp.get_context(start_method)
+        try:
+            for envs in np.array_split(np.arange(n), workers):
+                parent, child = ctx.Pipe()
+                envs = slice(envs[0], envs[-1] + 1)
+                process = ctx.Process(target=_worker, args=(child, self._shared.shm.name, specs, envs, game_kwargs),
+                                      daemon=True)
+                process.start()
+                child.close()
+                self._conns.append(parent)
+                self._processes.append(process)
+            self.reset()
+        except BaseException:
+            # E.g. a worker that couldn't load its games, don't leak the shared memory or the other workers
+            self.close()
+            raise
+
+    def _command(self, command, dt=None):
+        for conn in self._conns:
+            conn.send((command, dt))
+        for conn in self._conns:
+            conn.recv()
+
+    def reset(self):
+        """
+        Reset every game
+        :return: NxOBS_SIZE observations
+        """
+        self._command(_RESET)
+        return self._shared['observations'].copy()
+
+    def act(self, actions, dt=None):
+        """
+        Step every game once
+        :param actions: N action indices, one Controls value per game or -1 for no action
+        :param dt: Elapsed time to simulate, or None for action_repeat physics steps
+        :return: (observations, rewards, dones) as in VecGame.act
+        """
+        self._shared['actions'][:] = actions
+        self._command(_STEP, dt)
+        return (self._shared['observations'].copy(), self._shared['rewards'].copy(),
+                self._shared['dones'].copy())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for conn in self._conns:
+            try:
+                conn.send((_CLOSE, None))
+            except OSError:
+                # The worker has already exited
+                pass
+        for process in self._processes:
+            process.join(CLOSE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for conn in self._conns:
+            conn.close()
+        self._shared.close(unlink=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
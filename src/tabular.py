@@ -0,0 +1,221 @@
+# Tabular Q-learning over discretized observations, a baseline agent that needs nothing but NumPy
+import numpy as np
+
+from src.racecar_game import OBS_LASERS, OBS_SIZE, OBS_VELOCITY
+from src.replay import ReplayBuffer
+
+# Bin edges in pixels for the laser distances, finer close to the car where it matters for steering
+LASER_EDGES = (20, 45, 90, 180)
+# Bin edges in pixels per second for the speed
+VELOCITY_EDGES = (40, 120, 220)
+# Most table rows, state spaces with more states than this are hashed into this many rows
+TABLE_SIZE = 1 << 20
+# Fibonacci hashing multiplier, spreads consecutive state ids over the whole table
+HASH_MULTIPLIER = np.uint64(11400714819323198485)
+
+
+class Discretizer:
+    """
+    Maps observations to table rows. Speed and each laser distance fall into a bin, and the bins combine into a
+    state id like the digits of a number. If there are more states than table_size, ids are hashed into table_size
+    rows, so states may share a row, but only the states that are actually visited compete for space.
+    """
+
+    def __init__(self, laser_edges=LASER_EDGES, velocity_edges=VELOCITY_EDGES, table_size=TABLE_SIZE):
+        """
+        :param laser_edges: Increasing bin edges for the laser distances
+        :param velocity_edges: Increasing bin edges for the speed
+        :param table_size: Most rows, rounded up to a power of two when hashing
+        """
+        self.laser_edges = np.asarray(laser_edges, dtype=np.float32)
+        self.velocity_edges = np.asarray(velocity_edges, dtype=np.float32)
+        # Edges per observation entry, padded with inf, so binning a batch is one comparison per edge
+        self.edges = np.full((OBS_SIZE, max(len(self.laser_edges), len(self.velocity_edges))), np.inf,
+                             dtype=np.float32)
+        self.edges[OBS_LASERS, :len(self.laser_edges)] = self.laser_edges
+        self.edges[OBS_VELOCITY, :len(self.velocity_edges)] = self.velocity_edges
+        lasers = OBS_LASERS.stop - OBS_LASERS.start
+        laser_bins = len(self.laser_edges) + 1
+        # Place value of every observation entry's bin in the state id. Ids are combined in double precision, which is
+        # exact for any state space that fits a table
+        self.place = np.empty(OBS_SIZE)
+        self.place[OBS_LASERS] = float(laser_bins) ** np.arange(lasers)
+        self.place[OBS_VELOCITY] = float(laser_bins) ** lasers
+        self.states = (len(self.velocity_edges) + 1) * laser_bins ** lasers
+        self.hashed = self.states > table_size
+        self.shift = np.uint64(64 - int(np.ceil(np.log2(table_size))))
+        self.rows = 1 << (64 - int(self.shift)) if self.hashed else self.states
+
+    def __call__(self, states):
+        """
+        :param states: B x OBS_SIZE observations, or a single one
+        :return: B table rows
+        """
+        states = np.asarray(states, dtype=np.float32).reshape(-1, OBS_SIZE)
+        bins = np.zeros(states.shape, dtype=np.float32)
+        for edge in self.edges.T:
+            bins += states >= edge
+        ids = (bins @ self.place).astype(np.int64)
+        if not self.hashed:
+            return ids
+        return ((ids.astype(np.uint64) * HASH_MULTIPLIER) >> self.shift).astype(np.int64)
+
+
+class TabularPolicy:
+    """
+    Q-values looked up in a table, callable like src.inference.NumpyMLP so it can stand in for it, e.g. in the actors
+    of src.actor_learner
+    """
+
+    def __init__(self, discretizer, table):
+        self.discretizer = discretizer
+        self.table = table
+
+    def set_weights(self, weights):
+        # Takes the table by reference, see TabularAgent.get_weights
+        self.table = weights[0]
+
+    def copy(self):
+        return TabularPolicy(self.discretizer, self.table.copy())
+
+    def __call__(self, states):
+        """
+        :param states: Batch of states, B x OBS_SIZE, or a single state
+        :return: B x actions matrix of Q-values
+        """
+        return self.table[self.discretizer(states)]
+
+
+class TabularAgent:
+    """
+    Q-learning with a Q-table, with the same interface as CarAgent. Replay samples a batch from the replay memory and
+    applies all its TD updates at once, which is a few array operations however large the batch, so large batches and
+    many envs train at millions of updates per second. No TensorFlow needed.
+    """
+
+    WEIGHTS_SUFFIX = '.npz'
+
+    def __init__(self, state_shape, action_shape, memory_size=2000, learning_rate=0.1, laser_edges=LASER_EDGES,
+                 velocity_edges=VELOCITY_EDGES, table_size=TABLE_SIZE, memmap_dir=None, seed=None):
+        """
+        :param state_shape: Observation size, the observations must be laid out as described at OBS_SIZE
+        :param action_shape: Number of actions
+        :param memory_size: Transitions kept for replay
+        :param learning_rate: Step size of the TD updates
+        :param laser_edges: See Discretizer
+        :param velocity_edges: See Discretizer
+        :param table_size: See Discretizer
+        :param memmap_dir: See ReplayBuffer
+        :param seed: Seed for exploration and replay sampling
+        """
+        if state_shape != OBS_SIZE:
+            raise ValueError('TabularAgent needs observations of size {}, not {}'.format(OBS_SIZE, state_shape))
+        self.state_shape = state_shape
+        self.action_shape = action_shape
+        self.memory = ReplayBuffer(memory_size, state_shape, memmap_dir=memmap_dir, seed=seed)
+        self.rng = np.random.default_rng(seed)
+
+        # Same schedule as CarAgent
+        self.gamma = 0.95
+        self.epsilon = 1.0
+        self.epsilon_decay = 0.995
+        self.epsilon_min = 0.01
+        self.learning_rate = learning_rate
+
+        self.discretizer = Discretizer(laser_edges, velocity_edges, table_size)
+        self.table = np.zeros((self.discretizer.rows, action_shape), dtype=np.float32)
+        # Acts on the live table
+        self.policy = TabularPolicy(self.discretizer, self.table)
+        self._sums = np.zeros(self.table.size, dtype=np.float32)
+        self._counts = np.zeros(self.table.size, dtype=np.float32)
+        self.replays = 0
+
+    def get_weights(self):
+        """
+        The live table, not a copy. Policies given it only read it, so publishing it, e.g. in src.actor_learner, costs
+        nothing, and they see every update as it's made
+        """
+        return [self.table]
+
+    def remember(self, state, action, reward, next_state, done):
+        self.memory.append(state, action, reward, next_state, done)
+
+    def act(self, state):
+        if self.rng.random() <= self.epsilon:
+            return int(self.rng.integers(self.action_shape))
+        return int(np.argmax(self.policy(state)[0]))
+
+    def act_batch(self, states):
+        """
+        Epsilon-greedy actions for a batch of states, e.g. one per env of a VecGame
+        :param states: B x state_shape matrix
+        :return: B action indices
+        """
+        actions = np.argmax(self.policy(states), axis=1)
+        explore = self.rng.random(len(actions)) <= self.epsilon
+        actions[explore] = self.rng.integers(self.action_shape, size=np.count_nonzero(explore))
+        return actions
+
+    def update(self, states, actions, rewards, next_states, dones):
+        """
+        One TD update per transition, all applied at once. Transitions that share a table entry are averaged into a
+        single update, so a large batch doesn't overshoot on frequent states
+        :return: TD errors
+        """
+        rows, next_rows = self.discretizer(states), self.discretizer(next_states)
+        targets = rewards + self.gamma * self.table[next_rows].max(axis=1) * ~np.asarray(dones, dtype=bool)
+        errors = targets - self.table[rows, actions]
+        entries = rows * self.action_shape + actions
+        # Sums and counts per entry go into zeroed scratch tables, which are only read and cleared where touched, so
+        # averaging costs a few passes over the batch instead of sorting it
+        # Operands of the scratch tables' dtype, np.add.at is many times slower for anything else
+        np.add.at(self._sums, entries, errors.astype(np.float32, copy=False))
+        np.add.at(self._counts, entries, np.ones(len(entries), dtype=np.float32))
+        # Duplicate entries all write the same averaged value
+        table = self.table.reshape(-1)
+        table[entries] += self.learning_rate * self._sums[entries] / self._counts[entries]
+        self._sums[entries] = 0
+        self._counts[entries] = 0
+        return errors
+
+    def replay(self, batch_size, decay=True):
+        """
+        Train on a batch sampled from the replay memory
+        :param decay: Whether to decay epsilon once, see decay_epsilon
+        """
+        self.update(*self.memory.sample(batch_size))
+        self.replays += 1
+        if decay:
+            self.decay_epsilon()
+
+    def decay_epsilon(self, steps=1):
+        # Decay exploration as if replay had run steps times
+        self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay ** steps)
+
+    @staticmethod
+    def saved_settings(name):
+        """
+        :return: Keyword arguments for an agent that can load the table saved to name
+        """
+        with np.load(name) as arrays:
+            return {'laser_edges': tuple(arrays['laser_edges'].tolist()),
+                    'velocity_edges': tuple(arrays['velocity_edges'].tolist()),
+                    'table_size': len(arrays['table'])}
+
+    def load(self, name):
+        with np.load(name) as arrays:
+            if arrays['table'].shape != self.table.shape:
+                raise ValueError('Table of shape {} in {} does not match {}'.format(arrays['table'].shape, name,
+                                                                                    self.table.shape))
+            # Hashed tables have the same shape whatever the bins, but other bins map states to other rows
+            for key in ('laser_edges', 'velocity_edges'):
+                edges = getattr(self.discretizer, key)
+                if not np.array_equal(arrays[key], edges):
+                    raise ValueError('{} {} in {} do not match {}'.format(key, arrays[key].tolist(), name,
+                                                                         edges.tolist()))
+            np.copyto(self.table, arrays['table'])
+
+    def save(self, name):
+        with open(name, 'wb') as f:
+            np.savez(f, table=self.table, laser_edges=self.discretizer.laser_edges,
+                     velocity_edges=self.discretizer.velocity_edges)
@@ -0,0 +1,213 @@
+# Batched simulation of many independent cars on one level, without pygame
+import numpy as np
+
+from src.collision import line_array, segment_params, swept_box, transform_lines
+from src.racecar_game import (ACC, CAR_DIM, CHECKPOINT_REWARD, CHECKPOINT_TIMEOUT, FRICTION, IDLE_BREAK, LASER_LENGTH,
+                              MAX_VEL, OBS_LASERS, OBS_SIZE, OBS_VELOCITY, PHYSICS_DT, TURNSPEED, Car, Controls,
+                              GameState, Level, SimClock)
+from src.spatial import WallGrid
+
+
+class VecGame:
+    """
+    N independent cars on the same level, stepped in lockstep. Physics, sensing and reward follow Car.act, but all car
+    state lives in arrays, so one step is a fixed number of array operations no matter how many cars there are.
+    Cars that are done are reset to the start of the level, like Game.reset.
+    """
+
+    def __init__(self, n, level='level1', physics_dt=PHYSICS_DT, action_repeat=1, distance_field=False):
+        """
+        :param n: Number of cars
+        :param level: Name of the level directory
+        :param physics_dt: Length of a physics step in simulated seconds
+        :param action_repeat: Physics steps per act call without a dt, as in Game
+        :param distance_field: Collide with walls through the level's distance field, as in Game
+        """
+        self.n = n
+        self.distance_field = distance_field
+        self.clock = SimClock(physics_dt, action_repeat)
+        self.level = Level(None, level)
+        # Collision geometry in single precision, which is plenty for pixel coordinates and halves the cost of the
+        # lasers x walls cast
+        self.walls = self.level.wall_array.astype(np.float32)
+        self.wall_index = WallGrid.from_arrays(self.walls, self.level.wall_index.to_arrays())
+
+        # Car geometry relative to the car's center as 4 x 1 x lines arrays, and buffers it's posed into every step
+        center = np.tile(np.array(CAR_DIM) / 2, 2)[:, None, None]
+        self._box_local = line_array(Car._init_box())[:, None, :] - center
+        self._laser_local = line_array(Car._init_lasers().values())[:, None, :] - center
+        self._box_world = np.empty((4, n, self._box_local.shape[2]))
+        self._previous_box = np.empty_like(self._box_world)
+        self._laser_world = np.empty((4, n, self._laser_local.shape[2]))
+        self._scratch = np.empty((2, n, max(self._box_local.shape[2], self._laser_local.shape[2])))
+        self._cos, self._sin = np.empty((n, 1)), np.empty((n, 1))
+        # Single precision copies for the collision kernels
+        self._sweep = np.empty((4, n, 2 * self._box_local.shape[2]), dtype=np.float32)
+        self._lasers32 = np.empty(self._laser_world.shape, dtype=np.float32)
+
+        self.pos = np.zeros((n, 2))
+        self.vel = np.zeros((n, 2))
+        self.angle = np.zeros(n)
+        self.check_idx = np.zeros(n, dtype=int)
+        self.since_checkpoint = np.zeros(n)
+        self.reset()
+
+    def reset(self, mask=None):
+        """
+        Put cars back at the start of the level
+        :param mask: Boolean array of the cars to reset, all cars if None
+        """
+        mask = slice(None) if mask is None else mask
+        self.pos[mask] = self.level.start
+        self.vel[mask] = 0
+        self.angle[mask] = self.level.start_angle
+        self.check_idx[mask] = len(self.level.checkpoints) - 1
+        self.since_checkpoint[mask] = 0
+
+    def act(self, actions, dt=None):
+        """
+        Step all cars in fixed physics steps, holding the actions for all of them
+        :param actions: N action indices, one Controls value per car, or an Nx4 boolean matrix of pressed Controls
+        :param dt: Elapsed time to simulate. If None, the cars take action_repeat steps
+        :return: (observations, rewards, dones). Observations is an NxOBS_SIZE float32 matrix with the same layout as
+        Car.observation, rewards are summed over the steps taken. Observations are from before done cars are reset,
+        like Game.act.
+        """
+        pressed = self._pressed(actions)
+        rewards = np.zeros(self.n, dtype=int)
+        dones = np.zeros(self.n, dtype=bool)
+        for _ in range(self.clock.steps(dt)):
+            if not np.any(dones):
+                step_rewards, step_dones = self._step(pressed, self.clock.physics_dt)
+            else:
+                # Cars that are done stay where they ended, like a Game that stops stepping
+                state = [array[dones] for array in self._state]
+                step_rewards, step_dones = self._step(pressed, self.clock.physics_dt)
+                for array, saved in zip(self._state, state):
+                    array[dones] = saved
+                step_rewards[dones] = 0
+            rewards += step_rewards
+            dones |= step_dones
+
+        # Sense once, at the end of the last step
+        observations = self._sense()
+        if np.any(dones):
+            self.reset(dones)
+        return observations, rewards, dones
+
+    def snapshot(self):
+        """
+        :return: GameState of all cars, with their current observations
+        """
+        return GameState(self.pos.copy(), self.vel.copy(), self.angle.copy(), self.check_idx.copy(),
+                         self.since_checkpoint.copy(), self._sense())
+
+    def restore(self, state):
+        """
+        Put all cars into a state, e.g. to branch rollouts from one point of a track
+        :param state: GameState of N cars, or of a single car to put every car into
+        :return: NxOBS_SIZE observations of the restored cars
+        """
+        if len(state) not in (1, self.n):
+            raise ValueError('State of {} cars for {} cars'.format(len(state), self.n))
+        np.copyto(self.pos, state.pos)
+        np.copyto(self.vel, state.vel)
+        np.copyto(self.angle, state.angle)
+        # Game counts from -1 before the first checkpoint
+        np.copyto(self.check_idx, state.check_idx % len(self.level.checkpoints))
+        np.copyto(self.since_checkpoint, state.since_checkpoint)
+        return np.repeat(state.observation, self.n // len(state), axis=0)
+
+    @property
+    def _state(self):
+        return self.pos, self.vel, self.angle, self.check_idx, self.since_checkpoint
+
+    def _step(self, pressed, dt):
+        """
+        One physics step of every car, with collision and checkpoints
+        :return: (rewards, dones)
+        """
+        front, back, left, right = (pressed[:, c.value] for c in (Controls.FRONT, Controls.BACK, Controls.LEFT,
+                                                                   Controls.RIGHT))
+        self.since_checkpoint += dt
+        # Half a step of slack against rounding in the accumulated time, as in Car.act
+        dones = self.since_checkpoint > CHECKPOINT_TIMEOUT + dt / 2
+        self._pose(self._box_local, self._previous_box)
+
+        # Physics, in the same order as Car.act
+        direction = self._direction(self.angle)
+        self.vel[~front] *= IDLE_BREAK
+        self.vel += direction * (ACC * dt * (front.astype(float) - back))[:, None]
+        self.angle += TURNSPEED * dt * (right.astype(float) - left)
+        speed = np.hypot(self.vel[:, 0], self.vel[:, 1])
+        too_fast = speed > MAX_VEL
+        self.vel[too_fast] *= (MAX_VEL / speed[too_fast])[:, None]
+        # Friction
+        along = np.sum(direction * self.vel, axis=1)
+        self.vel -= (self.vel - along[:, None] * direction) * FRICTION
+        self.pos += self.vel * dt
+
+        # Area swept by each box since the last step against the walls near it
+        box = self._pose(self._box_local, self._box_world)
+        sweep = swept_box(self._previous_box, box, out=self._sweep)
+        if self.distance_field:
+            dones |= self.level.distance_field.clearance(sweep).min(axis=1) <= 0
+        else:
+            candidates = self.wall_index.box_candidates(np.minimum(sweep[0:2], sweep[2:4]).min(axis=2),
+                                                        np.maximum(sweep[0:2], sweep[2:4]).max(axis=2))
+            walls = self.walls[:, candidates]
+            hit = segment_params(sweep[:, :, :, None], walls[:, :, None, :])
+            hit[np.broadcast_to(candidates[:, None, :] < 0, hit.shape)] = np.inf
+            dones |= np.any(~np.isinf(hit), axis=(1, 2))
+
+        # Swept area against each car's current checkpoint, repeated for cars that passed more than one
+        rewards = np.zeros(self.n, dtype=int)
+        crossing = np.arange(self.n)
+        for _ in range(len(self.level.checkpoints)):
+            checkpoint = self.level.checkpoint_array[:, self.check_idx[crossing]]
+            crossed = np.any(~np.isinf(segment_params(sweep[:, crossing], checkpoint[:, :, None])), axis=1)
+            crossing = crossing[crossed]
+            if not crossing.size:
+                break
+            rewards[crossing] += CHECKPOINT_REWARD
+            self.since_checkpoint[crossing] = 0
+            self.check_idx[crossing] += self.level.checkpoint_step
+            self.check_idx[crossing] %= len(self.level.checkpoints)
+        return rewards, dones
+
+    def _sense(self):
+        # Lasers of all cars against the walls in one cast
+        np.copyto(self._lasers32, self._pose(self._laser_local, self._laser_world))
+        t, _ = self.wall_index.cast(self._lasers32.reshape(4, -1))
+        t = t.reshape(self.n, -1)
+
+        observations = np.empty((self.n, OBS_SIZE), dtype=np.float32)
+        observations[:, OBS_VELOCITY] = np.hypot(self.vel[:, 0], self.vel[:, 1])
+        observations[:, OBS_LASERS] = np.where(np.isinf(t), 1, t) * LASER_LENGTH
+        return observations
+
+    def _pressed(self, actions):
+        actions = np.asarray(actions)
+        if actions.ndim == 2:
+            return actions.astype(bool)
+        pressed = np.zeros((self.n, len(Controls)), dtype=bool)
+        pressed[np.arange(self.n), actions] = True
+        return pressed
+
+    @staticmethod
+    def _direction(angle):
+        rad = np.radians(angle)
+        return np.stack((np.cos(rad), np.sin(rad)), axis=1)
+
+    def _pose(self, local, out):
+        """
+        Rotate car-local lines by each car's angle and move them to its position, in place
+        :param local: 4 x 1 x lines array relative to the car's center
+        :param out: 4 x cars x lines buffer to write to
+        :return: out
+        """
+        np.radians(self.angle, out=self._cos[:, 0])
+        np.sin(self._cos, out=self._sin)
+        np.cos(self._cos, out=self._cos)
+        return transform_lines(local, self._cos, self._sin, (self.pos[:, 0:1], self.pos[:, 1:2]), out,
+                               self._scratch[:, :, :local.shape[2]])
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from src.actor_learner import ActorLearner
+from src.racecar_game import Controls, OBS_SIZE
+from src.tabular import TabularAgent
+
+
+def test_actors_feed_learner():
+    pytest.importorskip('tensorflow')
+    from src.agent import CarAgent
+    agent = CarAgent(OBS_SIZE, len(Controls), memory_size=10000)
+    before = [w.copy() for w in agent.model.get_weights()]
+    pipeline = ActorLearner(agent, actors=2, batch_size=16, publish_interval=2, action_repeat=4, seed=0)
+    stats = pipeline.run(seconds=60, replays=6)
+
+    assert stats['replays'] >= 6
+    assert stats['steps'] >= stats['transitions'] > 0
+    assert len(agent.memory) == min(stats['transitions'], agent.memory.capacity)
+    assert stats['weights_version'] >= 3
+    assert agent.epsilon < 1
+    assert any(not np.allclose(b, a) for b, a in zip(before, agent.model.get_weights()))
+    # Both actors produced experience
+    assert all(steps > 0 for steps in pipeline.steps)
+    assert not pipeline.running
+
+
+def test_learner_waits_for_experience():
+    agent = TabularAgent(OBS_SIZE, len(Controls), memory_size=10000, table_size=4096, seed=0)
+    pipeline = ActorLearner(agent, actors=2, batch_size=16, action_repeat=4, seed=0, replay_ratio=0.5)
+    stats = pipeline.run(seconds=2)
+    # The learner would replay far more often, but doesn't go past the bound
+    assert 0 < stats['replays'] <= stats['transitions'] * 0.5
+    # Exploration decays with the transitions collected, not with the replays
+    np.testing.assert_allclose(agent.epsilon, max(agent.epsilon_min, agent.epsilon_decay ** stats['transitions']))
+
+
+def test_thread_errors_are_raised():
+    agent = TabularAgent(OBS_SIZE, len(Controls), table_size=4096)
+    pipeline = ActorLearner(agent, actors=1, level='no_such_level')
+    with pytest.raises(FileNotFoundError):
+        pipeline.run(seconds=30)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from src.agent import CarAgent  # noqa: E402
+
+
+def _target_weights(agent):
+    return [array for layer in agent.target_policy.layers for array in layer]
+
+
+def _fill(agent, n, state_shape):
+    rng = np.random.RandomState(0)
+    for i in range(n):
+        state = rng.rand(1, state_shape)
+        next_state = rng.rand(1, state_shape)
+        agent.remember(state, rng.randint(agent.action_shape), rng.rand(), next_state, i % 7 == 0)
+
+
+def test_replay_trains_on_whole_minibatch():
+    agent = CarAgent(10, 4, target_update_interval=2)
+    _fill(agent, 64, 10)
+    before = [w.copy() for w in agent.model.get_weights()]
+
+    agent.replay(32)
+    after = agent.model.get_weights()
+    assert any(not np.allclose(b, a) for b, a in zip(before, after))
+    # Target network is not synced until target_update_interval replays have run
+    assert all(np.allclose(b, t) for b, t in zip(before, _target_weights(agent)))
+
+    agent.replay(32)
+    for w, t in zip(agent.model.get_weights(), _target_weights(agent)):
+        np.testing.assert_array_equal(w, t)
+    assert agent.epsilon < 1
+
+
+def test_prioritized_replay_updates_priorities():
+    agent = CarAgent(10, 4, prioritized=True)
+    _fill(agent, 64, 10)
+    before = agent.memory.tree[np.arange(64)].copy()
+    agent.replay(32)
+    assert not np.array_equal(before, agent.memory.tree[np.arange(64)])
+
+
+def test_numpy_policy_matches_keras():
+    agent = CarAgent(10, 4)
+    _fill(agent, 64, 10)
+    agent.replay(32)
+    states = np.random.RandomState(1).rand(16, 10).astype(np.float32)
+    expected = agent.model.predict_on_batch(states)
+    np.testing.assert_allclose(agent.policy(states), expected, rtol=1e-4, atol=1e-5)
+    # Not synced yet, so the target network still computes the initial model
+    assert not np.allclose(agent.target_policy(states), expected)
+    agent.update_target_model()
+    np.testing.assert_allclose(agent.target_policy(states), expected, rtol=1e-4, atol=1e-5)
+
+    agent.epsilon = 0
+    np.testing.assert_array_equal(agent.act_batch(states), np.argmax(expected, axis=1))
+    assert agent.act(states[:1]) == np.argmax(expected[0])
+    agent.epsilon = 1
+    assert agent.act_batch(states).shape == (16,)
@@ -0,0 +1,36 @@
+import json
+
+from src import benchmark
+
+
+def test_quick_run_is_json():
+    results = benchmark.run(['segment_intersection', 'nearest_hits', 'car_act', 'game_episodes', 'vec_game'],
+                            quick=True)
+    results = json.loads(json.dumps(results))
+    assert results['benchmarks']['car_act']['steps_per_s'] > 0
+    level = results['benchmarks']['segment_intersection']['level1']
+    assert level['walls'] > 0 and level['batched_pairs_per_s'] > 0
+    assert results['benchmarks']['nearest_hits']['batched_pairs_per_s'] > 0
+    assert set(results['benchmarks']['game_episodes']) == {'repeat1', 'repeat4'}
+
+
+def test_missing_dependency_is_skipped(monkeypatch):
+    monkeypatch.setitem(benchmark.BENCHMARKS, 'needs_missing', (None, 'no_such_module_installed'))
+    results = benchmark.run(['needs_missing'], quick=True)
+    assert 'skipped' in results['benchmarks']['needs_missing']
+
+
+def test_compare_finds_regressions():
+    baseline = {'benchmarks': {'a': {'steps_per_s': 100., 'walls': 10}, 'b': {'p95_ms': 2.}}}
+    assert benchmark.compare(baseline, baseline) == []
+    slower = {'benchmarks': {'a': {'steps_per_s': 80., 'walls': 20}, 'b': {'p95_ms': 2.1}}}
+    assert benchmark.compare(baseline, slower) == [('a.steps_per_s', 100., 80.)]
+    assert [key for key, _, _ in benchmark.compare(baseline, slower, threshold=0.01)] == ['a.steps_per_s', 'b.p95_ms']
+
+
+def test_main_writes_output(tmp_path):
+    output = str(tmp_path / 'results.json')
+    assert benchmark.main(['car_act', '--quick', '--output', output]) == 0
+    with open(output) as f:
+        assert 'car_act' in json.load(f)['benchmarks']
+    assert benchmark.main(['car_act', '--quick', '--output', output, '--compare', output, '--threshold', '0.9']) == 0
@@ -1,20 +1,167 @@
 import numpy as np
+from pygame.math import Vector2
 
-from src.collision import _intersection
-from src.helpers import _intersection as single_int
+from src.collision import (EPS, line_array, nearest_hits, nearest_intersections, pairwise_params, segment_params,
+                           segment_intersections, transform_lines)
+from src.helpers import segment_intersection, segment_intersection_param, nearest_hit, rotate_shape, translate_shape
+from src.racecar_game import Game, CAR_DIM
 
 
-def test_intersections():
-    print('testing intersection code')
-    line1 = [1, 1, 2, 2]
-    line2 = np.array([1, 2, 2, 1]).reshape(4, 1)
-    print(f'intersection: {_intersection(line1, line2)}')
-    assert False
+def _params(l1, l2):
+    return segment_params(line_array([l1]), line_array([l2]))[0]
 
 
-def test_intersection():
-    print('testing single intersection code')
-    line1 = [[1, 1], [2, 2]]
-    line2 = [[1, 2], [2, 1]]
-    print(f'intersection at {single_int(line1, line2)}')
-    assert False
+def test_crossing_segments():
+    assert _params([(0, 0), (2, 2)], [(0, 2), (2, 0)]) == 0.5
+    assert segment_intersection_param([(0, 0), (2, 2)], [(0, 2), (2, 0)]) == 0.5
+    assert segment_intersection([(0, 0), (2, 2)], [(0, 2), (2, 0)]) == (1, 1)
+
+
+def test_axis_aligned_segments():
+    # Vertical against horizontal, no slope special cases or padded bounding boxes needed
+    assert _params([(5, 0), (5, 10)], [(0, 4), (10, 4)]) == 0.4
+    assert _params([(0, 4), (10, 4)], [(5, 0), (5, 10)]) == 0.5
+    assert segment_intersection_param([(5, 0), (5, 10)], [(0, 4), (10, 4)]) == 0.4
+    # Thin segments that used to be lost to 3px rectangles
+    assert _params([(0, 0), (10, 0)], [(5, -0.1), (5, 0.1)]) == 0.5
+    assert np.isinf(_params([(0, 0), (10, 0)], [(5, 0.1), (5, 0.2)]))
+
+
+def test_misses():
+    # Infinite lines intersect, segments don't
+    assert np.isinf(_params([(0, 0), (1, 1)], [(3, 0), (0, 3.5)]))
+    assert segment_intersection_param([(0, 0), (1, 1)], [(3, 0), (0, 3.5)]) is None
+    # Parallel and collinear
+    assert np.isinf(_params([(0, 0), (10, 0)], [(0, 1), (10, 1)]))
+    assert np.isinf(_params([(0, 0), (10, 0)], [(2, 0), (8, 0)]))
+    assert segment_intersection([(0, 0), (10, 0)], [(2, 0), (8, 0)]) is None
+    # Degenerate segment
+    assert np.isinf(_params([(0, 0), (0, 0)], [(-1, 0), (1, 0)]))
+
+
+def test_endpoint_tolerance():
+    # Touching at an end of either segment counts as a hit
+    assert _params([(0, 0), (10, 0)], [(10, -1), (10, 1)]) == 1
+    assert _params([(0, 0), (10, 0)], [(5, 0), (5, 5)]) == 0.5
+    # Rays through a shared corner of two walls hit at least one of them despite rounding
+    walls = line_array([[(0, 1), (1 / 3, 1)], [(1 / 3, 1), (1, 2)]])
+    t, index = nearest_hits(line_array([[(1 / 3, 0), (1 / 3, 3)]]), walls)
+    assert np.isclose(t[0], 1 / 3) and index[0] in (0, 1)
+    # Just outside the tolerance
+    assert np.isinf(_params([(0, 0), (10, 0)], [(10 + 1e-6, -1), (10 + 1e-6, 1)]))
+    assert EPS < 1e-6
+
+
+def test_near_parallel_segments():
+    t = _params([(0, 0), (1000, 0)], [(0, -1e-3), (1000, 1e-3)])
+    assert np.isclose(t, 0.5)
+    assert np.isclose(segment_intersection_param([(0, 0), (1000, 0)], [(0, -1e-3), (1000, 1e-3)]), 0.5)
+    # Nonzero cross product, but parallel within the tolerance, on every path
+    line, wall = [(0, 0), (1000, 0)], [(0, -1e-7), (1000, 1e-7)]
+    assert np.isinf(_params(line, wall))
+    assert segment_intersection_param(line, wall) is None
+    t, index = nearest_hits(line_array([line]), line_array([wall]))
+    assert np.isinf(t[0]) and index[0] == -1
+
+
+def test_broadcasting():
+    lines = line_array([[(0, 5), (20, 5)], [(5, 0), (5, 20)], [(0, 0), (20, 20)]])
+    walls = line_array([[(10, 0), (10, 10)], [(15, 0), (15, 10)], [(0, 8), (10, 8)]])
+    t = pairwise_params(lines, walls)
+    assert t.shape == (3, 3)
+    np.testing.assert_allclose(t[0], [0.5, 0.75, np.inf])
+    # Pairwise along the last axis
+    np.testing.assert_allclose(segment_params(lines, walls), np.diag(t))
+
+
+def test_nearest_hits():
+    lasers = line_array([[(0, 5), (20, 5)], [(5, 0), (5, 20)], [(0, 0), (20, 20)], [(0, 30), (20, 30)]])
+    walls = line_array([[(10, 0), (10, 10)], [(15, 0), (15, 10)], [(0, 8), (10, 8)]])
+    t, index = nearest_hits(lasers, walls)
+    np.testing.assert_allclose(t, [0.5, 0.4, 0.4, np.inf])
+    np.testing.assert_array_equal(index, [0, 2, 2, -1])
+
+    distances, points = nearest_intersections(lasers, walls)
+    np.testing.assert_allclose(distances, [10, 8, 8 * np.sqrt(2), np.inf])
+    np.testing.assert_allclose(points[:, :3], [[10, 5, 8], [5, 8, 8]])
+    assert np.all(np.isnan(points[:, 3]))
+
+    t, index = nearest_hits(lasers, np.zeros((4, 0)))
+    assert np.all(np.isinf(t)) and np.all(index == -1)
+
+
+def test_segment_intersections():
+    walls = line_array([[(10, 0), (10, 10)], [(0, 8), (10, 8)], [(30, 0), (30, 10)]])
+    p = segment_intersections([0, 5, 20, 5], walls)
+    np.testing.assert_allclose(p, [[10, np.nan, np.nan], [5, np.nan, np.nan]])
+
+
+def test_scalar_and_batched_agree():
+    rng = np.random.RandomState(0)
+    lines = [[tuple(p) for p in rng.uniform(0, 100, (2, 2))] for _ in range(50)]
+    others = [[tuple(p) for p in rng.uniform(0, 100, (2, 2))] for _ in range(60)]
+    t = pairwise_params(line_array(lines), line_array(others))
+    for i, line in enumerate(lines):
+        for j, other in enumerate(others):
+            scalar = segment_intersection_param(line, other)
+            assert (scalar is None) == np.isinf(t[i, j])
+            if scalar is not None:
+                assert np.isclose(scalar, t[i, j])
+        best, _ = nearest_hit(line, others)
+        assert (best is None and np.isinf(t[i].min())) or np.isclose(best, t[i].min())
+
+
+def test_nearest_intersections_matches_scalar_path():
+    game = Game(init_graphics=False)
+    walls = game.level.wall_lines
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        game.car.pos = Vector2(rng.uniform(150, 1200), rng.uniform(50, 700))
+        game.car.angle = rng.uniform(0, 360)
+        shape = rotate_shape(game.car.lasers.values(), CAR_DIM / 2, game.car.angle)
+        lasers = translate_shape(shape, game.car.pos - CAR_DIM / 2)
+
+        distances, points = nearest_intersections(line_array(lasers), game.level.wall_array)
+
+        expected = []
+        for laser in lasers:
+            t, _ = nearest_hit(laser, walls)
+            expected.append(np.inf if t is None else t * (laser[1] - laser[0]).length())
+        np.testing.assert_allclose(distances, expected)
+        assert np.all(np.isnan(points[0]) == np.isinf(distances))
+
+
+def test_transform_lines_matches_vector_path():
+    car = Game(init_graphics=False).car
+    rng = np.random.RandomState(1)
+    for _ in range(10):
+        car.pos = Vector2(rng.uniform(0, 1000), rng.uniform(0, 700))
+        car.angle = rng.uniform(-720, 720)
+        expected = line_array(translate_shape(rotate_shape(car.lasers.values(), CAR_DIM / 2, car.angle),
+                                              car.pos - CAR_DIM / 2))
+        np.testing.assert_allclose(car._pose(car._laser_local, car._laser_world), expected, atol=1e-9)
+
+    # Broadcasting over a batch of poses
+    local = line_array(car.box)[:, None, :]
+    angles = rng.uniform(0, 2 * np.pi, (3, 1))
+    offset = rng.uniform(0, 100, (2, 3, 1))
+    out = transform_lines(local, np.cos(angles), np.sin(angles), offset, np.empty((4, 3, 4)))
+    for i in range(3):
+        single = transform_lines(local[:, 0], np.cos(angles[i]), np.sin(angles[i]), offset[:, i], np.empty((4, 4)))
+        np.testing.assert_allclose(out[:, i], single)
+
+
+def test_batched_nearest_hits_match_scalar():
+    # Speed is measured by src.benchmark
+    rng = np.random.RandomState(0)
+    lines = rng.uniform(0, 1000, (4, 10))
+    walls = rng.uniform(0, 1000, (4, 1000))
+    t, index = nearest_hits(lines, walls)
+    scalar_walls = [[walls[0:2, i], walls[2:4, i]] for i in range(walls.shape[1])]
+    for i in range(lines.shape[1]):
+        expected, _ = nearest_hit([lines[0:2, i], lines[2:4, i]], scalar_walls)
+        if expected is None:
+            assert np.isinf(t[i]) and index[i] == -1
+        else:
+            assert np.isclose(t[i], expected)
+    assert np.isfinite(t).any()
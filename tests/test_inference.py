@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from src.inference import NumpyMLP
+
+
+def test_forward_pass():
+    rng = np.random.RandomState(0)
+    weights = [(rng.randn(3, 5), rng.randn(5)), (rng.randn(5, 2), rng.randn(2))]
+    mlp = NumpyMLP(weights, ['relu', 'linear'], dtype=np.float64)
+    states = rng.randn(4, 3)
+    expected = np.maximum(states @ weights[0][0] + weights[0][1], 0) @ weights[1][0] + weights[1][1]
+    np.testing.assert_allclose(mlp(states), expected)
+    # A single state is a batch of one
+    np.testing.assert_allclose(mlp(states[0]), expected[:1])
+
+    mlp.set_weights([np.zeros((3, 5)), np.ones(5), np.ones((5, 2)), np.zeros(2)])
+    np.testing.assert_array_equal(mlp(states), np.full((4, 2), 5.))
+
+
+def test_unsupported_activation():
+    with pytest.raises(ValueError):
+        NumpyMLP([(np.ones((2, 2)), np.ones(2))], ['softplus'])
@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from src.levelfile import load_level, save_level, source_hash, LevelData, COMPILED_FILE, SOURCE_FILE
+from src.racecar_game import LEVEL_DIR
+
+
+def _source_sha1(level_dir):
+    with open(os.path.join(level_dir, SOURCE_FILE), 'rb') as f:
+        return source_hash(f.read())
+
+
+@pytest.fixture
+def level_dir(tmp_path):
+    shutil.copy(os.path.join(LEVEL_DIR, 'level1', SOURCE_FILE), str(tmp_path))
+    return str(tmp_path)
+
+
+def test_json_level(level_dir):
+    level = load_level(level_dir)
+    with open(os.path.join(level_dir, SOURCE_FILE)) as f:
+        source = json.load(f)
+    assert [len(polygon) for polygon in level.walls] == [len(polygon) for polygon in source['walls']]
+    assert level.wall_array.shape == (4, sum(len(polygon) for polygon in source['walls']))
+    np.testing.assert_array_equal(level.checkpoints, source['checkpoints'])
+    np.testing.assert_array_equal(level.start, source['start'])
+    # Every polygon is closed, the first segment starts at the last point
+    np.testing.assert_array_equal(level.wall_array[:2, 0], source['walls'][0][-1])
+
+
+def test_compiled_round_trip(level_dir):
+    level = load_level(level_dir)
+    save_level(os.path.join(level_dir, COMPILED_FILE), level, _source_sha1(level_dir))
+    compiled = load_level(level_dir)
+    assert compiled is not level
+    for key, array in level.to_arrays().items():
+        np.testing.assert_array_equal(compiled.to_arrays()[key], array)
+    assert compiled.start_angle == level.start_angle
+    assert compiled.dimensions == level.dimensions
+
+
+def test_distance_field_is_saved_once_built(level_dir):
+    level = load_level(level_dir)
+    assert not level.has_distance_field
+    assert level.distance_field.sample(*level.start) > 0
+    save_level(os.path.join(level_dir, COMPILED_FILE), level, _source_sha1(level_dir))
+    compiled = load_level(level_dir)
+    assert compiled.has_distance_field
+    np.testing.assert_array_equal(compiled.distance_field.values, level.distance_field.values)
+    with pytest.raises(ValueError):
+        compiled.distance_field.values[0, 0] = 1
+
+
+def test_cache_shares_read_only_copy(level_dir):
+    level = load_level(level_dir)
+    assert load_level(level_dir) is level
+    with pytest.raises(ValueError):
+        level.wall_array[0, 0] = 1
+    with pytest.raises(ValueError):
+        level.wall_index.table[0, 0] = 1
+
+
+def test_stale_compiled_level_is_ignored(level_dir):
+    level = load_level(level_dir)
+    compiled = os.path.join(level_dir, COMPILED_FILE)
+    small = LevelData(level.wall_points[:3], [0, 3], level.checkpoint_array, level.start, 0)
+    # Built from another source, or from an unknown one
+    for source_sha1 in (source_hash(b'{}'), None):
+        save_level(compiled, small, source_sha1)
+        assert load_level(level_dir).wall_array.shape == level.wall_array.shape
+
+
+def test_compiled_level_is_used_regardless_of_mtime(level_dir):
+    level = load_level(level_dir)
+    compiled = os.path.join(level_dir, COMPILED_FILE)
+    save_level(compiled, LevelData(level.wall_points[:3], [0, 3], level.checkpoint_array, level.start, 0),
+               _source_sha1(level_dir))
+    # Older than its source, as a checkout may leave it
+    os.utime(compiled, (0, 0))
+    assert load_level(level_dir).wall_array.shape == (4, 3)
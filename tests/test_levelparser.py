@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from src.levelfile import load_level, COMPILED_FILE, SOURCE_FILE
+from src.levelparser import (build_level, parse_path, tokenize_svg_path, read_prewalls, read_svg, simplify_polygon,
+                             validate, main, LevelBuildError, WALLS_FILE, CHECKPOINTS_FILE)
+from src.racecar_game import LEVEL_DIR
+
+LEVEL1 = os.path.join(LEVEL_DIR, 'level1')
+
+
+@pytest.fixture
+def level_dir(tmp_path):
+    for name in (WALLS_FILE, CHECKPOINTS_FILE, 'level1.svg', SOURCE_FILE):
+        shutil.copy(os.path.join(LEVEL1, name), str(tmp_path))
+    return str(tmp_path)
+
+
+def test_svg_path_commands():
+    commands = tokenize_svg_path('M10,10l5-.5 5,.5H30V20h-10v5zM0 0L1 0 1 1Z')
+    assert commands[:3] == [('M', 10, 10), ('l', 5, -.5), ('l', 5, .5)]
+    polygons, problems = parse_path(commands)
+    assert problems == []
+    np.testing.assert_allclose(polygons[0], [[10, 10], [15, 9.5], [20, 10], [30, 10], [30, 20], [20, 20], [20, 25]])
+    np.testing.assert_allclose(polygons[1], [[0, 0], [1, 0], [1, 1]])
+
+    _, problems = parse_path(tokenize_svg_path('M0,0L1,0 1,1C2,2,3,3,4,4'))
+    assert len(problems) == 2
+
+
+def test_svg_matches_prewalls():
+    prewalls, problems = read_prewalls(os.path.join(LEVEL1, WALLS_FILE))
+    svg, svg_problems = read_svg(os.path.join(LEVEL1, 'level1.svg'))
+    assert problems == svg_problems == []
+    assert [len(polygon) for polygon in prewalls] == [len(polygon) for polygon in svg]
+    for a, b in zip(prewalls, svg):
+        np.testing.assert_allclose(a, b)
+
+
+def test_simplify_polygon():
+    square = [[0, 0], [1, 0], [2, 0], [2, 0], [2, 1], [2, 2], [0, 2], [0, 1]]
+    np.testing.assert_array_equal(simplify_polygon(square), [[0, 0], [2, 0], [2, 2], [0, 2]])
+    # A spike doubling back on itself is not on the segment between its neighbours
+    assert len(simplify_polygon([[0, 0], [2, 0], [1, 0], [1, 1]])) == 4
+
+
+def test_validate():
+    outer = [[0, 0], [10, 0], [10, 10], [0, 10]]
+    inner = [[4, 4], [6, 4], [6, 6], [4, 6]]
+    assert validate([outer, inner], [[[5, -1], [5, 5]]]) == []
+    # Checkpoint that doesn't reach the inner wall
+    assert len(validate([outer, inner], [[[5, -1], [5, 2]]])) == 1
+    # Bow tie and overlapping walls
+    assert validate([[[0, 0], [10, 10], [10, 0], [0, 10]], [[20, 20], [21, 20], [21, 21]]],
+                    [[[5, 1], [20.5, 20.1]]]) == ['wall 0 crosses itself at segments 1 and 3']
+    assert all('crosses wall 1' in problem for problem in validate([outer, [[8, 8], [12, 8], [12, 9]]],
+                                                                    [[[5, -1], [9, 8.5]]]))
+
+
+def test_build_level(level_dir):
+    with open(os.path.join(level_dir, SOURCE_FILE)) as f:
+        source = json.load(f)
+    level = build_level(level_dir)
+    assert os.path.exists(os.path.join(level_dir, COMPILED_FILE))
+    # level1 has many midpoints on straight walls
+    prewalls, _ = read_prewalls(os.path.join(level_dir, WALLS_FILE))
+    assert level.wall_array.shape[1] < 0.6 * sum(len(polygon) for polygon in prewalls)
+    np.testing.assert_array_equal(level.start, source['start'])
+    assert load_level(level_dir).wall_array.shape == level.wall_array.shape
+
+    # The simplified walls cover the same lines, so the lasers see the same distances
+    original = load_level(LEVEL1)
+    rng = np.random.default_rng(0)
+    origins = rng.uniform([300, 100], [1100, 650], (500, 2))
+    ends = origins + rng.uniform(-300, 300, (500, 2))
+    lasers = np.concatenate((origins, ends), axis=1).T
+    np.testing.assert_allclose(level.wall_index.cast(lasers)[0], original.wall_index.cast(lasers)[0], atol=1e-4)
+
+
+def test_build_errors(level_dir):
+    os.remove(os.path.join(level_dir, SOURCE_FILE))
+    with pytest.raises(LevelBuildError) as e:
+        build_level(level_dir)
+    assert len(e.value.problems) == 2
+    build_level(level_dir, start=(915, 470), start_angle=164, write=False)
+    assert not os.path.exists(os.path.join(level_dir, COMPILED_FILE))
+
+
+def test_batch_build(tmp_path_factory, level_dir):
+    tracks = tmp_path_factory.mktemp('tracks')
+    for name in ('a', 'b'):
+        shutil.copytree(level_dir, str(tracks / name))
+    os.remove(str(tracks / 'b' / CHECKPOINTS_FILE))
+    assert main([str(tracks), '--svg']) == 1
+    assert os.path.exists(str(tracks / 'a' / COMPILED_FILE))
+    assert not os.path.exists(str(tracks / 'b' / COMPILED_FILE))
@@ -0,0 +1,53 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from src import main
+from src.backends import load_backend
+
+
+def test_simulation_entry_points_skip_tensorflow():
+    code = 'import sys, src.main, src.agent, src.backends; print("tensorflow" in sys.modules)'
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.decode().strip() == 'False'
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        load_backend('no_such_backend')
+
+
+def test_benchmark_command_forwards_arguments(tmp_path):
+    output = str(tmp_path / 'results.json')
+    assert main.main(['benchmark', '--quick', 'car_act', '--output', output]) == 0
+    with open(output) as f:
+        assert json.load(f)['benchmarks']['car_act']['steps_per_s'] > 0
+
+
+def test_train_options_are_checked():
+    with pytest.raises(SystemExit):
+        main.main(['train', '--actors', '2', '--render'])
+    with pytest.raises(SystemExit):
+        main.main(['evaluate', '--no-such-option'])
+    # Keras can't save to this name, which is caught before training
+    with pytest.raises(SystemExit):
+        main.main(['train', '--episodes', '1', '--save', 'weights.h5'])
+
+
+def test_evaluate(capsys):
+    pytest.importorskip('tensorflow')
+    main.main(['evaluate', '--episodes', '2', '--max-steps', '20'])
+    report = json.loads(capsys.readouterr().out)
+    assert len(report['episodes']) == 2
+    assert all(episode['steps'] <= 20 for episode in report['episodes'])
+
+
+def test_keras_weights_round_trip(tmp_path, capsys):
+    pytest.importorskip('tensorflow')
+    path = str(tmp_path / 'weights.weights.h5')
+    main.main(['train', '--seconds', '2', '--save', path])
+    capsys.readouterr()
+    main.main(['evaluate', '--weights', path, '--episodes', '1', '--max-steps', '20'])
+    assert len(json.loads(capsys.readouterr().out)['episodes']) == 1
@@ -0,0 +1,63 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+from src.profiler import Profiler, NULL_PROFILER, HISTOGRAM_EDGES
+from src.racecar_game import Game, Controls
+
+
+def test_profiles_game_phases():
+    profiler = Profiler(window=50)
+    game = Game(init_graphics=False, profiler=profiler)
+    for _ in range(100):
+        game.act([Controls.FRONT])
+    report = json.loads(json.dumps(profiler.report()))
+
+    assert report['steps'] == 100
+    assert {'step', 'physics', 'pose', 'collision', 'checkpoint', 'lasers'} <= set(report['phases'])
+    physics = report['phases']['physics']
+    assert physics['count'] == 100
+    # Histograms cover the last window samples only
+    assert sum(physics['histogram']) == 50
+    assert len(physics['histogram']) == len(HISTOGRAM_EDGES) + 1
+    assert 0 < physics['p50_us'] <= physics['max_us']
+    # Every sense casts 10 lasers against every wall of the small level, once per step and once per reset
+    counters = report['counters']
+    casts, remainder = divmod(counters['cast_tests']['total'], 10 * game.level.wall_array.shape[1])
+    assert casts >= 100 and remainder == 0
+    assert counters['checkpoint_tests']['per_step'] >= 8
+    assert counters['wall_tests']['total'] > 0
+
+
+def test_periodic_dump():
+    output = io.StringIO()
+    game = Game(init_graphics=False, profiler=Profiler(dump_every=10, output=output))
+    for _ in range(25):
+        game.act([])
+    lines = output.getvalue().splitlines()
+    assert [json.loads(line)['steps'] for line in lines] == [10, 20]
+
+
+def test_render_phases(monkeypatch):
+    monkeypatch.setitem(os.environ, 'SDL_VIDEODRIVER', 'dummy')
+    profiler = Profiler()
+    game = Game(init_graphics=True, profiler=profiler)
+    try:
+        game.act([Controls.FRONT])
+        game.render(1 / 60)
+    except Exception as e:
+        pytest.skip('no display available: {}'.format(e))
+    finally:
+        import pygame
+        pygame.quit()
+    assert profiler.phases['render'].count == profiler.phases['flip'].count == 1
+
+
+def test_disabled_by_default():
+    game = Game(init_graphics=False)
+    assert game.profiler is NULL_PROFILER and not game.profiler.enabled
+    observation, _, _ = game.act([Controls.FRONT])
+    assert np.all(np.isfinite(observation))
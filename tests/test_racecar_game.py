@@ -0,0 +1,221 @@
+import os
+import tracemalloc
+
+import numpy as np
+import pygame
+import pytest
+from pygame.math import Vector2
+
+from src import racecar_game
+from src.collision import line_array, pairwise_params
+from src.profiler import Profiler
+from src.racecar_game import (Game, GameState, Controls, SimClock, CHECKPOINT_REWARD, CHECKPOINT_TIMEOUT, LASER_LENGTH,
+                              LASER_NAMES, MAX_VEL, OBS_LASERS, OBS_SIZE, OBS_VELOCITY, PHYSICS_DT)
+
+
+def test_headless_game_steps_without_display():
+    game = Game(init_graphics=False)
+    for _ in range(30):
+        observation, reward, done = game.act([Controls.FRONT], 1 / 60)
+    assert not pygame.display.get_init()
+    assert game.screen is None
+
+    assert observation[OBS_VELOCITY] > 0
+    assert np.all((0 <= observation[OBS_LASERS]) & (observation[OBS_LASERS] <= LASER_LENGTH))
+    assert reward in (0, 1)
+    assert not done
+
+
+def test_observation_layout():
+    game = Game(init_graphics=False)
+    buffer = game.car.observation
+    assert buffer.shape == (OBS_SIZE,) and buffer.dtype == np.float32
+    assert list(game.car.lasers) == list(LASER_NAMES)
+    assert np.all(game.car.sense()[OBS_LASERS] <= LASER_LENGTH)
+
+    observation, _, _ = game.act([Controls.FRONT], 1 / 60)
+    # Written in place every step
+    assert observation is buffer
+    assert game.act([Controls.FRONT], 1 / 60)[0] is buffer
+
+
+def test_headless_game_resets_on_timeout():
+    game = Game(init_graphics=False)
+    car = game.car
+    start = car.observation.copy()
+    for _ in range(round(CHECKPOINT_TIMEOUT / PHYSICS_DT)):
+        game.act([Controls.RIGHT], PHYSICS_DT)
+    observation, _, done = game.act([Controls.RIGHT], PHYSICS_DT)
+    assert done
+    # The car is reused and its buffer holds the first observation of the next episode
+    assert game.car is car and observation is not car.observation
+    assert not np.array_equal(observation, start)
+    np.testing.assert_array_equal(car.observation, start)
+    assert car.since_checkpoint == 0
+    assert tuple(car.pos) == tuple(game.level.start)
+
+
+def _jump_across(car, line, distance=30, dt=0.25):
+    # Put the car `distance` before the middle of a line, heading straight at it fast enough to end up well past it
+    line = np.reshape(line, 4)
+    normal = np.array([line[1] - line[3], line[2] - line[0]])
+    normal /= np.hypot(*normal)
+    car.pos = Vector2(*((line[0:2] + line[2:4]) / 2 - distance * normal))
+    car.angle = np.degrees(np.arctan2(normal[1], normal[0]))
+    car.vel = Vector2(*(normal * MAX_VEL * 0.9))
+    car.act([], dt)
+
+
+def test_fast_car_does_not_tunnel_through_walls():
+    game = Game(init_graphics=False)
+    car, level = game.car, game.level
+    # A long inner wall, with nothing but the inside of the track behind it
+    wall = level.wall_array[:, np.argmax(np.hypot(*(level.wall_array[2:4] - level.wall_array[0:2])))]
+    _jump_across(car, wall)
+    # The final pose alone is clear of the walls, only the swept area collides
+    assert np.all(np.isinf(pairwise_params(car._box_world, level.wall_array)))
+    assert car.done
+
+
+def test_fast_car_collects_checkpoint():
+    game = Game(init_graphics=False)
+    car, level = game.car, game.level
+    checkpoint = level.current_checkpoint
+    _jump_across(car, checkpoint)
+    assert np.all(np.isinf(pairwise_params(car._box_world, line_array([checkpoint]))))
+    assert car.checkpoint and car.reward == CHECKPOINT_REWARD
+    assert not np.array_equal(level.current_checkpoint, checkpoint)
+
+
+def test_distance_field_collision_matches_segments():
+    games = Game(init_graphics=False), Game(init_graphics=False, distance_field=True)
+    rng = np.random.RandomState(0)
+    dones = 0
+    for _ in range(1000):
+        action = [Controls(rng.choice(len(Controls), p=[0.7, 0.05, 0.15, 0.1]))]
+        (_, reward, done), (_, field_reward, field_done) = (game.act(action) for game in games)
+        assert (field_reward, field_done) == (reward, done)
+        dones += done
+    assert dones > 0
+
+
+def test_sim_clock():
+    clock = SimClock(physics_dt=0.01, action_repeat=3)
+    assert clock.steps() == 3
+    # Real time is spent in whole steps and the remainder carried over
+    assert [clock.steps(0.025), clock.steps(0.004), clock.steps(0.001)] == [2, 0, 1]
+    assert clock.steps(0.01) == 1
+    assert np.isclose(clock.time, 0.07)
+
+
+def test_action_repeat():
+    repeated = Game(init_graphics=False, action_repeat=3)
+    single = Game(init_graphics=False)
+    for _ in range(20):
+        observation, reward, done = repeated.act([Controls.FRONT])
+        total = sum(single.act([Controls.FRONT])[1] for _ in range(3))
+        np.testing.assert_array_equal(observation, single.car.observation)
+        assert reward == total and not done
+
+    # The timeout is in simulated seconds, so it comes after a third as many calls. The 181st step is in the 61st call
+    repeated.reset()
+    calls = 1
+    while not repeated.act([])[2]:
+        calls += 1
+    assert calls == 61
+
+
+def test_pose_does_not_allocate():
+    car = Game(init_graphics=False).car
+    car._pose(car._laser_local, car._laser_world)
+    tracemalloc.start()
+    try:
+        for _ in range(100):
+            car._pose(car._box_local, car._box_world)
+            car._pose(car._laser_local, car._laser_world)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # Scalars and views only, nothing that grows with the number of steps or lines
+    assert peak < 4096
+
+
+@pytest.fixture
+def window(monkeypatch):
+    monkeypatch.setitem(os.environ, 'SDL_VIDEODRIVER', 'dummy')
+    try:
+        game = Game(init_graphics=True)
+    except pygame.error as e:
+        pytest.skip('no display available: {}'.format(e))
+    yield game
+    pygame.quit()
+
+
+def test_dirty_rect_frames_match_full_frames(window, monkeypatch):
+    updates = []
+    monkeypatch.setattr(pygame.display, 'update', lambda rects: updates.append(rects))
+    rng = np.random.RandomState(0)
+    window.render(1 / 60)
+    for _ in range(30):
+        window.act([Controls(rng.choice(len(Controls), p=[0.7, 0.05, 0.15, 0.1]))])
+        window.render(1 / 60)
+    assert len(updates) == 30
+    # Only the car, laser hits, checkpoint and what they covered in the last frame
+    assert sum(rect.width * rect.height for rect in updates[-1]) < 0.1 * window.screen.get_width() * \
+        window.screen.get_height()
+
+    frame = pygame.surfarray.array3d(window.screen)
+    window.render(1 / 60, full=True)
+    np.testing.assert_array_equal(frame, pygame.surfarray.array3d(window.screen))
+
+
+def test_rotated_car_sprites_are_cached(window, monkeypatch):
+    sprites = window.sprites
+    assert sprites.rotated_car(10.4, True) is sprites.rotated_car(9.6, True)
+    assert sprites.rotated_car(10, True) is not sprites.rotated_car(10, False)
+    assert sprites.rotated_car(-90, True) is sprites.rotated_car(270, True)
+    monkeypatch.setattr(racecar_game, 'SPRITE_CACHE_SIZE', 4)
+    for angle in range(0, 360, 30):
+        sprites.rotated_car(angle, False)
+    assert len(sprites._rotated_cars) == 4
+
+
+def test_snapshot_and_restore_branch_identically():
+    game = Game(init_graphics=False)
+    rng = np.random.RandomState(0)
+    for _ in range(40):
+        game.act([Controls(rng.choice(len(Controls), p=[0.7, 0.05, 0.15, 0.1]))])
+    state = game.snapshot()
+    actions = [[Controls(a)] for a in rng.choice(len(Controls), 100, p=[0.7, 0.05, 0.15, 0.1])]
+    branches = []
+    for _ in range(2):
+        np.testing.assert_array_equal(game.restore(state), state.observation[0])
+        branches.append([game.act(action)[0].copy() for action in actions])
+    np.testing.assert_array_equal(branches[0], branches[1])
+
+
+def test_reset_restores_start_without_sensing():
+    profiler = Profiler()
+    game = Game(init_graphics=False, profiler=profiler)
+    start = game.car.observation.copy()
+    for _ in range(30):
+        game.act([Controls.FRONT])
+    casts = profiler.counters['cast_tests']
+    game.reset()
+    assert profiler.counters['cast_tests'] == casts
+    np.testing.assert_array_equal(game.car.observation, start)
+    assert game.car.pos == Vector2(*game.level.start) and game.car.vel == Vector2(0, 0)
+    np.testing.assert_array_equal(game.level.current_checkpoint, game.level.checkpoints[-1])
+
+
+def test_game_state_batches():
+    game = Game(init_graphics=False)
+    state = GameState.stack([game.snapshot(), game.snapshot()]).repeat(3)
+    assert len(state) == 6 and state.observation.shape == (6, OBS_SIZE)
+    assert len(state[2]) == 1 and len(state[1:4]) == 3
+    copy = state.copy()
+    copy.pos[:] = 0
+    assert np.all(state.pos[:, 0] == game.level.start[0])
+    # Snapshots can go into a preallocated batch
+    assert game.snapshot(out=copy, index=5) is copy
+    np.testing.assert_array_equal(copy.pos[5], game.level.start)
@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+import pygame
+import pytest
+
+from src import main
+from src.racecar_game import Game, Controls
+from src.recorder import Recorder, Trajectory, STEP_DTYPE, actions_of, play, rederive_observations, resimulate
+
+
+def _record(path, steps=600, chunk_size=64, action_repeat=1):
+    rng = np.random.RandomState(0)
+    game = Game(init_graphics=False, action_repeat=action_repeat, recorder=Recorder(path, chunk_size=chunk_size))
+    dones = 0
+    for _ in range(steps):
+        _, _, done = game.act([Controls(rng.choice(len(Controls), p=[0.7, 0.05, 0.15, 0.1]))])
+        dones += done
+    game.recorder.close()
+    return dones
+
+
+def test_recorded_log_round_trip(tmp_path):
+    path = str(tmp_path / 'run.traj')
+    dones = _record(path)
+    trajectory = Trajectory(path)
+    assert len(trajectory) == 600
+    assert trajectory.header['level'] == 'level1'
+    assert dones > 1 and len(trajectory.episodes) == dones + 1
+    assert trajectory.records['done'].sum() == dones
+    first = trajectory.episode(0)
+    np.testing.assert_array_equal(first['step'], np.arange(len(first)))
+    assert all(len(actions_of(record)) == 1 for record in first)
+
+
+def test_playback_reproduces_episode(tmp_path):
+    path = str(tmp_path / 'run.traj')
+    _record(path, action_repeat=3)
+    trajectory = Trajectory(path)
+    records = trajectory.episode(1)
+    rerun = resimulate(trajectory, records)
+    assert len(rerun) == len(records) and rerun['done'][-1]
+    for field in ('x', 'y', 'angle', 'reward', 'checkpoint', 'physics_steps', 'observation'):
+        np.testing.assert_array_equal(rerun[field], records[field])
+    # Poses are stored in single precision, so sensing again at them is only nearly exact
+    np.testing.assert_allclose(rederive_observations(trajectory, records), records['observation'], atol=0.01)
+
+
+def test_partial_record_is_ignored(tmp_path):
+    path = str(tmp_path / 'run.traj')
+    _record(path, steps=10)
+    with open(path, 'ab') as f:
+        f.write(b'\0' * (STEP_DTYPE.itemsize // 2))
+    assert len(Trajectory(path)) == 10
+    with open(path, 'r+b') as f:
+        f.write(b'garbage!')
+    with pytest.raises(ValueError):
+        Trajectory(path)
+
+
+def test_in_memory_recorder():
+    recorder = Recorder(chunk_size=4)
+    game = Game(init_graphics=False, recorder=recorder)
+    for _ in range(10):
+        game.act([Controls.FRONT])
+    records = recorder.to_array()
+    assert len(records) == 10
+    assert np.all(np.diff(records['x']) != 0)
+
+
+def test_restore_while_recording():
+    recorder = Recorder()
+    game = Game(init_graphics=False, recorder=recorder)
+    game.act([Controls.FRONT])
+    state = game.snapshot()
+    game.act([Controls.FRONT])
+    with pytest.raises(ValueError):
+        game.restore(state)
+    # Restoring the start state is a reset, and starts a new episode
+    game.restore(game._start_state)
+    game.act([Controls.FRONT])
+    np.testing.assert_array_equal(recorder.to_array()['episode'], [0, 0, 1])
+
+
+def test_replay_check_command(tmp_path, capsys):
+    path = str(tmp_path / 'run.traj')
+    _record(path, steps=300)
+    capsys.readouterr()
+    assert main.main(['replay', path, '--check']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert sum(episode['steps'] for episode in report) == 300
+    assert all(episode['resimulated'] for episode in report)
+
+
+def test_play_renders_records(tmp_path, monkeypatch):
+    monkeypatch.setitem(os.environ, 'SDL_VIDEODRIVER', 'dummy')
+    path = str(tmp_path / 'run.traj')
+    _record(path, steps=20)
+    trajectory = Trajectory(path)
+    try:
+        assert play(trajectory, trajectory.records, fps=1000)
+    except pygame.error as e:
+        pytest.skip('no display available: {}'.format(e))
@@ -0,0 +1,76 @@
+import numpy as np
+
+from src.replay import ReplayBuffer, PrioritizedReplayBuffer, SumTree
+
+
+def test_ring_buffer_overwrites_oldest():
+    buffer = ReplayBuffer(4, 3)
+    for i in range(6):
+        buffer.append(np.full((1, 3), i), i, i / 10, np.full(3, i + 1), i == 5)
+    assert len(buffer) == 4
+    np.testing.assert_array_equal(buffer.actions, [4, 5, 2, 3])
+    np.testing.assert_array_equal(buffer.states[:, 0], [4, 5, 2, 3])
+    np.testing.assert_array_equal(buffer.dones, [False, True, False, False])
+
+
+def test_sample_returns_contiguous_batches():
+    buffer = ReplayBuffer(100, (2, 5), seed=0)
+    n = 30
+    states = np.arange(n * 10, dtype=np.float32).reshape(n, 2, 5)
+    buffer.extend(states, np.arange(n), np.ones(n), states + 1, np.zeros(n, dtype=bool))
+    states, actions, rewards, next_states, dones = buffer.sample(16)
+    assert states.shape == next_states.shape == (16, 2, 5)
+    assert states.flags['C_CONTIGUOUS']
+    assert actions.shape == rewards.shape == dones.shape == (16,)
+    assert np.all(actions < n)
+    np.testing.assert_array_equal(states[:, 0, 0], actions * 10)
+    np.testing.assert_array_equal(next_states, states + 1)
+
+
+def test_extend_wraps_around():
+    buffer = ReplayBuffer(5, 1)
+    buffer.extend(np.zeros((3, 1)), [0, 1, 2], np.zeros(3), np.zeros((3, 1)), np.zeros(3))
+    indices = buffer.extend(np.zeros((4, 1)), [3, 4, 5, 6], np.zeros(4), np.zeros((4, 1)), np.zeros(4))
+    np.testing.assert_array_equal(indices, [3, 4, 0, 1])
+    np.testing.assert_array_equal(buffer.actions, [5, 6, 2, 3, 4])
+    assert len(buffer) == 5 and buffer.index == 2
+
+
+def test_memmap_storage(tmp_path):
+    buffer = ReplayBuffer(1000, 11, memmap_dir=str(tmp_path))
+    buffer.append(np.ones(11), 2, 1.0, np.ones(11), True)
+    buffer.flush()
+    assert isinstance(buffer.states, np.memmap)
+    stored = np.load(str(tmp_path / 'actions.npy'), mmap_mode='r')
+    assert stored.shape == (1000,) and stored[0] == 2
+
+
+def test_sum_tree():
+    tree = SumTree(5)
+    tree.update(np.arange(5), [1., 0., 2., 3., 4.])
+    assert tree.total == 10
+    np.testing.assert_array_equal(tree.find([0, 0.99, 1, 2.5, 3, 5.9, 6, 9.99]), [0, 0, 2, 2, 3, 3, 4, 4])
+    tree.update([4, 0], [0., 5.])
+    assert tree.total == 10
+    np.testing.assert_array_equal(tree[[0, 4]], [5, 0])
+
+
+def test_prioritized_sampling_follows_priorities():
+    buffer = PrioritizedReplayBuffer(64, 1, alpha=1, beta=0.5, beta_steps=10, priority_eps=0, seed=0)
+    buffer.extend(np.zeros((10, 1)), np.arange(10), np.zeros(10), np.zeros((10, 1)), np.zeros(10))
+    # New transitions all share the maximum priority
+    np.testing.assert_array_equal(buffer.tree[np.arange(10)], np.ones(10))
+
+    errors = np.full(10, 0.01)
+    errors[3] = 9.91
+    buffer.update_priorities(np.arange(10), errors)
+    (states, actions, *_), indices, weights = buffer.sample_weighted(1000)
+    np.testing.assert_array_equal(actions, indices)
+    assert 0.95 < np.mean(actions == 3) < 1
+    # Rare transitions get the largest weights
+    assert weights.max() == 1 and np.all(weights[actions == 3] < weights[actions != 3].min())
+    assert buffer.beta > 0.5
+
+    # Transitions appended afterwards get the new maximum priority
+    buffer.append(np.zeros(1), 10, 0, np.zeros(1), True)
+    assert buffer.tree[10] == buffer.max_priority == 9.91
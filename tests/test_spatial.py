@@ -0,0 +1,95 @@
+import numpy as np
+
+from src.collision import line_array, nearest_hits, pairwise_params
+from src.racecar_game import Game
+from src.spatial import DistanceField, WallGrid
+
+
+def _random_lines(rng, n, low, high, length):
+    start = rng.uniform(low, high, (2, n))
+    angle = rng.uniform(0, 2 * np.pi, n)
+    return np.vstack((start, start + length * np.vstack((np.cos(angle), np.sin(angle)))))
+
+
+def test_cast_matches_brute_force_on_level():
+    walls = Game(init_graphics=False).level.wall_array
+    grid = WallGrid(walls, brute_force_walls=0)
+    lasers = _random_lines(np.random.RandomState(0), 500, -50, 1400, 300)
+
+    t, index = grid.cast(lasers)
+    expected_t, expected_index = nearest_hits(lasers, walls)
+    np.testing.assert_allclose(t, expected_t)
+    hit = ~np.isinf(expected_t)
+    assert hit.any()
+    # Rays through a wall corner may report either wall
+    assert np.mean(index[hit] == expected_index[hit]) > 0.99
+
+
+def test_cast_long_walls_and_small_cells():
+    rng = np.random.RandomState(1)
+    walls = _random_lines(rng, 200, 0, 1000, 400)
+    lines = _random_lines(rng, 300, 0, 1000, 250)
+    for cell_size in (10, 64, 5000):
+        t, _ = WallGrid(walls, cell_size, brute_force_walls=0).cast(lines)
+        np.testing.assert_allclose(t, nearest_hits(lines, walls)[0])
+
+
+def test_brute_force_for_small_levels():
+    walls = Game(init_graphics=False).level.wall_array
+    assert WallGrid(walls).brute_force
+    assert not WallGrid(walls, brute_force_walls=0).brute_force
+    lasers = _random_lines(np.random.RandomState(3), 50, 0, 1366, 300)
+    np.testing.assert_allclose(WallGrid(walls).cast(lasers)[0], WallGrid(walls, brute_force_walls=0).cast(lasers)[0])
+
+
+def test_query_box_returns_all_crossing_walls():
+    rng = np.random.RandomState(2)
+    walls = _random_lines(rng, 300, 0, 1000, 60)
+    grid = WallGrid(walls, 32)
+    for _ in range(50):
+        x, y = rng.uniform(-50, 1000, 2)
+        box = line_array([[(x, y), (x + 30, y)], [(x + 30, y), (x + 30, y + 15)],
+                          [(x + 30, y + 15), (x, y + 15)], [(x, y + 15), (x, y)]])
+        crossing = np.flatnonzero(np.any(~np.isinf(pairwise_params(box, walls)), axis=0))
+        nearby = grid.query_lines(box)
+        assert set(crossing) <= set(nearby)
+        assert len(nearby) < walls.shape[1]
+
+
+def test_box_candidates_for_boxes_larger_than_cells():
+    rng = np.random.RandomState(4)
+    walls = _random_lines(rng, 300, 0, 1000, 60)
+    grid = WallGrid(walls, 32)
+    lo = rng.uniform(-50, 1000, (2, 40))
+    hi = lo + rng.uniform(1, 150, (2, 40))
+    candidates = grid.box_candidates(lo, hi)
+    for i in range(40):
+        assert set(grid.query_box(*lo[:, i], *hi[:, i])) <= set(candidates[i])
+
+
+def test_empty_grid():
+    grid = WallGrid(np.zeros((4, 0)), brute_force_walls=0)
+    t, index = grid.cast(line_array([[(0, 0), (10, 10)]]))
+    assert np.isinf(t[0]) and index[0] == -1
+    assert grid.query_box(0, 0, 10, 10).size == 0
+
+
+def _square(lo, hi):
+    corners = [(lo, lo), (hi, lo), (hi, hi), (lo, hi)]
+    return [(corners[i - 1], corners[i]) for i in range(4)]
+
+
+def test_distance_field_of_square_track():
+    # The track is the ring between two squares. Points outside the field get the distance at its edge
+    field = DistanceField(line_array(_square(10, 90) + _square(40, 60)), (100, 100), cell_size=1)
+    x, y = np.array([20, 25, 50, 5, 150]), np.array([50, 15, 50, 5, 50])
+    np.testing.assert_allclose(field.sample(x, y), [10, 5, -10, -5 * np.sqrt(2), -10], atol=1e-4)
+    # Between samples
+    np.testing.assert_allclose(field.sample(20.5, 50.), 10.5, atol=1e-4)
+
+    on_track, crossing = line_array([((20, 20), (30, 20)), ((20, 50), (45, 50))]).T
+    np.testing.assert_allclose(field.clearance(on_track[:, None]), [10], atol=1e-4)
+    assert field.clearance(crossing[:, None])[0] < 0
+
+    restored = DistanceField.from_arrays(field.to_arrays())
+    np.testing.assert_array_equal(restored.sample(x, y), field.sample(x, y))
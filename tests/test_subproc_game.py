@@ -0,0 +1,44 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from src import subproc_game
+from src.racecar_game import Game, Controls, OBS_SIZE
+from src.subproc_game import SubprocGame
+
+
+def test_matches_games_in_this_process():
+    n = 3
+    games = [Game(init_graphics=False) for _ in range(n)]
+    rng = np.random.RandomState(0)
+    with SubprocGame(n, workers=2) as runner:
+        observations = runner.reset()
+        assert observations.shape == (n, OBS_SIZE)
+        for _ in range(200):
+            actions = rng.choice(len(Controls), n, p=[0.7, 0.05, 0.15, 0.1])
+            actions[0] = -1
+            observations, rewards, dones = runner.act(actions, 1 / 60)
+
+            for i, game in enumerate(games):
+                expected, reward, done = game.act([Controls(actions[i])] if actions[i] >= 0 else [], 1 / 60)
+                np.testing.assert_allclose(observations[i], expected, rtol=1e-6)
+                assert rewards[i] == reward
+                assert dones[i] == done
+    assert runner.closed
+
+
+def test_failed_start_cleans_up(monkeypatch):
+    created = []
+
+    class Recorded(subproc_game._SharedArrays):
+        def __init__(self, specs, name=None):
+            super().__init__(specs, name)
+            created.append(self.shm.name)
+
+    monkeypatch.setattr(subproc_game, '_SharedArrays', Recorded)
+    # The workers can't load the level, so the first reset fails
+    with pytest.raises((EOFError, OSError)):
+        SubprocGame(2, workers=2, level='no_such_level')
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=created[0])
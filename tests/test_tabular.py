@@ -0,0 +1,109 @@
+import json
+
+import numpy as np
+import pytest
+
+from src import main
+from src.actor_learner import ActorLearner
+from src.backends import load_backend
+from src.racecar_game import Controls, OBS_LASERS, OBS_SIZE, OBS_VELOCITY
+from src.tabular import Discretizer, TabularAgent
+
+
+def _observation(velocity, lasers):
+    observation = np.zeros(OBS_SIZE, dtype=np.float32)
+    observation[OBS_VELOCITY] = velocity
+    observation[OBS_LASERS] = lasers
+    return observation
+
+
+def test_discretizer_bins_like_digits():
+    discretizer = Discretizer(laser_edges=(10, 100), velocity_edges=(50,))
+    assert discretizer.states == 2 * 3 ** 10 and not discretizer.hashed
+    lasers = np.zeros(10)
+    lasers[[0, 2]] = 50, 300
+    rows = discretizer([_observation(0, lasers), _observation(60, np.zeros(10)), _observation(60, lasers)])
+    np.testing.assert_array_equal(rows, [1 + 2 * 9, 3 ** 10, 3 ** 10 + 1 + 2 * 9])
+
+
+def test_hashed_table_size():
+    discretizer = Discretizer(table_size=1000)
+    assert discretizer.hashed and discretizer.rows == 1024
+    rows = discretizer(np.random.RandomState(0).uniform(0, 300, (1000, OBS_SIZE)))
+    assert rows.min() >= 0 and rows.max() < 1024
+    # Spread over the table instead of piling up in a few rows
+    assert len(np.unique(rows)) > 500
+
+
+def test_td_updates_learn_the_rewarded_action():
+    agent = TabularAgent(OBS_SIZE, len(Controls), seed=0)
+    states = np.tile(_observation(100, np.full(10, 50)), (256, 1))
+    actions = np.arange(256) % len(Controls)
+    rewards = (actions == Controls.LEFT.value).astype(np.float32)
+    # Each batch moves every entry by one learning rate step, whatever the number of duplicates
+    for _ in range(100):
+        agent.update(states, actions, rewards, states, np.ones(256, dtype=bool))
+    agent.epsilon = 0
+    assert agent.act(states[0]) == Controls.LEFT.value
+    np.testing.assert_array_equal(agent.act_batch(states[:4]), [Controls.LEFT.value] * 4)
+    np.testing.assert_allclose(agent.policy(states[0])[0, Controls.LEFT.value], 1, atol=1e-3)
+
+
+def test_published_table_is_shared():
+    agent = TabularAgent(OBS_SIZE, len(Controls), table_size=4096)
+    policy = agent.policy.copy()
+    policy.set_weights(agent.get_weights())
+    assert policy.table is agent.table
+    states = np.tile(_observation(100, np.full(10, 50)), (8, 1))
+    agent.update(states, np.zeros(8, dtype=np.int64), np.ones(8, dtype=np.float32), states, np.ones(8, dtype=bool))
+    np.testing.assert_allclose(policy(states[0])[0, 0], agent.learning_rate)
+    # The scratch tables for averaging are clean again
+    assert not agent._sums.any() and not agent._counts.any()
+
+
+def test_replay_and_exploration():
+    agent = TabularAgent(OBS_SIZE, len(Controls), seed=0)
+    rng = np.random.RandomState(0)
+    n = 500
+    agent.memory.extend(rng.uniform(0, 300, (n, OBS_SIZE)), rng.randint(4, size=n), rng.rand(n),
+                        rng.uniform(0, 300, (n, OBS_SIZE)), rng.rand(n) < 0.1)
+    agent.replay(64)
+    assert agent.epsilon < 1 and np.any(agent.table != 0)
+    agent.epsilon = 1
+    actions = agent.act_batch(rng.uniform(0, 300, (1000, OBS_SIZE)))
+    assert set(actions) == set(range(len(Controls)))
+
+
+def test_save_and_load(tmp_path, capsys):
+    path = str(tmp_path / 'table.npz')
+    agent = TabularAgent(OBS_SIZE, len(Controls), table_size=4096)
+    agent.table[:] = np.random.RandomState(0).rand(*agent.table.shape)
+    agent.save(path)
+    loaded = TabularAgent(OBS_SIZE, len(Controls), table_size=4096)
+    loaded.load(path)
+    np.testing.assert_array_equal(loaded.table, agent.table)
+    with pytest.raises(ValueError):
+        TabularAgent(OBS_SIZE, len(Controls), table_size=1024).load(path)
+    # Same hashed table shape, but binned differently
+    other_bins = TabularAgent(OBS_SIZE, len(Controls), laser_edges=(30, 80), table_size=4096)
+    assert other_bins.table.shape == agent.table.shape
+    with pytest.raises(ValueError):
+        other_bins.load(path)
+    # The CLI sets the agent up with the saved bins
+    other_bins.save(path)
+    capsys.readouterr()
+    main.main(['evaluate', '--backend', 'tabular', '--weights', path, '--episodes', '1', '--max-steps', '5'])
+    assert len(json.loads(capsys.readouterr().out)['episodes']) == 1
+
+
+def test_registered_backend_trains_without_tensorflow(capsys):
+    assert load_backend('tabular') is TabularAgent
+    agent = TabularAgent(OBS_SIZE, len(Controls), memory_size=10000, seed=0)
+    stats = ActorLearner(agent, actors=2, batch_size=64, publish_interval=2, action_repeat=4, seed=0).run(
+        seconds=60, replays=20)
+    assert stats['replays'] >= 20 and stats['weights_version'] >= 10
+    assert np.any(agent.table != 0)
+
+    capsys.readouterr()
+    main.main(['train', '--backend', 'tabular', '--envs', '16', '--steps', '20', '--batch-size', '64'])
+    assert json.loads(capsys.readouterr().out)['epsilon'] < 1
@@ -0,0 +1,107 @@
+import numpy as np
+
+from src.racecar_game import Game, Controls, OBS_SIZE
+from src.vec_game import VecGame
+
+
+def test_matches_single_car_game():
+    game = Game(init_graphics=False)
+    vec = VecGame(3)
+    rng = np.random.RandomState(0)
+    dt = 1 / 60
+    dones = 0
+    for _ in range(400):
+        action = rng.choice(len(Controls), p=[0.7, 0.05, 0.15, 0.1])
+        expected, reward, expected_done = game.act([Controls(action)], dt)
+        observations, rewards, done = vec.act(np.full(3, action), dt)
+
+        for row in observations:
+            np.testing.assert_allclose(row, expected, rtol=1e-5, atol=1e-3)
+        assert np.all(rewards == reward)
+        assert np.all(done == expected_done)
+        dones += done[0]
+    assert dones > 0
+
+
+def test_independent_cars_and_reset():
+    vec = VecGame(2)
+    actions = np.zeros((2, len(Controls)), dtype=bool)
+    actions[0, Controls.FRONT.value] = True
+    for _ in range(10):
+        observations, _, dones = vec.act(actions, 1 / 60)
+    assert observations.shape == (2, OBS_SIZE)
+    assert observations.dtype == np.float32
+    assert observations[0, 0] > 0 and observations[1, 0] == 0
+    assert not np.any(dones)
+
+    vec.reset(np.array([True, False]))
+    assert np.all(vec.pos[0] == vec.level.start)
+    assert np.all(vec.vel[0] == 0)
+
+
+def test_matches_single_car_game_with_coarse_steps():
+    # Swept collision keeps both paths in agreement when cars move further than their own length per step
+    game = Game(init_graphics=False, physics_dt=0.15)
+    vec = VecGame(1, physics_dt=0.15)
+    rng = np.random.RandomState(1)
+    rewards = dones = 0
+    for _ in range(300):
+        action = rng.choice(len(Controls), p=[0.7, 0.05, 0.15, 0.1])
+        expected, reward, expected_done = game.act([Controls(action)])
+        observations, reward_vec, done = vec.act([action])
+        np.testing.assert_allclose(observations[0], expected, rtol=1e-5, atol=1e-2)
+        assert reward_vec[0] == reward and done[0] == expected_done
+        rewards += reward
+        dones += done[0]
+    assert rewards > 0 and dones > 0
+
+
+def test_action_repeat_matches_single_car_game():
+    game = Game(init_graphics=False, action_repeat=4)
+    vec = VecGame(4, action_repeat=4)
+    rng = np.random.RandomState(2)
+    dones = 0
+    for _ in range(150):
+        action = rng.choice(len(Controls), p=[0.7, 0.05, 0.15, 0.1])
+        expected, reward, expected_done = game.act([Controls(action)])
+        observations, rewards, done = vec.act(np.full(4, action))
+        for row in observations:
+            np.testing.assert_allclose(row, expected, rtol=1e-5, atol=1e-3)
+        assert np.all(rewards == reward) and np.all(done == expected_done)
+        dones += done[0]
+    assert dones > 0
+
+
+def test_distance_field_matches_segments():
+    vecs = VecGame(64), VecGame(64, distance_field=True)
+    rng = np.random.RandomState(0)
+    dones = 0
+    for _ in range(200):
+        actions = rng.choice(len(Controls), 64, p=[0.7, 0.05, 0.15, 0.1])
+        (_, rewards, done), (_, field_rewards, field_done) = (vec.act(actions) for vec in vecs)
+        np.testing.assert_array_equal(field_done, done)
+        np.testing.assert_array_equal(field_rewards, rewards)
+        dones += done.sum()
+    assert dones > 0
+
+
+def test_branch_rollouts_from_game_snapshot():
+    game = Game(init_graphics=False)
+    for _ in range(60):
+        game.act([Controls.FRONT])
+    state = game.snapshot()
+    vec = VecGame(8)
+    observations = vec.restore(state)
+    assert observations.shape == (8, OBS_SIZE)
+    np.testing.assert_array_equal(observations[3], game.car.observation)
+
+    for _ in range(30):
+        expected, reward, done = game.act([Controls.FRONT, Controls.LEFT])
+        observations, rewards, dones = vec.act(np.tile([[1, 0, 1, 0]], (8, 1)))
+        for row in observations:
+            np.testing.assert_allclose(row, expected, rtol=1e-5, atol=1e-3)
+        assert np.all(rewards == reward) and np.all(dones == done)
+
+    snapshot = vec.snapshot()
+    assert len(snapshot) == 8
+    np.testing.assert_allclose(snapshot.observation, observations, rtol=1e-5, atol=1e-3)